@@ -0,0 +1 @@
+"""Offline benchmarks of the connectors. Run with python -m benchmarks"""
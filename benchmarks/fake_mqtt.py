@@ -0,0 +1,65 @@
+"""In-process stand-in for the ThingsBoard gateway MQTT client"""
+import time
+
+from paho.mqtt.client import MQTT_ERR_SUCCESS
+from tb_device_mqtt import TBPublishInfo
+
+from serialization import loads
+
+
+class FakeMessageInfo:
+    """Publish result which is acknowledged ack_delay seconds after publishing"""
+
+    def __init__(self, ack_delay: float):
+        self.rc = MQTT_ERR_SUCCESS
+        self._acked_at = time.monotonic() + ack_delay
+
+    def is_published(self) -> bool:
+        return time.monotonic() >= self._acked_at
+
+    def wait_for_publish(self, timeout: float | None = None):
+        pass
+
+
+class FakePahoClient:
+    """Counts gateway payloads, their size and telemetry messages in them"""
+
+    def __init__(self, ack_delay: float = 0.0):
+        self.ack_delay = ack_delay
+        self.payloads = 0
+        self.bytes = 0
+        self.messages = 0
+
+    def publish(self, topic: str, payload: bytes | str, qos: int = 0, retain: bool = False) -> FakeMessageInfo:
+        self.payloads += 1
+        self.bytes += len(payload)
+        self.messages += sum(len(device_messages) for device_messages in loads(payload).values())
+        return FakeMessageInfo(self.ack_delay)
+
+
+class FakeTBPublishInfo:
+
+    def rc(self) -> int:
+        return TBPublishInfo.TB_ERR_SUCCESS
+
+
+class FakeGatewayClient:
+    """Subset of TBGatewayMqttClient used by CubaMqttClient. Always connected"""
+
+    def __init__(self, ack_delay: float = 0.0):
+        self._client = FakePahoClient(ack_delay)
+
+    def connect(self):
+        pass
+
+    def is_connected(self) -> bool:
+        return True
+
+    def gw_send_telemetry(self, device_name: str, telemetry: dict | list) -> FakeTBPublishInfo:
+        self._client.messages += len(telemetry) if isinstance(telemetry, list) else 1
+        self._client.payloads += 1
+        return FakeTBPublishInfo()
+
+    @property
+    def messages(self) -> int:
+        return self._client.messages
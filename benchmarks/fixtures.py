@@ -0,0 +1,240 @@
+"""Synthetic or recorded responses of Wialon and CityPoint APIs for a fleet of configurable size"""
+import os
+import random
+import time
+from datetime import datetime, timezone
+
+import jwt
+
+from serialization import loads
+
+
+# Wialon and CityPoint ids share cars table, so synthetic fleets use disjoint ranges
+WIALON_FIRST_ID = 10_000_000
+CITY_POINT_FIRST_ID = 1
+
+# CityPoint sensor ids mapped to channels by connectors.sensor_mapping.DEFAULT_SENSOR_CHANNELS
+CITY_POINT_SENSORS = [(1, 'Ignition', 0, 1), (41, 'CAN speed', 0, 2), (100, 'Fuel level', 100, 3), (104, 'Light', 0, 1)]
+
+
+def utc_date(ts: float) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+class FleetFixtures:
+    """
+    Responses for a fleet of `units` units. Positions of change_ratio of the units change between polls,
+    so the delta telemetry cache publishes them.
+    A response is read from recorded_dir/<name>.json instead when the file exists.
+    """
+
+    def __init__(self, units: int, seed: int = 1, change_ratio: float = 1.0, recorded_dir: str | None = None):
+        self.units = units
+        self.change_ratio = change_ratio
+        self.recorded_dir = recorded_dir
+        self._random = random.Random(seed)
+        self._positions = [(55 + self._random.random(), 37 + self._random.random()) for _ in range(units)]
+        self._recorded: dict[str, dict] = {}
+
+    def recorded(self, name: str) -> dict | None:
+        """
+        Get recorded response
+        :param name: fixture name, e.g. wialon_units
+        :return: None if there is no recording
+        """
+        if self.recorded_dir is None:
+            return None
+        if name not in self._recorded:
+            path = os.path.join(self.recorded_dir, f'{name}.json')
+            if not os.path.exists(path):
+                return None
+            with open(path, 'rb') as file:
+                self._recorded[name] = loads(file.read())
+        return self._recorded[name]
+
+    def move(self):
+        """
+        Move change_ratio of the units
+        :return:
+        """
+        for index in self._random.sample(range(self.units), int(self.units * self.change_ratio)):
+            lat, lon = self._positions[index]
+            self._positions[index] = (lat + self._random.uniform(-0.001, 0.001), lon + self._random.uniform(-0.001, 0.001))
+
+    def _position(self, index: int) -> tuple[float, float, int]:
+        lat, lon = self._positions[index]
+        return round(lat, 6), round(lon, 6), self._random.randint(0, 90)
+
+    # Wialon
+
+    def wialon_login(self) -> dict:
+        return {'eid': 'benchmark-session', 'user': {'id': 1}}
+
+    def wialon_units(self) -> dict:
+        """core/search_items with flags 8388609: units with custom fields"""
+        if recorded := self.recorded('wialon_units'):
+            return recorded
+        items = []
+        for index in range(self.units):
+            items.append({
+                'id': WIALON_FIRST_ID + index,
+                'nm': f'МГ-{index % 1000} unit {index}',
+                'pflds': {
+                    '1': {'id': 1, 'n': 'vehicle_type', 'v': f'department {index % 20}'},
+                    '2': {'id': 2, 'n': 'brand', 'v': 'KAMAZ'},
+                    '3': {'id': 3, 'n': 'color', 'v': f'А{index:06d}'},
+                }
+            })
+        return {'searchSpec': {}, 'dataFlags': 8388609, 'totalItemsCount': len(items), 'items': items}
+
+    def _wialon_message(self, index: int, ts: int) -> dict:
+        lat, lon, speed = self._position(index)
+        return {
+            't': ts,
+            'f': 1,
+            'tp': 'ud',
+            'pos': {'y': lat, 'x': lon, 's': speed, 'c': 0, 'z': 150, 'sc': 12},
+            'i': 0,
+            'lc': 0,
+            'rt': ts,
+            'p': {'io_239': speed > 0, 'pwr_ext': 27.6}
+        }
+
+    def wialon_states(self) -> dict:
+        """core/search_items with flags 15729697: units with the last message"""
+        if recorded := self.recorded('wialon_states'):
+            return recorded
+        self.move()
+        ts = int(time.time())
+        items = [
+            {'id': WIALON_FIRST_ID + index, 'nm': f'unit {index}', 'lmsg': self._wialon_message(index, ts)}
+            for index in range(self.units)
+        ]
+        return {'searchSpec': {}, 'dataFlags': 15729697, 'totalItemsCount': len(items), 'items': items}
+
+    def wialon_counters(self) -> dict:
+        """core/search_items with flags 8193: mileage and engine hours counters"""
+        if recorded := self.recorded('wialon_counters'):
+            return recorded
+        items = [
+            {'id': WIALON_FIRST_ID + index, 'cnm': 10000 + index, 'cneh': 1000 + index / 10}
+            for index in range(self.units)
+        ]
+        return {'searchSpec': {}, 'dataFlags': 8193, 'totalItemsCount': len(items), 'items': items}
+
+    def wialon_update_data_flags(self, item_ids: list[int]) -> list[dict]:
+        return [{'i': item_id, 'd': None, 'f': 8225} for item_id in item_ids]
+
+    def wialon_avl_events(self, events: int) -> dict:
+        """avl_evts: position updates of `events` units"""
+        if recorded := self.recorded('wialon_avl_events'):
+            return recorded
+        ts = int(time.time())
+        indexes = self._random.sample(range(self.units), min(events, self.units))
+        self.move()
+        return {
+            'tm': ts,
+            'events': [
+                {'i': WIALON_FIRST_ID + index, 't': 'm', 'd': self._wialon_message(index, ts)}
+                for index in indexes
+            ]
+        }
+
+    # CityPoint
+
+    def city_point_token(self) -> dict:
+        return {
+            'token_type': 'Bearer',
+            'expires_in': 86400,
+            'access_token': jwt.encode({'user_id': 1}, 'benchmark', algorithm='HS256'),
+            'refresh_token': 'benchmark'
+        }
+
+    def city_point_cars(self) -> dict:
+        """/cars: car list"""
+        if recorded := self.recorded('city_point_cars'):
+            return recorded
+        return {'data': [
+            {
+                'type': 'car',
+                'id': str(CITY_POINT_FIRST_ID + index),
+                'attributes': {'RegNumber': f'В{index:06d}', 'Model': 'MAZ', 'IsHidden': 0}
+            }
+            for index in range(self.units)
+        ]}
+
+    def city_point_states(self) -> dict:
+        """/cars/states: current states with sensors"""
+        if recorded := self.recorded('city_point_states'):
+            return recorded
+        self.move()
+        now = utc_date(time.time())
+        data = []
+        for index in range(self.units):
+            lat, lon, speed = self._position(index)
+            data.append({
+                'type': 'carState',
+                'id': str(CITY_POINT_FIRST_ID + index),
+                'attributes': {
+                    'Lon': lon,
+                    'Lat': lat,
+                    'Velocity': speed,
+                    'RecordDate': now,
+                    'LattestGpsDate': now,
+                    'LattestConnectionTime': now,
+                    'Sensors': [
+                        {'id': 1, 'value': int(speed > 0), 'calibration': None},
+                        {'id': 41, 'value': speed, 'calibration': None},
+                        {'id': 100, 'value': round(self._random.uniform(20, 400), 1), 'calibration': None},
+                        {'id': 104, 'value': 0, 'calibration': None},
+                    ]
+                }
+            })
+        return {'data': data}
+
+    def city_point_sensors(self) -> dict:
+        """/sensors: sensor dictionary"""
+        if recorded := self.recorded('city_point_sensors'):
+            return recorded
+        return {'data': [
+            {
+                'type': 'sensor',
+                'id': str(sensor_id),
+                'attributes': {'SensorName': name, 'Destination': destination, 'SensorType': sensor_type}
+            }
+            for sensor_id, name, destination, sensor_type in CITY_POINT_SENSORS
+        ]}
+
+    def city_point_notifications(self, count: int = 10) -> dict:
+        """/notifications: latest alarms with drivers"""
+        if recorded := self.recorded('city_point_notifications'):
+            return recorded
+        now = utc_date(time.time())
+        data, included = [], []
+        for _ in range(count):
+            index = self._random.randrange(self.units)
+            lat, lon, _ = self._position(index)
+            notification_id = self._random.randrange(1, 2 ** 31)
+            data.append({
+                'type': 'notification',
+                'id': str(notification_id),
+                'attributes': {
+                    'Title': 'Speeding',
+                    'Message': '<b>Speed limit exceeded</b>\\Zone',
+                    'Level': self._random.randint(1, 7),
+                    'Latitude': lat,
+                    'Longitude': lon,
+                    'RecordDate': now,
+                    'DateOfCreation': now
+                },
+                'relationships': {
+                    'Car': {'data': {'type': 'car', 'id': str(CITY_POINT_FIRST_ID + index)}},
+                    'Driver': {'data': {'type': 'driver', 'id': str(notification_id)}}
+                }
+            })
+            included.append({
+                'type': 'driver',
+                'id': str(notification_id),
+                'attributes': {'FIO': {'FirstName': 'Ivan', 'LastName': 'Ivanov'}}
+            })
+        return {'data': data, 'included': included}
@@ -0,0 +1,309 @@
+"""
+Benchmark of one connector end to end: monitoring source against the stub server, CubaMqttClient
+publishing to the fake gateway and ORM classes writing to a scratch Postgres database.
+Prints JSON report as the last line of stdout. Started by `python -m benchmarks` in a fresh process per run,
+so peak RSS belongs to one connector and one fleet size.
+"""
+import argparse
+import asyncio
+import os
+import resource
+import sys
+import time
+
+from sqlalchemy import make_url
+
+
+def percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(q * (len(ordered) - 1)))]
+
+
+class StageStats:
+    """Cycles of one stage: latency of every cycle and telemetry messages published by them"""
+
+    def __init__(self):
+        self.latencies: list[float] = []
+        self.seconds = 0.0
+        self.messages = 0
+        self.units = 0
+
+    def report(self) -> dict:
+        report = {
+            'cycles': len(self.latencies),
+            'seconds': round(self.seconds, 4),
+            'messages': self.messages,
+            'units': self.units,
+            'msg_per_s': round(self.messages / self.seconds, 1) if self.seconds else 0.0,
+        }
+        if self.latencies:
+            report.update({
+                'p50_ms': round(percentile(self.latencies, 0.5) * 1000, 2),
+                'p95_ms': round(percentile(self.latencies, 0.95) * 1000, 2),
+                'max_ms': round(max(self.latencies) * 1000, 2),
+            })
+        return report
+
+
+class ConnectorBenchmark:
+    """Runs stages of one connector and collects StageStats"""
+
+    def __init__(self, args: argparse.Namespace, base_url: str):
+        # Project modules read configuration from environment on import
+        from benchmarks.fake_mqtt import FakeGatewayClient
+        from database.backlog import TelemetryBacklog
+        from database.car_registry import CarRegistry
+        from destinations.cuba_mqtt_client import CubaMqttClient
+        from monitoring_source.http_client import AsyncHttpClient
+
+        self.args = args
+        self.base_url = base_url
+        self.gateway = FakeGatewayClient(ack_delay=args.ack_delay)
+        self.registry = CarRegistry()
+        self.backlog = TelemetryBacklog()
+        self.destination = CubaMqttClient(
+            self.gateway,
+            backlog=self.backlog,
+            registry=self.registry,
+            publish_timeout=max(30.0, args.ack_delay * 10)
+        )
+        self.http_client = AsyncHttpClient()
+        self.stages: dict[str, StageStats] = {}
+        self.poll_samples: dict[str, list[tuple[float, int]]] = {}
+
+    def record_polls(self, connector):
+        """
+        Collect every poll cycle reported by the connector
+        :param connector: AbstractConnector
+        :return:
+        """
+        observe_poll = connector.observe_poll
+
+        def observe(poll: str, started: float, units: int):
+            self.poll_samples.setdefault(poll, []).append((time.monotonic() - started, units))
+            observe_poll(poll, started, units)
+
+        connector.observe_poll = observe
+
+    async def run_stage(self, name: str, function, cycles: int = 1) -> StageStats:
+        """
+        Await function `cycles` times, timing every call
+        :param name: stage name
+        :param function: coroutine function without arguments
+        :param cycles:
+        :return:
+        """
+        stats = self.stages.setdefault(name, StageStats())
+        for _ in range(cycles):
+            messages = self.gateway.messages
+            started = time.perf_counter()
+            await function()
+            latency = time.perf_counter() - started
+            stats.latencies.append(latency)
+            stats.seconds += latency
+            stats.messages += self.gateway.messages - messages
+        return stats
+
+    async def run_polls(self, name: str, poll: str, function, cycles: int):
+        """
+        Run stage of a loop reporting its cycles with observe_poll until `cycles` non-empty cycles are done
+        :param name: stage name
+        :param poll: poll name passed to observe_poll by the loop
+        :param function: coroutine function of the loop
+        :param cycles:
+        :return:
+        """
+        stats = self.stages.setdefault(name, StageStats())
+        samples = self.poll_samples.setdefault(poll, [])
+        messages = self.gateway.messages
+        started = time.perf_counter()
+        task = asyncio.create_task(function())
+        while sum(1 for _, units in samples if units) < cycles and not task.done():
+            await asyncio.sleep(0.01)
+        stats.seconds += time.perf_counter() - started
+        task.cancel()
+        stats.messages += self.gateway.messages - messages
+        for latency, units in samples:
+            if units:
+                stats.latencies.append(latency)
+                stats.units += units
+
+    async def run_until_served(self, name: str, endpoint: str, function, requests: int):
+        """
+        Run stage of a loop without cycle reporting until the stub served `requests` requests of the endpoint
+        :param name: stage name
+        :param endpoint: stub endpoint counter
+        :param function: coroutine function of the loop
+        :param requests:
+        :return:
+        """
+        stats = self.stages.setdefault(name, StageStats())
+        started = time.perf_counter()
+        task = asyncio.create_task(function())
+        while (await self.served()).get(endpoint, 0) < requests and not task.done():
+            await asyncio.sleep(0.01)
+        stats.seconds += time.perf_counter() - started
+        stats.units += requests
+        task.cancel()
+
+    async def served(self) -> dict:
+        return (await self.http_client.get(self.base_url + '/_stats')).json()
+
+    async def replay_backlog(self, source: str):
+        """
+        Fill car_states with backlog_states states per unit of the source and replay them to the gateway
+        :param source: Car.source
+        :return:
+        """
+        from database.queries import AsyncCarStateORM
+        from telemetry_objects.transport import Transport
+
+        ts = int(time.time()) - 3600
+        car_ids = self.registry.ids(source)
+        for offset in range(self.args.backlog_states):
+            await AsyncCarStateORM.save_unsent_telemetry_list([
+                Transport(ts + offset, False, 55.75, 37.61, 40, None, car_id, True, None, ts + offset, self.registry.name(car_id))
+                for car_id in car_ids
+            ])
+        stats = await self.run_stage('backlog_replay', self.destination.replay_backlog)
+        stats.units = len(car_ids) * self.args.backlog_states
+
+    async def wialon(self):
+        from benchmarks.stub_server import WIALON_AVL_PATH, WIALON_PATH
+        from connectors.adaptive_poller import AdaptivePoller
+        from connectors.wialon_connector import WialonConnector
+        from monitoring_source.wialon_asource import WialonAsyncSource
+
+        source = WialonAsyncSource(http_client=self.http_client, secret_key='benchmark')
+        source.BASE_URL = self.base_url + WIALON_PATH
+        source.AVL_EVENTS_URL = self.base_url + WIALON_AVL_PATH
+        connector = WialonConnector(
+            source=source,
+            destination=self.destination,
+            registry=self.registry,
+            avl_poller=AdaptivePoller(min_interval=0, max_interval=0.05),
+            name='benchmark'
+        )
+        self.record_polls(connector)
+
+        await self.run_stage('auth', source.auth)
+        await self.run_stage('fleet_sync', connector.check_transport)
+        stats = await self.run_stage('states', connector.fetch_transport_states, self.args.polls)
+        stats.units = self.args.units * self.args.polls
+        await self.run_polls('avl_events', 'avl_events', connector.get_avls, self.args.polls)
+        stats = await self.run_stage('counters', connector.monitor_counters, self.args.polls)
+        stats.units = sum(units for _, units in self.poll_samples.get('counters', []))
+        await self.replay_backlog('wialon')
+
+    async def city_point(self):
+        from benchmarks.stub_server import CITY_POINT_PATH
+        from connectors.city_point_connector import CityPointConnector
+        from monitoring_source.citypoint_asource import CityPointAsyncSource
+
+        source = CityPointAsyncSource(self.http_client, 'benchmark', 'benchmark', 'benchmark', 'benchmark')
+        source.BASE_URL = self.base_url + CITY_POINT_PATH
+        connector = CityPointConnector(source=source, destination=self.destination, registry=self.registry, name='benchmark')
+        self.record_polls(connector)
+
+        await self.run_stage('auth', source.auth)
+        await self.run_stage('fleet_sync', connector.check_transport)
+        await self.run_stage('sensors', connector.fetch_sensors)
+        await self.run_stage('states', connector.fetch_transport_states, self.args.polls)
+        self.stages['states'].units = sum(units for _, units in self.poll_samples.get('states', []))
+        await self.run_until_served('notifications', 'notifications', lambda: connector.fetch_notifications(0), self.args.polls)
+        await self.replay_backlog('city_point')
+
+    async def run(self) -> dict:
+        try:
+            if self.args.connector == 'wialon':
+                await self.wialon()
+            else:
+                await self.city_point()
+            # Wait for acknowledgement of everything published, as the gateway would
+            deadline = time.monotonic() + self.destination.publish_timeout
+            while self.destination._in_flight and time.monotonic() < deadline:
+                self.destination.check_deliveries()
+                await asyncio.sleep(0.01)
+        finally:
+            await self.http_client.close()
+        return {
+            'connector': self.args.connector,
+            'units': self.args.units,
+            'stages': {name: stats.report() for name, stats in self.stages.items()},
+            'gateway': {
+                'payloads': self.gateway._client.payloads,
+                'bytes': self.gateway._client.bytes,
+                'messages': self.gateway.messages,
+                'unacknowledged': len(self.destination._in_flight),
+            },
+            # Linux reports ru_maxrss in kilobytes
+            'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        }
+
+
+def reset_database():
+    """
+    Create schema and empty every table of the project
+    :return:
+    """
+    from sqlalchemy import text
+
+    from database.database import Base, db_init, engine
+
+    db_init()
+    tables = ', '.join(table.name for table in Base.metadata.sorted_tables)
+    with engine.begin() as connection:
+        connection.execute(text(f'TRUNCATE {tables} CASCADE'))
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--connector', choices=('wialon', 'city_point'), required=True)
+    parser.add_argument('--units', type=int, default=1000, help='fleet size')
+    parser.add_argument('--polls', type=int, default=10, help='cycles of every polling stage')
+    parser.add_argument('--avl-events', type=int, default=1000, help='events per AVL poll')
+    parser.add_argument('--backlog-states', type=int, default=5, help='car_states rows per unit replayed')
+    parser.add_argument('--latency', type=float, default=0.0, help='stub server response delay, seconds')
+    parser.add_argument('--ack-delay', type=float, default=0.0, help='fake gateway acknowledgement delay, seconds')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--recorded', help='directory with recorded fixtures, <name>.json')
+    parser.add_argument(
+        '--database-url',
+        default=os.environ.get('BENCH_DATABASE_URL'),
+        help='scratch Postgres database, emptied before the run. BENCH_DATABASE_URL by default'
+    )
+    parser.add_argument('--force', action='store_true', help="allow a database without 'bench' in its name")
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None) -> dict:
+    args = parse_args(argv)
+    if not args.database_url:
+        sys.exit('Scratch database is required: --database-url or BENCH_DATABASE_URL')
+    if 'bench' not in (make_url(args.database_url).database or '') and not args.force:
+        sys.exit("Database is emptied before the run. Use one with 'bench' in its name or --force")
+    os.environ['DATABASE_URL'] = args.database_url
+
+    from benchmarks.stub_server import start_stub_server
+    from serialization import dumps_str
+
+    reset_database()
+    stub, base_url = start_stub_server(
+        args.units,
+        seed=args.seed,
+        recorded_dir=args.recorded,
+        latency=args.latency,
+        avl_polls=args.polls,
+        avl_events=args.avl_events,
+        notifications=10
+    )
+    try:
+        report = asyncio.run(ConnectorBenchmark(args, base_url).run())
+    finally:
+        stub.terminate()
+    print(dumps_str(report))
+    return report
+
+
+if __name__ == '__main__':
+    main()
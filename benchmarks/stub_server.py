@@ -0,0 +1,143 @@
+"""Local HTTP server emulating Wialon Remote API and CityPoint REST API"""
+import asyncio
+import multiprocessing
+import socket
+import time
+from collections import Counter
+
+from aiohttp import web
+
+from benchmarks.fixtures import FleetFixtures
+from serialization import dumps, loads
+
+
+WIALON_PATH = '/wialon/ajax.html'
+WIALON_AVL_PATH = '/avl_evts'
+CITY_POINT_PATH = '/v2.1'
+
+
+class StubServer:
+    """
+    Serves fixtures of one fleet. Every response may be delayed by `latency` seconds to emulate the upstream.
+    AVL events are returned for the first avl_polls requests, empty responses afterwards.
+    GET /_stats returns number of served requests per endpoint.
+    """
+
+    def __init__(
+            self,
+            fixtures: FleetFixtures,
+            latency: float = 0.0,
+            avl_polls: int = 20,
+            avl_events: int = 1000,
+            notifications: int = 10
+    ):
+        self.fixtures = fixtures
+        self.latency = latency
+        self.avl_polls = avl_polls
+        self.avl_events = avl_events
+        self.notifications = notifications
+        self.served: Counter[str] = Counter()
+
+    async def _respond(self, endpoint: str, body) -> web.Response:
+        self.served[endpoint] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return web.Response(body=dumps(body), content_type='application/json')
+
+    async def wialon(self, request: web.Request) -> web.Response:
+        svc = request.query.get('svc')
+        params = loads(request.query.get('params', '{}'))
+        if svc == 'token/login':
+            return await self._respond(svc, self.fixtures.wialon_login())
+        if svc == 'core/update_data_flags':
+            item_ids = [item_id for spec in params['spec'] for item_id in spec['data']]
+            return await self._respond(svc, self.fixtures.wialon_update_data_flags(item_ids))
+        if svc == 'core/search_items':
+            flags = params.get('flags')
+            if flags == 8388609:
+                return await self._respond('wialon_units', self.fixtures.wialon_units())
+            if flags == 15729697:
+                return await self._respond('wialon_states', self.fixtures.wialon_states())
+            if flags == 8193:
+                return await self._respond('wialon_counters', self.fixtures.wialon_counters())
+            return await self._respond(svc, {'items': []})
+        if svc == 'messages/unload':
+            return await self._respond(svc, {})
+        return await self._respond('wialon_unknown', {'error': 1})
+
+    async def wialon_avl_events(self, request: web.Request) -> web.Response:
+        if self.served['avl_evts'] < self.avl_polls:
+            return await self._respond('avl_evts', self.fixtures.wialon_avl_events(self.avl_events))
+        return await self._respond('avl_evts_empty', {'tm': int(time.time()), 'events': []})
+
+    async def city_point_token(self, request: web.Request) -> web.Response:
+        return await self._respond('oauth_token', self.fixtures.city_point_token())
+
+    async def city_point_cars(self, request: web.Request) -> web.Response:
+        return await self._respond('cars', self.fixtures.city_point_cars())
+
+    async def city_point_states(self, request: web.Request) -> web.Response:
+        return await self._respond('cars_states', self.fixtures.city_point_states())
+
+    async def city_point_notifications(self, request: web.Request) -> web.Response:
+        return await self._respond('notifications', self.fixtures.city_point_notifications(self.notifications))
+
+    async def city_point_sensors(self, request: web.Request) -> web.Response:
+        return await self._respond('sensors', self.fixtures.city_point_sensors())
+
+    async def stats(self, request: web.Request) -> web.Response:
+        return web.Response(body=dumps(dict(self.served)), content_type='application/json')
+
+    def application(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get(WIALON_PATH, self.wialon)
+        app.router.add_get(WIALON_AVL_PATH, self.wialon_avl_events)
+        app.router.add_post(CITY_POINT_PATH + '/oauth/token', self.city_point_token)
+        app.router.add_get(CITY_POINT_PATH + '/user/{user_id}/cars', self.city_point_cars)
+        app.router.add_get(CITY_POINT_PATH + '/user/{user_id}/cars/states', self.city_point_states)
+        app.router.add_get(CITY_POINT_PATH + '/user/{user_id}/notifications', self.city_point_notifications)
+        app.router.add_get(CITY_POINT_PATH + '/sensors', self.city_point_sensors)
+        app.router.add_get('/_stats', self.stats)
+        return app
+
+
+def serve(connection, units: int, seed: int, recorded_dir: str | None, **options):
+    """
+    Entry point of the stub server process. Port is sent back over the connection once listening
+    :param connection: pipe to the benchmark process
+    :param units: fleet size
+    :param seed: seed of synthetic fixtures
+    :param recorded_dir: directory with recorded fixtures
+    :param options: StubServer options
+    :return:
+    """
+    async def run():
+        server = StubServer(FleetFixtures(units, seed=seed, recorded_dir=recorded_dir), **options)
+        runner = web.AppRunner(server.application(), access_log=None)
+        await runner.setup()
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(('127.0.0.1', 0))
+        await web.SockSite(runner, sock).start()
+        connection.send(sock.getsockname()[1])
+        await asyncio.Event().wait()
+
+    asyncio.run(run())
+
+
+def start_stub_server(units: int, seed: int = 1, recorded_dir: str | None = None, **options) -> tuple[multiprocessing.Process, str]:
+    """
+    Run stub server in a separate process, so its memory is not counted in the benchmark's peak RSS
+    :param units: fleet size
+    :param seed: seed of synthetic fixtures
+    :param recorded_dir: directory with recorded fixtures
+    :param options: StubServer options
+    :return: process and base URL
+    """
+    context = multiprocessing.get_context('spawn')
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(
+        target=serve, args=(sender, units, seed, recorded_dir), kwargs=options, daemon=True
+    )
+    process.start()
+    port = receiver.recv()
+    return process, f'http://127.0.0.1:{port}'
@@ -1,19 +1,35 @@
+import time
 from abc import ABC, abstractmethod
 
+from database.car_registry import CarRegistry
 from destinations.abs_destination import AbstractDestination
+from metrics.instruments import POLL_SECONDS, POLL_UNITS
+from scheduler import Scheduler
+from sharding import Shard
+from telemetry_objects.last_state_cache import LastStateCache
 
 class AbstractConnector(ABC):
     def __init__(
             self,
             source,
             destination: AbstractDestination | None,
-            data=None
+            data=None,
+            registry: CarRegistry | None = None,
+            heartbeat_interval: float = 300,
+            scheduler: Scheduler | None = None,
+            name: str | None = None,
+            shard: Shard | None = None
     ):
         if data is None:
             data = {}
         self.source = source
         self.destination = destination
         self.data = data
+        self.registry = registry if registry is not None else CarRegistry()
+        self.last_states = LastStateCache(heartbeat_interval)
+        self.scheduler = scheduler if scheduler is not None else Scheduler()
+        self.name = name or type(self).__name__
+        self.shard = shard
         self.transport_map = {}
 
     @abstractmethod
@@ -21,9 +37,47 @@ class AbstractConnector(ABC):
         pass
 
     @abstractmethod
-    async def fetch_transport_states(self, discreteness: int):
+    async def fetch_transport_states(self) -> bool:
         pass
 
+    def owns(self, car_id) -> bool:
+        """
+        Check if car is handled by this process. Always True if not sharded
+        :param car_id: Car.id
+        :return:
+        """
+        return self.shard is None or self.shard.owns(car_id)
+
+    def is_home(self, key: str | None = None) -> bool:
+        """
+        Check if account-wide jobs run in this process. Always True if not sharded
+        :param key: job key. Connector name if None
+        :return:
+        """
+        return self.shard is None or self.shard.is_home(key or self.name)
+
+    def observe_poll(self, poll: str, started: float, units: int):
+        """
+        Record duration and size of a polling cycle
+        :param poll: name of the poll, e.g. states
+        :param started: time.monotonic() at the start of the cycle
+        :param units: number of units handled by the cycle
+        :return:
+        """
+        POLL_SECONDS.observe(time.monotonic() - started, connector=self.name, poll=poll)
+        POLL_UNITS.observe(units, connector=self.name, poll=poll)
+
+    def queue_changes(self, transport):
+        """
+        Queue only values changed since the last message of the transport. Unchanged states are skipped
+        :param transport: Transport object
+        :return:
+        """
+        _, telemetry = transport.form_mqtt_message()
+        telemetry = self.last_states.diff(transport.car_id, telemetry)
+        if telemetry is not None:
+            self.destination.queue_telemetry(transport, telemetry)
+
     @abstractmethod
     def load_transport_in_memory(self, transports):
         pass
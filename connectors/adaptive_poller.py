@@ -0,0 +1,81 @@
+"""Adaptive polling interval with per-poll statistics"""
+import logging
+import os
+import time
+
+
+logger = logging.getLogger(os.environ.get("LOGGER"))
+
+
+class AdaptivePoller:
+    """
+    Delay between polls of an event queue. Grows while polls come back empty and
+    shrinks as soon as events arrive. Polls returning at least burst_size events are repeated immediately.
+    Per-poll event count and latency are aggregated and logged every report_interval seconds.
+    """
+
+    def __init__(
+            self,
+            min_interval: float = 0.5,
+            max_interval: float = 10.0,
+            backoff: float = 1.5,
+            burst_size: int = 500,
+            report_interval: float = 60
+    ):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.burst_size = burst_size
+        self.report_interval = report_interval
+        self.interval = min_interval
+        self.last_events = 0
+        self.last_latency = 0.0
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self._started = time.monotonic()
+        self.polls = 0
+        self.empty_polls = 0
+        self.events = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def record(self, events: int, latency: float) -> float:
+        """
+        Account one poll and get delay before the next one
+        :param events: number of events returned by the poll
+        :param latency: duration of the request in seconds
+        :return: delay in seconds
+        """
+        self.last_events, self.last_latency = events, latency
+        self.polls += 1
+        self.events += events
+        self.latency_total += latency
+        self.latency_max = max(self.latency_max, latency)
+        if not events:
+            self.empty_polls += 1
+
+        if events >= self.burst_size:
+            delay = 0.0
+            self.interval = self.min_interval
+        elif events:
+            delay = self.interval = self.min_interval
+        else:
+            delay = self.interval = min(self.max_interval, self.interval * self.backoff)
+
+        if time.monotonic() - self._started >= self.report_interval:
+            self.report()
+        return delay
+
+    def report(self):
+        """
+        Log statistics since the previous report and start over
+        :return:
+        """
+        if self.polls:
+            logger.info(
+                f"AVL polls: {self.polls} ({self.empty_polls} empty), {self.events} events, "
+                f"latency avg {self.latency_total / self.polls:.3f}s max {self.latency_max:.3f}s, "
+                f"interval {self.interval:.2f}s"
+            )
+        self._reset_stats()
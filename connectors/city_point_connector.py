@@ -2,30 +2,28 @@ import os
 import logging
 import asyncio
 import re
+import time
 
-from datetime import datetime, timedelta
-from http.client import RemoteDisconnected
-
-from urllib3.exceptions import NameResolutionError, MaxRetryError
-from requests.exceptions import ConnectionError as RequestsConnectionError
+from datetime import date, datetime, timedelta
 
 from connectors.abs_connector import AbstractConnector
-from database.queries import CarORM, CarStateORM, SensorORM
+from connectors.sensor_mapping import SensorMapping
+from database.car_registry import CarRegistry
+from database.queries import AsyncAlarmORM, AsyncCarORM, AsyncCarStateORM, AsyncSensorORM
 from destinations.cuba_mqtt_client import CubaMqttClient
-from destinations.cuba_rest_client import CubaRestClient
-from monitoring_source.citypoint_source import CityPointSource
+from destinations.alarm_dispatcher import AlarmDispatcher
+from monitoring_source.citypoint_asource import CityPointAsyncSource
+from monitoring_source.utils import parse_utc_timestamp
+from scheduler import Scheduler
+from sharding import Shard
 from telemetry_objects.alarm import Alarm
 from telemetry_objects.transport import Transport
+from tracing import traced
 
 
 logger = logging.getLogger(os.environ.get('LOGGER'))
 
 
-def full_date_to_timestamp(date: str) -> int:
-    time_format = "%Y-%m-%dT%H:%M:%SZ"
-    return int(datetime.timestamp(datetime.strptime(date, time_format)))
-
-
 def remove_html_tags(text):
     # Use regex to remove HTML tags
     clean_text = re.sub(r'<.*?>', '', text)
@@ -37,149 +35,140 @@ class CityPointConnector(AbstractConnector):
 
     def __init__(
         self,
-        source: CityPointSource,
+        source: CityPointAsyncSource,
         destination: CubaMqttClient | None,
         data = None,
-        rest_client: CubaRestClient = None
+        alarm_dispatcher: AlarmDispatcher | None = None,
+        registry: CarRegistry | None = None,
+        sensor_channels: dict | None = None,
+        heartbeat_interval: float = 300,
+        scheduler: Scheduler | None = None,
+        name: str | None = None,
+        shard: Shard | None = None
     ):
-        super().__init__(source, destination, data)
-        self.rest_client: CubaRestClient | None = rest_client
+        super().__init__(source, destination, data, registry, heartbeat_interval, scheduler, name, shard)
+        self.alarm_dispatcher: AlarmDispatcher | None = alarm_dispatcher
+        self.sensor_mapping = SensorMapping(sensor_channels)
+        self.reported_day: date | None = None
 
     async def start_loop(self):
-        try:
-            res = self.source.auth()
-        except (RequestsConnectionError, NameResolutionError, TimeoutError, RemoteDisconnected) as exc:
-            res = False
-            logger.exception(f"Exception trying to authenticate: {exc}")
-        while not res:
+        while True:
+            try:
+                res = await self.source.auth()
+            except (ConnectionError, TimeoutError) as exc:
+                res = False
+                logger.exception(f"Exception trying to authenticate: {exc}")
+            if res:
+                break
             logger.info('Failed authentication')
             await asyncio.sleep(30)
-            await self.start_loop()
         logger.info('Authenticated')
 
-        self.data['transports_id'] = CarORM.get_all_cars_ids()
-        asyncio.create_task(self.fetch_sensors())
+        if not len(self.registry):
+            await self.registry.load_async()
+        self.data['transports_id'] = set(self.registry.ids(include_hidden=False))
+        asyncio.create_task(self.fetch_sensors(), name=f'{self.name}:sensors')
 
-        asyncio.create_task(self.check_transport_with_discreteness(86400))
+        self.scheduler.every(
+            f'{self.name}:check_transport', 86400, self.check_transport, run_immediately=True, retry_interval=10
+        )
         # asyncio.create_task(self.fetch_timezones(86400))
         # if runtime := get_last_runtime():
         #     asyncio.create_task(self.get_states_since(runtime))
-        asyncio.create_task(self.fetch_transport_states(16))
-        asyncio.create_task(self.daily_report(hour=6, minute=0))
-
-    async def daily_report(self, hour, minute):
-        while True:
-            # Get the current time
-            now = datetime.now()
-            next_run = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
-
-            if next_run < now:
-                next_run += timedelta(days=1)
-
-            time_to_wait = (next_run - now).total_seconds()
-
-            await self.send_report()
-            logger.info(f"Waiting {time_to_wait} seconds until the next run at {next_run}")
-
-            await asyncio.sleep(time_to_wait)
-
-            await self.send_report()
+        self.scheduler.every(f'{self.name}:transport_states', 16, self.fetch_transport_states, retry_interval=10)
+        self.scheduler.daily(f'{self.name}:daily_report', 6, 0, self.send_report)
 
     async def send_report(self):
+        """
+        Publish yesterday's mileage and working hours of visible cars in one batch. Skipped if already published
+        :return:
+        """
         dt = datetime.today().replace(hour=6, minute=0, second=0, microsecond=0) - timedelta(days=1)
+        if self.reported_day == dt.date() or not self.destination or not self.is_home():
+            return
         try:
-            res = self.source.get_day_info(dt.strftime('%Y-%m-%d'))
-        except (RequestsConnectionError, NameResolutionError, TimeoutError, RemoteDisconnected) as exc:
+            res = await self.source.get_day_info(dt.strftime('%Y-%m-%d'))
+        except (ConnectionError, TimeoutError) as exc:
             logger.exception(f"Exception trying to fetch day report: {exc}")
-            await asyncio.sleep(10)
-        except MaxRetryError:
-            self.source.delay = 60
-            await self.send_report()
-
-        try:
-            if not res or not res.get('data'):  # noqa
-                return
-        except NameError:
+            return
+        if not res or not res.get('data'):
             return
 
+        ts = int(round(datetime.timestamp(dt) * 1000))
+        messages = {}
         for record in res['data']:
-            car = CarORM.get_car_by_id(int(record['relationships']['Car']['data']['id']))
+            car = self.registry.get(record['relationships']['Car']['data']['id'])
             if not car or car.is_hidden:
                 continue
+            messages.setdefault(car.name, []).append({
+                'ts': ts,
+                'values': {
+                    'mileage': record['attributes'].get('Mileage', 0),
+                    'working_hours': record['attributes'].get('WorkingHours', 0)
+                }
+            })
 
-            try:
-                self.destination.send_data(
-                    car.name,
-                    {
-                        'ts': int(round(datetime.timestamp(dt) * 1000)),
-                        'values': {
-                            'mileage': record['attributes'].get('Mileage', 0),
-                            'working_hours': record['attributes'].get('WorkingHours', 0)
-                        }
-                    }
-                )
-            except Exception as exc:
-                logger.exception(exc)
+        try:
+            if await self.destination.send_batch(messages):
+                self.reported_day = dt.date()
+                logger.info(f"Report published: {len(messages)} cars")
+        except Exception as exc:
+            logger.exception(exc)
 
     async def get_states_since(self, runtime):
         start_ts, end_ts = runtime.end_ts, int(datetime.timestamp(datetime.now()))
 
         try:
-            transport_ids = CarORM.get_transport_ids('city_point')
-            print(transport_ids)
+            transport_ids = await AsyncCarORM.get_transport_ids('city_point')
+            logger.debug(f"CityPoint transports to fetch history for: {transport_ids}")
             for transport_id in transport_ids:
-                res = self.source.load_historical_messages_by_id(transport_id, start_ts, end_ts)
-                self.save_trips(transport_id, res.get('messages', []))
+                res = await self.source.get_historical_messages_by_id(transport_id, start_ts, end_ts)
+                await self.save_trips(transport_id, res.get('messages', []))
                 await asyncio.sleep(10)
 
         except Exception as exc:
             logger.exception(exc)
 
     @staticmethod
-    def save_trips(transport_id, trips):
-        car = CarORM.get_car_by_id(transport_id)
-        time_format = "%Y-%m-%dT%H:%M:%SZ"
-        print(f"for {car.name} {len(trips)} states")
-        for trip in trips:
-            CarStateORM.save_unsent_telemetry(Transport(
-                ts=datetime.strptime(trip['attributes']['RecordDate'], time_format),
+    async def save_trips(transport_id, trips):
+        car = await AsyncCarORM.get_car_by_id(transport_id)
+        logger.debug(f"for {car.name} {len(trips)} states")
+        await AsyncCarStateORM.save_unsent_telemetry_list([
+            Transport(
+                ts=parse_utc_timestamp(trip['attributes']['RecordDate']),
                 is_sent=False,
                 latitude=trip['attributes']['Lat'],
-                longitude=trip['attributes']['Lat'],
+                longitude=trip['attributes']['Lon'],
                 velocity=trip['attributes']['Velocity'],
                 fuel_level=None,
                 car_id=transport_id,
                 ignition=1,
                 light=None,
-                last_conn=datetime.strptime(trip['attributes']['RecordDate'], time_format),
+                last_conn=parse_utc_timestamp(trip['attributes']['RecordDate']),
                 name=car.name
-            ))
+            ) for trip in trips
+        ])
 
     async def fetch_sensors(self):
         try:
-            sensors = self.source.get_sensors()
-            SensorORM.add_sensors_if_not_exist(sensors['data'])
-            self.data['fuel_sensors_id'] = SensorORM.get_sensors_by_destination(100)
-            self.data['ignition_sensors_id'] = SensorORM.get_sensors_by_destination(1)
-            self.data['light_sensors_id'] = SensorORM.get_sensors_by_destination(1300)
-        except (RequestsConnectionError, NameResolutionError, TimeoutError, RemoteDisconnected) as exc:
+            sensors = await self.source.get_sensors()
+            if sensors:
+                inserted, updated = await AsyncSensorORM.add_sensors_if_not_exist(sensors['data'])
+                logger.info(f"Sensors synchronized: {inserted} added, {updated} updated")
+        except (ConnectionError, TimeoutError) as exc:
             logger.exception(f"Exception trying to fetch sensors: {exc}")
-            await asyncio.sleep(10)
-        except MaxRetryError:
-            self.source.delay = 60
-            await self.fetch_sensors()
+        self.sensor_mapping.build(await AsyncSensorORM.get_all_sensors())
 
     async def fetch_notifications(self, discreteness):
         while True:
             await asyncio.sleep(discreteness)
             try:
-                notifications = self.source.get_messages()
-            except (RequestsConnectionError, NameResolutionError, TimeoutError, RemoteDisconnected) as exc:
+                notifications = await self.source.get_messages()
+            except (ConnectionError, TimeoutError) as exc:
                 logger.exception(f"Exception trying to fetch notifications: {exc}")
                 await asyncio.sleep(10)
                 continue
-            except MaxRetryError:
-                self.source.delay = 60
+            if not notifications:
                 continue
             alarms = [alarm for alarm in notifications['data'] if alarm['attributes']['Level'] >= 4]
             drivers = [driver for driver in notifications['included'] if driver['type'] == 'driver']
@@ -198,39 +187,46 @@ class CityPointConnector(AbstractConnector):
                     level=alarm['attributes']['Level'],
                     latitude=alarm['attributes']['Latitude'],
                     longitude=alarm['attributes']['Longitude'],
-                    record_date=full_date_to_timestamp(alarm['attributes']['RecordDate']),
-                    date_of_creation=full_date_to_timestamp(alarm['attributes']['DateOfCreation']),
+                    record_date=parse_utc_timestamp(alarm['attributes']['RecordDate']),
+                    date_of_creation=parse_utc_timestamp(alarm['attributes']['DateOfCreation']),
                     car_id=car_id,
                     driver_first_name=driver[0]['attributes']['FIO']['FirstName'] if driver else '',
                     driver_last_name=driver[0]['attributes']['FIO']['LastName'] if driver else '',
                     place=None
                 )
 
-                car = CarORM.get_car_by_id(a.car_id)
-
-                if not self.rest_client or not self.rest_client.post_alarm(a, car.name):
-                    # TODO: Save to DB.
-                    pass
-                    # save_unsent_alarm_(a)
-
-    async def check_transport_with_discreteness(self, discreteness: int):
+                car = self.registry.get(a.car_id) if a.car_id else None
+                if not car:
+                    logger.warning(f"Alarm for unknown car: {a.car_id}")
+                    continue
 
-        logger.info("start check_transport_with_discreteness")
-        while True:
-            try:
-                transports_result = self.source.get_transport_list()
-            except (RequestsConnectionError, NameResolutionError, TimeoutError, RemoteDisconnected) as exc:
-                logger.exception(f"Exception trying to fetch transport: {exc}")
-                await asyncio.sleep(10)
-                continue
-            except MaxRetryError:
-                self.source.delay = 60
-                continue
-            transports = transports_result['data']
-            CarORM.add_transport_if_not_exists(transports)
-            self.load_transport_in_memory(transports)
-            await asyncio.sleep(discreteness)
-            logger.info("end check_transport_with_discreteness")
+                if self.alarm_dispatcher:
+                    self.alarm_dispatcher.dispatch(a, car.name)
+                else:
+                    await AsyncAlarmORM.save_unsent_alarms([a])
+
+    @traced('city_point.fleet_sync')
+    async def check_transport(self) -> bool:
+        """
+        Synchronize cars of the account with DB and registry. Scheduled daily
+        :return: False if transport list was not fetched
+        """
+        if not self.is_home():
+            return True
+        try:
+            transports_result = await self.source.get_transport_list()
+        except (ConnectionError, TimeoutError) as exc:
+            logger.exception(f"Exception trying to fetch transport: {exc}")
+            return False
+        if not transports_result:
+            return False
+        transports = transports_result['data']
+        inserted, updated = await AsyncCarORM.add_transport_if_not_exists(transports)
+        logger.info(f"CityPoint transport synchronized: {inserted} added, {updated} updated")
+        await self.registry.refresh_async()
+        self.data['transports_id'] = {int(transport['id']) for transport in transports}
+        self.load_transport_in_memory(transports)
+        return True
 
     # async def fetch_timezones(self, discreteness: int):
     #     logger.info("start fetch_timezones")
@@ -238,56 +234,59 @@ class CityPointConnector(AbstractConnector):
     #         await asyncio.sleep(discreteness)
     #         logger.info('end fetch_timezones')
 
-    async def fetch_transport_states(self, discreteness: int):
-        while True:
-            logger.info('Fetching states')
-            time_format = "%Y-%m-%dT%H:%M:%SZ"
+    @traced('city_point.states_poll')
+    async def fetch_transport_states(self) -> bool:
+        """
+        Fetch current states of all cars and queue changed telemetry. Scheduled every 16 seconds
+        :return: False if states were not fetched
+        """
+        # One request returns states of the whole account, so the account is served by its home worker
+        if not self.is_home():
+            return True
+        logger.info('Fetching states')
+        started = time.monotonic()
 
-            try:
-                transports = self.source.get_transports(query_filter=','.join(f'"{str(car_id)}"' for car_id in self.data['transports_id']))
-                if transports and transports.get('errors'):
-                    logger.warning(transports)
-                    await asyncio.sleep(10)
+        try:
+            transports = await self.source.get_transports(query_filter=','.join(f'"{str(car_id)}"' for car_id in self.data['transports_id']))
+            if not transports or transports.get('errors'):
+                logger.warning(transports)
+                return False
+        except (ConnectionError, TimeoutError) as exc:
+            logger.exception(f"Exception trying to fetch transport stated: {exc}")
+            return False
+
+        for transport in transports.get('data', []):
+            car = self.registry.get(transport['id'])
+            if car and not car.is_hidden:
+                last_conn = parse_utc_timestamp(transport['attributes']['LattestGpsDate'])
+                if time.time() - last_conn > 600:
                     continue
-            except (RequestsConnectionError, NameResolutionError, TimeoutError, RemoteDisconnected) as exc:
-                logger.exception(f"Exception trying to fetch transport stated: {exc}")
-                await asyncio.sleep(10)
-                continue
-            except MaxRetryError:
-                self.source.delay = 60
-                continue
+                sensors = self.sensor_mapping.extract(transport['attributes']['Sensors'])
+                velocity_can = sensors.pop('velocity_can', None)
+                t = Transport(
+                    ts=parse_utc_timestamp(transport['attributes']['RecordDate']),
+                    is_sent=False,
+                    latitude=transport['attributes']['Lat'],
+                    longitude=transport['attributes']['Lon'],
+                    velocity=int(velocity_can) if velocity_can is not None else transport['attributes']['Velocity'],
+                    fuel_level=sensors.pop('fuel_level', None),
+                    car_id=int(transport['id']),
+                    ignition=sensors.pop('ignition', None),
+                    light=sensors.pop('light', None),
+                    last_conn=last_conn,
+                    name=car.name,
+                    extra=sensors
+                )
 
-            for transport in transports.get('data', []):
-                if int(transport['id']) in self.data['transports_id']:
-                    latest_gps_date = datetime.strptime(transport['attributes']['LattestGpsDate'], time_format)
-                    if (datetime.now() - latest_gps_date).seconds > 600:
-                        continue
-                    fuel_sensor = [
-                        sensor for sensor in transport['attributes']['Sensors'] if sensor['id'] in self.data['fuel_sensors_id']
-                    ]
-                    ignition = [sensor for sensor in transport['attributes']['Sensors'] if sensor['id'] == 1]
-                    light = [sensor for sensor in transport['attributes']['Sensors'] if sensor['id'] == 104]
-                    velocity_can = [sensor for sensor in transport['attributes']['Sensors'] if sensor['id'] == 41]
-                    ts = datetime.strptime(transport['attributes']['RecordDate'], time_format)
-                    last_conn = datetime.strptime(transport['attributes']['LattestGpsDate'], time_format)
-                    t = Transport(
-                        ts=datetime.timestamp(ts),
-                        is_sent=False,
-                        latitude=transport['attributes']['Lat'],
-                        longitude=transport['attributes']['Lon'],
-                        velocity=int(velocity_can[0]['value']) if velocity_can else transport['attributes']['Velocity'],
-                        fuel_level=fuel_sensor[0]['value'] if fuel_sensor else None,
-                        car_id=int(transport['id']),
-                        ignition=ignition[0]['value'],
-                        light=light[0]['value'],
-                        last_conn=datetime.timestamp(last_conn),
-                        name=CarORM.get_car_by_id(int(transport['id'])).name
-                    )
-
-                    if not self.destination or not self.destination.send_data(*t.form_mqtt_message()):
-                        CarStateORM.save_unsent_telemetry(t)
+                if self.destination:
+                    self.queue_changes(t)
+                else:
+                    await AsyncCarStateORM.save_unsent_telemetry(t)
 
-            await asyncio.sleep(discreteness)
+        if self.destination:
+            self.destination.flush()
+        self.observe_poll('states', started, len(transports.get('data', [])))
+        return True
 
     def load_transport_in_memory(self, transports):
         self.transport_map = {str(transport['id']):transport for transport in transports}
@@ -0,0 +1,83 @@
+"""Daily mileage and engine hours report built from counter_daily rollup"""
+import logging
+import os
+from datetime import date, datetime, time, timedelta
+
+from database.queries import AsyncCounterORM
+from destinations.abs_destination import AbstractDestination
+
+
+logger = logging.getLogger(os.environ.get("LOGGER"))
+
+
+class CounterReportEngine:
+    """
+    Reads per-car daily mileage and engine hours from counter_daily rollup, one query per range of days.
+    Results are cached per report day and every day is published to the destination only once.
+    """
+
+    def __init__(self, destination: AbstractDestination | None, hour: int = 6, cache_days: int = 31):
+        self.destination = destination
+        self.hour = hour
+        self.cache_days = cache_days
+        self._cache: dict[date, list[tuple]] = {}
+        self._published: set[date] = set()
+
+    async def get_days(self, first_day: date, days: int) -> dict[date, list[tuple]]:
+        """
+        Get report rows of completed days. Days which are not cached yet are fetched with one query
+        :param first_day: first report day
+        :param days: number of days
+        :return: {day: [(car_id, name, day, mileage, engine_seconds), ...]}
+        """
+        report_days = [first_day + timedelta(days=offset) for offset in range(days)]
+        missing = [day for day in report_days if day not in self._cache]
+        if missing:
+            start, span = missing[0], (missing[-1] - missing[0]).days + 1
+            fetched = {start + timedelta(days=offset): [] for offset in range(span)}
+            for row in await AsyncCounterORM.get_daily_stats(start, span):
+                fetched[row.day].append(row)
+            for day in missing:
+                self._cache[day] = fetched[day]
+        return {day: self._cache[day] for day in report_days}
+
+    async def publish(self, days: int = 1) -> int:
+        """
+        Publish report of the last completed days in one batch. Already published days are skipped
+        :param days: number of days before today to report
+        :return: number of published messages
+        """
+        today = date.today()
+        reports = await self.get_days(today - timedelta(days=days), days)
+        pending = [day for day in reports if day not in self._published]
+
+        messages = {}
+        for day in pending:
+            ts = int(datetime.combine(day, time(hour=self.hour)).timestamp() * 1000)
+            for row in reports[day]:
+                messages.setdefault(row.name, []).append({
+                    'ts': ts,
+                    'values': {
+                        'mileage': row.mileage,
+                        'working_hours': row.engine_seconds
+                    }
+                })
+
+        count = sum(len(device_messages) for device_messages in messages.values())
+        if self.destination is None or not await self.destination.send_batch(messages):
+            logger.warning(f"Report for {len(pending)} days was not published")
+            return 0
+        self._published.update(pending)
+        self._prune(today)
+        logger.info(f"Report published: {len(pending)} days, {count} messages")
+        return count
+
+    def _prune(self, today: date):
+        """
+        Forget days older than cache_days
+        :param today:
+        :return:
+        """
+        oldest = today - timedelta(days=self.cache_days)
+        self._cache = {day: rows for day, rows in self._cache.items() if day >= oldest}
+        self._published = {day for day in self._published if day >= oldest}
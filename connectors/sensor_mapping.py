@@ -0,0 +1,64 @@
+"""Mapping of CityPoint sensors to telemetry channels"""
+import logging
+import os
+
+from database.models import Sensor
+
+
+logger = logging.getLogger(os.environ.get('LOGGER'))
+
+
+# Channel name -> sensors feeding it. Sensors are selected by explicit ids and/or by Sensor.destination
+DEFAULT_SENSOR_CHANNELS: dict[str, dict[str, list[int]]] = {
+    'fuel_level': {'destinations': [100]},
+    'ignition': {'ids': [1]},
+    'light': {'ids': [104]},
+    'velocity_can': {'ids': [41]},
+}
+
+
+class SensorMapping:
+    """
+    Id-keyed lookup table built once from sensors table. Every car's sensor list is
+    then mapped to channels in a single pass.
+    """
+
+    def __init__(self, channels: dict[str, dict[str, list[int]]] | None = None):
+        self.channels = channels if channels is not None else DEFAULT_SENSOR_CHANNELS
+        self._by_id: dict[int, str] = {}
+        self.build([])
+
+    def build(self, sensors: list[Sensor]):
+        """
+        Rebuild lookup table. Explicit ids take precedence over destinations
+        :param sensors: all known sensors
+        :return:
+        """
+        by_destination: dict[int, set[int]] = {}
+        for sensor in sensors:
+            by_destination.setdefault(sensor.destination, set()).add(sensor.id)
+
+        by_id = {}
+        for channel, selector in self.channels.items():
+            for destination in selector.get('destinations', []):
+                for sensor_id in by_destination.get(destination, ()):
+                    by_id.setdefault(sensor_id, channel)
+        for channel, selector in self.channels.items():
+            for sensor_id in selector.get('ids', []):
+                by_id[sensor_id] = channel
+        self._by_id = by_id
+        logger.info(f"Sensor mapping built: {len(by_id)} sensors in {len(self.channels)} channels")
+
+    def extract(self, sensors: list[dict]) -> dict:
+        """
+        Get value of every configured channel. The first matching sensor wins
+        :param sensors: list of CityPoint sensor states with keys id and value
+        :return: {channel: value}
+        """
+        by_id = self._by_id
+        values = {}
+        for sensor in sensors:
+            channel = by_id.get(sensor['id'])
+            if channel is not None and channel not in values:
+                values[channel] = sensor.get('value')
+        return values
@@ -3,174 +3,249 @@ import json
 import os
 import logging
 import re
-from http.client import RemoteDisconnected
+import time
 from datetime import datetime, timedelta
 
-from urllib3.exceptions import NameResolutionError
-from requests.exceptions import ConnectionError as RequestsConnectionError
-
 from connectors.abs_connector import AbstractConnector
-from database.queries import CarORM, CounterORM, CarStateORM
+from connectors.adaptive_poller import AdaptivePoller
+from connectors.report_engine import CounterReportEngine
+from database.car_registry import CarRegistry
+from database.queries import AsyncAlarmORM, AsyncCarORM, AsyncCounterORM, AsyncCarStateORM
 from destinations.abs_destination import AbstractDestination
-from destinations.cuba_rest_client import CubaRestClient
-from monitoring_source.wialon_source import WialonSource
+from destinations.alarm_dispatcher import AlarmDispatcher
+from monitoring_source.wialon_asource import WialonAsyncSource
+from scheduler import Scheduler
+from sharding import Shard
 from telemetry_objects.alarm import Alarm
 from telemetry_objects.transport import Transport
+from tracing import traced, tracer
 
 
 logger = logging.getLogger(os.environ.get("LOGGER"))
 
+MOBILE_GROUP_REGEX = re.compile(r'[мМM][гГ]\s?-\s?\d{1,4}\D')
+REG_NUMBER_STRIP_REGEX = re.compile(r'[_\-|\s]')
+# Wialon custom field name -> cars column
+UNIT_FIELDS = {'vehicle_type': 'department', 'brand': 'model', 'color': 'reg_number'}
+
+
+def parse_unit(transport: dict) -> dict | None:
+    """
+    Convert Wialon unit with custom fields into cars row
+    :param transport: avl_unit item
+    :return: dictionary representation of Car. None if unit has no registration number
+    """
+    fields = {}
+    for field in transport.get('pflds', {}).values():
+        column = UNIT_FIELDS.get(field['n'])
+        if column and column not in fields:
+            fields[column] = field['v']
+    if 'reg_number' not in fields:
+        return None
+
+    reg_number = REG_NUMBER_STRIP_REGEX.sub('', fields['reg_number'])
+    mobile_group = MOBILE_GROUP_REGEX.search(transport['nm'])
+    return {
+        'id': transport['id'],
+        'name': f"{mobile_group.group(0).replace(' ', '')} {reg_number}" if mobile_group else reg_number,
+        'department': fields.get('department'),
+        'model': fields.get('model'),
+        'reg_number': reg_number,
+        'source': 'wialon'
+    }
+
 
 class WialonConnector(AbstractConnector):
 
     def __init__(
             self,
-            source: WialonSource,
+            source: WialonAsyncSource,
             destination: AbstractDestination | None,
             data=None,
-            rest_client: CubaRestClient = None
+            alarm_dispatcher: AlarmDispatcher | None = None,
+            registry: CarRegistry | None = None,
+            heartbeat_interval: float = 300,
+            report_backfill_days: int = 1,
+            counters_retention_days: int = 90,
+            avl_poller: AdaptivePoller | None = None,
+            report_engine: CounterReportEngine | None = None,
+            scheduler: Scheduler | None = None,
+            name: str | None = None,
+            shard: Shard | None = None
     ):
-        super().__init__(source, destination, data)
-        self.rest_client: CubaRestClient | None = rest_client
+        super().__init__(source, destination, data, registry, heartbeat_interval, scheduler, name, shard)
+        self.alarm_dispatcher: AlarmDispatcher | None = alarm_dispatcher
+        # Engine may be shared by several Wialon accounts, each report day is published once anyway
+        self.report_engine = report_engine if report_engine is not None else CounterReportEngine(destination)
+        self.report_backfill_days = report_backfill_days
+        self.counters_retention_days = counters_retention_days
+        self.avl_poller = avl_poller if avl_poller is not None else AdaptivePoller()
+        # All units of the account and the ones owned by this process and loaded into the session
+        self.account_unit_ids: set[int] = set()
+        self.unit_ids: set[int] = set()
 
     async def start_loop(self):
-        try:
-            res = self.source.auth()
-        except (RequestsConnectionError, NameResolutionError, TimeoutError, RemoteDisconnected) as exc:
-            logger.exception(f"Exception trying to authenticate: {exc}")
-            res = False
-        while not res:
+        while True:
+            try:
+                res = await self.source.auth()
+            except (ConnectionError, TimeoutError) as exc:
+                logger.exception(f"Exception trying to authenticate: {exc}")
+                res = False
+            if res:
+                break
             logger.info('Failed authentication')
             await asyncio.sleep(10)
-            await self.start_loop()
 
-        wialon_transport_ids = CarORM.get_transport_ids('wialon')
-        asyncio.create_task(self.check_transport_with_discreteness(86400))
+        if not len(self.registry):
+            await self.registry.load_async()
+        # Units of the account have to be known and loaded into the session before consuming events
+        while not await self.check_transport():
+            await asyncio.sleep(10)
+        self.scheduler.every(f'{self.name}:check_transport', 86400, self.check_transport, retry_interval=10)
+        if self.shard is not None:
+            self.shard.on_rebalance(self.rebalance)
         # if runtime := get_last_runtime():
         #     asyncio.create_task(self.get_states_since(runtime))
-        self.source.manage_session_units(wialon_transport_ids)
-        asyncio.create_task(self.get_avls(2))
-        asyncio.create_task(self.daily_report(hour=6, minute=0))
-        asyncio.create_task(self.monitor_counters(600))
+        asyncio.create_task(self.get_avls(), name=f'{self.name}:avl_events')
+        self.scheduler.daily(f'{self.name}:daily_report', 6, 0, self.daily_report)
+        self.scheduler.every(f'{self.name}:counters', 600, self.monitor_counters, retry_interval=10)
         # asyncio.create_task(self.send_day_report())
 
-    async def daily_report(self, hour, minute):
-        while True:
-            # Get the current time
-            now = datetime.now()
-            next_run = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
-
-            await self.send_report()
-
-            if next_run < now:
-                next_run += timedelta(days=1)
-
-            await self.send_report()
-
-            time_to_wait = (next_run - now).total_seconds()
-            logger.info(f"Waiting {time_to_wait} seconds until the next run at {next_run}")
-
-            await asyncio.sleep(time_to_wait)
-
-            await self.send_report()
+    async def daily_report(self):
+        """
+        Maintain counters partitions, publish report and prune raw counters. Scheduled daily
+        :return:
+        """
+        # Report covers all Wialon accounts, so only one process runs it
+        if not self.is_home('daily_report'):
+            return
+        await AsyncCounterORM.ensure_partitions()
+        await self.send_report()
+        await self.prune_counters()
 
     def check_drivers_with_discreteness(self, discreteness):
         pass
 
     async def send_report(self):
-        dt = datetime.today().replace(hour=6, minute=0, second=0, microsecond=0)
-        start_ts = int(datetime.timestamp(dt.replace(hour=0) - timedelta(days=1)))
-        end_ts = int(datetime.timestamp(dt.replace(hour=0)))
-        res = CounterORM.get_day_stats(start_ts, end_ts)
-        for record in res:
-            mileage, engine_hours, car_id = record
-            car = CarORM.get_car_by_id(car_id)
-            if not car:
-                continue
-
-            try:
-                self.destination.send_data(
-                    car.name,
-                    {
-                        'ts': int(round(datetime.timestamp(dt - timedelta(days=1)) * 1000)),
-                        'values': {
-                            'mileage': mileage,
-                            'working_hours': engine_hours
-                        }
-                    }
-                )
-            except Exception as exc:
-                logger.exception(exc)
-
-    async def monitor_counters(self, discreteness):
-        while True:
-            try:
-                data = self.source.get_counters_info()
-            except (RequestsConnectionError, NameResolutionError, TimeoutError, RemoteDisconnected) as exc:
-                logger.exception(f"Exception trying to fetch counters: {exc}")
-                await asyncio.sleep(10)
-                continue
+        """
+        Publish daily counters report of the last report_backfill_days days. Already published days are skipped
+        :return:
+        """
+        try:
+            await self.report_engine.publish(self.report_backfill_days)
+        except Exception as exc:
+            logger.exception(exc)
 
-            if data.get('items'):
-                ts = datetime.timestamp(datetime.now())
-                for item in data['items']:
-                    CounterORM.save_counter(
-                        mileage=item.get('cnm'),
-                        engine_seconds=int(item['cneh'] * 3600) if item.get('cneh') else None,
-                        ts=ts,
-                        car_id=item['id']
-                    )
+    async def prune_counters(self):
+        """
+        Remove raw counters older than counters_retention_days. Reports use counter_daily rollup which is kept
+        :return:
+        """
+        if not self.counters_retention_days:
+            return
+        before = datetime.now() - timedelta(days=self.counters_retention_days)
+        try:
+            await AsyncCounterORM.prune_counters(int(datetime.timestamp(before)))
+        except Exception as exc:
+            logger.exception(exc)
 
-            await asyncio.sleep(discreteness)
+    async def monitor_counters(self) -> bool:
+        """
+        Save mileage and engine hours counters of all units. Scheduled every 10 minutes
+        :return: False if counters were not fetched
+        """
+        if not self.is_home():
+            return True
+        started = time.monotonic()
+        try:
+            data = await self.source.get_counters_info()
+        except (ConnectionError, TimeoutError) as exc:
+            logger.exception(f"Exception trying to fetch counters: {exc}")
+            return False
+        fetched = time.monotonic()
+
+        if data and data.get('items'):
+            known_ids = {unit_id for unit_id in self.account_unit_ids if unit_id in self.registry}
+            saved = await AsyncCounterORM.save_counters(data['items'], int(time.time()), known_ids)
+            finished = time.monotonic()
+            logger.info(
+                f"Counters cycle: {saved} of {len(data['items'])} units saved in {finished - started:.2f}s "
+                f"(fetch {fetched - started:.2f}s, DB {finished - fetched:.2f}s)"
+            )
+            self.observe_poll('counters', started, saved)
+        return True
 
     async def get_states_since(self, runtime):
         start_ts, end_ts = runtime.end_ts, int(datetime.timestamp(datetime.now()))
 
         try:
-            transport_ids = CarORM.get_transport_ids('wialon')
+            transport_ids = await AsyncCarORM.get_transport_ids('wialon')
 
             for transport_id in transport_ids:
-                res = self.source.load_historical_messages_by_id(transport_id, start_ts, end_ts)
-                self.source.unload()
-                self.save_trips(transport_id, res.get('messages', []))
+                res = await self.source.get_historical_messages_by_id(transport_id, start_ts, end_ts)
+                await self.source.unload()
+                await self.save_trips(transport_id, res.get('messages', []))
                 await asyncio.sleep(10)
 
         except Exception as exc:
             logger.exception(exc)
 
     @staticmethod
-    def save_trips(transport_id, trips):
-        car = CarORM.get_car_by_id(transport_id)
-        for trip in trips:
-            if trip['pos']['s'] > 3:
-                CarStateORM.save_unsent_telemetry(Transport(
-                    ts=trip['t'],
-                    is_sent=False,
-                    latitude=trip['pos']['y'],
-                    longitude=trip['pos']['x'],
-                    velocity=trip['pos']['s'],
-                    fuel_level=None,
-                    car_id=transport_id,
-                    ignition=trip['p'].get('io_239'),
-                    light=None,
-                    last_conn=trip['rt'],
-                    name=car.name
-                ))
-
-    async def get_avls(self, discreteness: int):
+    async def save_trips(transport_id, trips):
+        car = await AsyncCarORM.get_car_by_id(transport_id)
+        await AsyncCarStateORM.save_unsent_telemetry_list([
+            Transport(
+                ts=trip['t'],
+                is_sent=False,
+                latitude=trip['pos']['y'],
+                longitude=trip['pos']['x'],
+                velocity=trip['pos']['s'],
+                fuel_level=None,
+                car_id=transport_id,
+                ignition=trip['p'].get('io_239'),
+                light=None,
+                last_conn=trip['rt'],
+                name=car.name
+            ) for trip in trips if trip['pos']['s'] > 3
+        ])
+
+    async def get_avls(self):
+        """
+        Consume AVL events of the session. Polls sequentially with the delay adapted to the event rate
+        :return:
+        """
         while True:
-            logger.info('Fetching states')
-            try:
-                data = self.source.get_avl_event()
-            except (RequestsConnectionError, NameResolutionError, TimeoutError, RemoteDisconnected) as exc:
-                self.source.reinitialize_session(CarORM.get_transport_ids('wialon'))
-                logger.exception(f"Exception trying to fetch transport states: {exc}")
+            delay = await self.poll_avl_events()
+            if delay is None:
                 await asyncio.sleep(10)
+                try:
+                    await self.source.reinitialize_session(list(self.unit_ids))
+                except Exception as exc:
+                    logger.exception(f"Exception trying to reinitialize session: {exc}")
                 continue
-
-            if not data:
-                continue
-            for event in data.get('events', []):
+            await asyncio.sleep(delay)
+
+    async def poll_avl_events(self) -> float | None:
+        """
+        Fetch AVL events once, queue telemetry and alarms and flush the destination. Traced as one span
+        :return: delay before the next poll. None if events were not fetched
+        """
+        started = time.monotonic()
+        with tracer.span('wialon.avl_poll', connector=self.name) as span:
+            try:
+                data = await self.source.get_avl_event()
+            except (ConnectionError, TimeoutError) as exc:
+                logger.exception(f"Exception trying to fetch transport states: {exc}")
+                return None
+            except Exception as exc:
+                # E.g. undecodable response body. The consumer must keep running
+                logger.exception(f"Unexpected exception trying to fetch AVL events: {exc}")
+                return None
+
+            events = data.get('events', []) if data else []
+            span.set_attribute('events', len(events))
+            delay = self.avl_poller.record(len(events), time.monotonic() - started)
+            for event in events:
                 try:
                     if event['d'].get('tp') == 'ud':
                         await self.parse_transport_state(event)
@@ -180,7 +255,10 @@ class WialonConnector(AbstractConnector):
                     logger.exception(event)
                     logger.exception(e)
 
-            await asyncio.sleep(discreteness)
+            if events and self.destination:
+                self.destination.flush()
+        self.observe_poll('avl_events', started, len(events))
+        return delay
 
     async def parse_violation(self, event):
         if event['d']['f'] == 1537:
@@ -198,14 +276,24 @@ class WialonConnector(AbstractConnector):
                 car_id=event['i'],
                 place=json.loads(event['d']['p'].get('task_tags', '')).get('ZONE', '')
             )
-            car = CarORM.get_car_by_id(a.car_id)
+            car = self.registry.get(a.car_id)
+            if not car:
+                logger.warning(f"Alarm for unknown car: {a.car_id}")
+                return
             logger.warning(f"{a}, {car.name}")
-            if not self.rest_client or not self.rest_client.post_alarm(a, car.name):
-                # TODO: Save to DB.
-                pass
+            if self.alarm_dispatcher:
+                self.alarm_dispatcher.dispatch(a, car.name)
+            else:
+                await AsyncAlarmORM.save_unsent_alarms([a])
 
     async def parse_transport_state(self, event):
-        if event.get('d', {}).get('pos'):
+        if not event.get('d', {}).get('pos'):
+            return
+        # lag_s is the age of the message when it was received
+        with tracer.span('wialon.ud_event', car_id=event['i'], lag_s=round(time.time() - event['d']['t'], 3)):
+            name = self.registry.name(event['i'])
+            if name is None:
+                return
             t = Transport(
                 ts=event['d']['t'],
                 is_sent=False,
@@ -217,10 +305,12 @@ class WialonConnector(AbstractConnector):
                 ignition=event['d']['pos'].get('io_239'),
                 light=None,
                 last_conn=event['d']['rt'],
-                name=CarORM.get_car_by_id(event['i']).name
+                name=name
             )
-            if not self.destination or not self.destination.send_data(*t.form_mqtt_message()):
-                CarStateORM.save_unsent_telemetry(t)
+            if self.destination:
+                self.queue_changes(t)
+            else:
+                await AsyncCarStateORM.save_unsent_telemetry(t)
 
     # async def send_day_report(self, hour=6, minute=0, second=0):
     #     start_ts = int(datetime.timestamp((datetime.now() - timedelta(days=1)).replace(hour=0, minute=0, second=0)))
@@ -228,92 +318,122 @@ class WialonConnector(AbstractConnector):
     #
     #     counters = CounterORM.get_counters_for_period(start_ts, end_ts)
 
-    async def fetch_transport_states(self, discreteness: int):
-        while True:
-            logger.info('Fetching states')
-            try:
-                data = self.source.get_transports()
-            except (RequestsConnectionError, NameResolutionError, TimeoutError, RemoteDisconnected) as exc:
-                logger.exception(f"Exception trying to fetch transport states: {exc}")
-                await asyncio.sleep(10)
-                continue
-            logger.info(f"Fetched {len(data['items'])} units")
-            telemetry = []
-
-            for transport in data['items']:
-                if transport['lmsg']['pos']:
-                    t = Transport(
-                        ts=transport['lmsg']['t'],
-                        is_sent=False,
-                        latitude=transport['lmsg']['pos']['y'],
-                        longitude=transport['lmsg']['pos']['x'],
-                        velocity=transport['lmsg']['pos']['s'],
-                        fuel_level=None,
-                        car_id=transport['id'],
-                        ignition=transport['lmsg']['p'].get('io_239'),
-                        light=None,
-                        last_conn=transport['lmsg']['rt'],
-                        name=self.transport_map.get(str(transport['id']))['nm']
-                    )
-                    telemetry.append(t)
-                    if not self.destination or not self.destination.send_data(*t.form_mqtt_message()):
-                        CarStateORM.save_unsent_telemetry(t)
+    async def fetch_transport_states(self) -> bool:
+        """
+        Fetch last messages of all units and queue changed telemetry. AVL events are used instead while running
+        :return: False if states were not fetched
+        """
+        logger.info('Fetching states')
+        try:
+            data = await self.source.get_transports()
+        except (ConnectionError, TimeoutError) as exc:
+            logger.exception(f"Exception trying to fetch transport states: {exc}")
+            return False
+        if not data:
+            return False
+        logger.info(f"Fetched {len(data['items'])} units")
+
+        for transport in data['items']:
+            name = self.registry.name(transport['id'])
+            if name and transport['lmsg']['pos']:
+                t = Transport(
+                    ts=transport['lmsg']['t'],
+                    is_sent=False,
+                    latitude=transport['lmsg']['pos']['y'],
+                    longitude=transport['lmsg']['pos']['x'],
+                    velocity=transport['lmsg']['pos']['s'],
+                    fuel_level=None,
+                    car_id=transport['id'],
+                    ignition=transport['lmsg']['p'].get('io_239'),
+                    light=None,
+                    last_conn=transport['lmsg']['rt'],
+                    name=name
+                )
+                if self.destination:
+                    self.queue_changes(t)
+                else:
+                    await AsyncCarStateORM.save_unsent_telemetry(t)
 
-            await asyncio.sleep(discreteness)
+        if self.destination:
+            self.destination.flush()
+        return True
 
     async def fetch_notifications(self, discreteness):
         while True:
             try:
-                events = self.source.get_messages()
+                events = await self.source.get_messages()
                 logger.info(json.dumps(events))
-            except (RequestsConnectionError, NameResolutionError, TimeoutError, RemoteDisconnected) as exc:
+            except (ConnectionError, TimeoutError) as exc:
                 logger.exception(f"Exception trying to fetch updates: {exc}")
                 await asyncio.sleep(10)
                 continue
 
             await asyncio.sleep(discreteness)
 
-    async def check_transport_with_discreteness(self, discreteness: int):
-        while True:
-            try:
-                transports_result = self.source.get_transport_list()
-            except (RequestsConnectionError, NameResolutionError, TimeoutError, RemoteDisconnected) as exc:
-                logger.exception(f"Exception trying to fetch transport list: {exc}")
-                await asyncio.sleep(10)
+    @traced('wialon.fleet_sync')
+    async def check_transport(self) -> bool:
+        """
+        Synchronize owned units of the account with DB and registry and load them into the session.
+        Scheduled daily
+        :return: False if unit list was not fetched or units were not loaded into the session
+        """
+        try:
+            transports_result = await self.source.get_transport_list()
+        except (ConnectionError, TimeoutError) as exc:
+            logger.exception(f"Exception trying to fetch transport list: {exc}")
+            return False
+        if not transports_result:
+            return False
+        transports = transports_result.get('items', [])
+        logger.info(f"Fetched {len(transports)} units")
+        changed, added, unit_ids = [], 0, set()
+        for transport in transports:
+            props = parse_unit(transport)
+            if props is None:
                 continue
-            transports = transports_result.get('items', [])
-            logger.info(f"Fetched {len(transports)} units")
-            transport_props = []
-            mobile_group_regex = re.compile(r'[мМM][гГ]\s?-\s?\d{1,4}\D')
-            for transport in transports:
-
-                department = [field['v'] for field in transport['pflds'].values() if field['n'] == 'vehicle_type']
-                model =[field['v'] for field in transport['pflds'].values() if field['n'] == 'brand']
-                reg_number = [field['v'] for field in transport['pflds'].values() if field['n'] == 'color']
-
-                if len(reg_number) == 0:
-                    continue
-
-                reg_number = re.sub('[_\-|\s]', '', reg_number[0])
-
-                mobile_group_matches = re.findall(mobile_group_regex, transport['nm'])
-                if mobile_group_matches:
-                    mobile_group = mobile_group_matches[0].replace(' ', '')
-                    name = f'{mobile_group} {reg_number}'
-                else:
-                    name = reg_number
-
-                transport_props.append({
-                    "id": transport['id'],
-                    "name": name,
-                    'department': department[0] if department else None,
-                    'model': model[0] if model else None,
-                    'reg_number': reg_number,
-                    'source': 'wialon'
-                })
-            CarORM.add_wialon_transport_if_not_exists(transport_props)
-            self.load_transport_in_memory(transports)
-            await asyncio.sleep(discreteness)
+            unit_ids.add(props['id'])
+            if not self.owns(props['id']):
+                continue
+            car = self.registry.get(props['id'])
+            if car is None:
+                added += 1
+                changed.append(props)
+            elif car.name != props['name'] or car.reg_number != props['reg_number']:
+                changed.append(props)
+
+        if changed:
+            await AsyncCarORM.upsert_cars(changed)
+            await self.registry.refresh_async()
+            logger.info(f"Wialon units synchronized: {added} added, {len(changed) - added} renamed")
+        self.load_transport_in_memory(transports)
+        self.account_unit_ids = unit_ids
+        return await self.rebalance()
+
+    async def rebalance(self) -> bool:
+        """
+        Load owned units of the account into the session and remove the ones owned by other processes now
+        :return: False if session was not updated
+        """
+        owned = {unit_id for unit_id in self.account_unit_ids if self.owns(unit_id)}
+        new_ids, removed_ids = owned - self.unit_ids, self.unit_ids - owned
+        try:
+            if new_ids:
+                # Units taken over from another process may have been added to cars table by it
+                await self.registry.refresh_async()
+                # The first load sets units of the session, later ones add to it
+                await self.source.manage_session_units(list(new_ids), mode=1 if self.unit_ids else 0)
+                self.unit_ids |= new_ids
+            if removed_ids:
+                await self.source.manage_session_units(list(removed_ids), mode=2)
+                self.unit_ids -= removed_ids
+        except (ConnectionError, TimeoutError) as exc:
+            logger.exception(f"Exception trying to update session units: {exc}")
+            return False
+        for unit_id in removed_ids:
+            self.last_states.forget(unit_id)
+        if new_ids or removed_ids:
+            logger.info(f"{self.name}: {len(new_ids)} units added to session, {len(removed_ids)} removed")
+        return True
 
     def load_transport_in_memory(self, transports):
         self.transport_map = {str(transport['id']):transport for transport in transports}
@@ -0,0 +1,116 @@
+"""Buffered writer of unsent telemetry into car_states table"""
+import asyncio
+import logging
+import os
+from collections import deque
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from database.queries import AsyncCarStateORM, CarStateORM
+from telemetry_objects.transport import Transport
+from tracing import tracer
+
+
+logger = logging.getLogger(os.environ.get("LOGGER"))
+
+
+class TelemetryBacklog:
+    """
+    Collects unsent Transport objects in a bounded in-memory queue and writes them
+    with one multi-row INSERT per flush instead of one transaction per state.
+    """
+
+    def __init__(self, max_size: int = 100000, flush_size: int = 1000, flush_interval: float = 5.0):
+        self.max_size = max_size
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._queue: deque[Transport] = deque()
+        self._flush_requested = asyncio.Event()
+
+    def __len__(self):
+        return len(self._queue)
+
+    def add(self, transport: Transport):
+        """
+        Queue single unsent state
+        :param transport: Transport object
+        :return:
+        """
+        self.extend([transport])
+
+    def extend(self, transports: list[Transport]):
+        """
+        Queue unsent states. Wakes run() to flush early when flush_size is reached.
+        :param transports: list of Transport objects
+        :return:
+        """
+        self._queue.extend(transports)
+        self._trim()
+        if len(self._queue) >= self.flush_size:
+            self._flush_requested.set()
+
+    def flush(self):
+        """
+        Write all queued states to DB, blocking the caller. Used on shutdown, when the event loop is stopped.
+        On DB error states are kept in the queue for the next flush.
+        :return:
+        """
+        if not self._queue:
+            return
+        telemetry = list(self._queue)
+        self._queue.clear()
+        with tracer.span('backlog.flush', states=len(telemetry)):
+            try:
+                CarStateORM.save_unsent_telemetry_list(telemetry)
+            except SQLAlchemyError as exc:
+                self._requeue(telemetry, exc)
+
+    async def flush_async(self):
+        """
+        Same as flush, but awaits the write instead of blocking the event loop
+        :return:
+        """
+        if not self._queue:
+            return
+        telemetry = list(self._queue)
+        self._queue.clear()
+        with tracer.span('backlog.flush', states=len(telemetry)):
+            try:
+                await AsyncCarStateORM.save_unsent_telemetry_list(telemetry)
+            except SQLAlchemyError as exc:
+                self._requeue(telemetry, exc)
+
+    def _requeue(self, telemetry: list[Transport], exc: Exception):
+        """
+        Put states which failed to be saved back in front of the queue
+        :param telemetry: list of Transport objects
+        :param exc: DB error
+        :return:
+        """
+        logger.exception(f"Exception trying to save {len(telemetry)} unsent states: {exc}")
+        self._queue.extendleft(reversed(telemetry))
+        self._trim()
+
+    def _trim(self):
+        """
+        Keep queue bounded by dropping the oldest states
+        :return:
+        """
+        overflow = len(self._queue) - self.max_size
+        if overflow > 0:
+            logger.warning(f"Telemetry backlog is full. Dropping {overflow} oldest states")
+            for _ in range(overflow):
+                self._queue.popleft()
+
+    async def run(self):
+        """
+        Flush queued states every flush_interval seconds or as soon as flush_size states are queued
+        :return:
+        """
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_requested.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_requested.clear()
+            await self.flush_async()
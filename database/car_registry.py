@@ -0,0 +1,97 @@
+"""In-process registry of cars. Resolves car attributes on hot paths without a DB round trip"""
+import logging
+import os
+from typing import NamedTuple
+
+from database.queries import AsyncCarORM, CarORM
+
+
+logger = logging.getLogger(os.environ.get("LOGGER"))
+
+
+class CarEntry(NamedTuple):
+    name: str
+    is_hidden: bool
+    source: str
+    reg_number: str | None
+
+
+class CarRegistry:
+    """
+    Maps car id to CarEntry. Loaded from cars table once and refreshed after every fleet sync.
+    One instance is shared by all connectors and destinations.
+    """
+
+    def __init__(self):
+        self._cars: dict[int, CarEntry] = {}
+
+    def __len__(self):
+        return len(self._cars)
+
+    def __contains__(self, car_id) -> bool:
+        return int(car_id) in self._cars
+
+    def load(self):
+        """
+        (Re)load all cars from DB
+        :return:
+        """
+        self._cars = {
+            car_id: CarEntry(name, bool(is_hidden), source, reg_number)
+            for car_id, name, is_hidden, source, reg_number in CarORM.get_registry_entries()
+        }
+        logger.info(f"Car registry loaded: {len(self._cars)} cars")
+
+    async def load_async(self):
+        """
+        (Re)load all cars from DB without blocking the event loop
+        :return:
+        """
+        self._cars = {
+            car_id: CarEntry(name, bool(is_hidden), source, reg_number)
+            for car_id, name, is_hidden, source, reg_number in await AsyncCarORM.get_registry_entries()
+        }
+        logger.info(f"Car registry loaded: {len(self._cars)} cars")
+
+    def refresh(self):
+        """
+        Reload registry after cars table was synchronized with a source
+        :return:
+        """
+        self.load()
+
+    async def refresh_async(self):
+        """
+        Reload registry after cars table was synchronized with a source without blocking the event loop
+        :return:
+        """
+        await self.load_async()
+
+    def get(self, car_id: int | str) -> CarEntry | None:
+        """
+        Get car by its ID
+        :param car_id: Car.id
+        :return: CarEntry or None if car is unknown
+        """
+        return self._cars.get(int(car_id))
+
+    def name(self, car_id: int | str) -> str | None:
+        """
+        Get car name by its ID
+        :param car_id: Car.id
+        :return: name or None if car is unknown
+        """
+        car = self._cars.get(int(car_id))
+        return car.name if car else None
+
+    def ids(self, source: str | None = None, include_hidden: bool = True) -> list[int]:
+        """
+        Get car IDs
+        :param source: filter by Car.source if given
+        :param include_hidden: whether to include hidden cars
+        :return: list of IDs
+        """
+        return [
+            car_id for car_id, car in self._cars.items()
+            if (source is None or car.source == source) and (include_hidden or not car.is_hidden)
+        ]
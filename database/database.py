@@ -1,7 +1,7 @@
 """Database configuration file"""
 import os
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, make_url
 from sqlalchemy.orm import sessionmaker, DeclarativeBase
 
 # Get DB variables from the environment
@@ -9,11 +9,44 @@ DB_USERNAME = os.environ.get('DB_USERNAME')
 DB_PASSWORD = os.environ.get("DB_PASSWORD")
 DB_ADDRESS = os.environ.get("DB_ADDRESS")
 DB_NAME = os.environ.get("DB_NAME")
+DATABASE_URL = os.environ.get("DATABASE_URL") or f"postgresql://{DB_USERNAME}:{DB_PASSWORD}@{DB_ADDRESS}/{DB_NAME}"
+
+# Pool and session settings
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 20))
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "1").lower() in ("1", "true", "yes")
+# Milliseconds. 0 - no limit
+DB_STATEMENT_TIMEOUT = int(os.environ.get("DB_STATEMENT_TIMEOUT", 0))
+DB_ASYNC = os.environ.get("DB_ASYNC", "").lower() in ("1", "true", "yes")
 
 # Creating engine and session factory for the whole project
-engine = create_engine(f"postgresql://{DB_USERNAME}:{DB_PASSWORD}@{DB_ADDRESS}/{DB_NAME}")
+engine = create_engine(
+    DATABASE_URL,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_recycle=DB_POOL_RECYCLE,
+    pool_pre_ping=DB_POOL_PRE_PING,
+    connect_args={'options': f'-c statement_timeout={DB_STATEMENT_TIMEOUT}'} if DB_STATEMENT_TIMEOUT else {}
+)
 Session = sessionmaker(bind=engine)
 
+# asyncpg engine used by async ORM classes. Without it they run the sync ones in a worker thread
+async_engine = None
+AsyncSession = None
+if DB_ASYNC:
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+    async_engine = create_async_engine(
+        make_url(DATABASE_URL).set(drivername='postgresql+asyncpg'),
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        connect_args={'server_settings': {'statement_timeout': str(DB_STATEMENT_TIMEOUT)}} if DB_STATEMENT_TIMEOUT else {}
+    )
+    AsyncSession = async_sessionmaker(async_engine, expire_on_commit=False)
+
 
 class Base(DeclarativeBase):
     """Just a standard Base class for models."""
@@ -21,8 +54,19 @@ class Base(DeclarativeBase):
 
 
 def db_init():
-    """Create all tables if not exit yet."""
+    """Create all tables and indexes if not exit yet."""
     Base.metadata.create_all(engine)
+    # create_all skips indexes of tables that already exist
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+
+
+async def db_close():
+    """Dispose connection pools. Called on shutdown."""
+    if async_engine is not None:
+        await async_engine.dispose()
+    engine.dispose()
 
 
 class DataBase:
@@ -1,5 +1,8 @@
 """Here describe all database tables for the project. We use SQLAlchemy classes for it."""
-from sqlalchemy import String, Integer, Boolean, ForeignKey, Float
+import os
+from datetime import date
+
+from sqlalchemy import String, Integer, BigInteger, Boolean, Date, ForeignKey, Float, Index, Text, UniqueConstraint
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from database.database import Base
@@ -7,6 +10,10 @@ from database.database import Base
 from typing import List
 
 
+# Create counters as a table partitioned by month of ts. Applies to newly created table only.
+COUNTERS_PARTITIONED = os.environ.get('DB_PARTITION_COUNTERS', '').lower() in ('1', 'true', 'yes')
+
+
 class Car(Base):
     __tablename__ = 'cars'
 
@@ -31,6 +38,9 @@ class Sensor(Base):
 
 class CarState(Base):
     __tablename__ = 'car_states'
+    __table_args__ = (
+        Index('ix_car_states_car_id_ts', 'car_id', 'ts'),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     ts: Mapped[int] = mapped_column(Integer)
@@ -64,9 +74,49 @@ class RunTime(Base):
 
 class Counter(Base):
     __tablename__ = 'counters'
+    __table_args__ = (
+        Index('ix_counters_car_id_ts', 'car_id', 'ts'),
+        {'postgresql_partition_by': 'RANGE (ts)'} if COUNTERS_PARTITIONED else {},
+    )
 
     id: Mapped[int] = mapped_column(Integer, autoincrement=True, primary_key=True)
     mileage: Mapped[int] = mapped_column(Integer, nullable=True)
     engine_seconds: Mapped[float] = mapped_column(Integer, nullable=True)
-    ts: Mapped[int] = mapped_column(Integer)
+    # Partition key has to be a part of the primary key
+    ts: Mapped[int] = mapped_column(Integer, primary_key=COUNTERS_PARTITIONED)
     car_id: Mapped[int] = mapped_column(ForeignKey('cars.id'))
+
+
+class CounterDaily(Base):
+    """Per-car and per-day range of counters. Updated on every counters insert"""
+    __tablename__ = 'counter_daily'
+
+    car_id: Mapped[int] = mapped_column(ForeignKey('cars.id'), primary_key=True)
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    mileage_min: Mapped[int] = mapped_column(Integer, nullable=True)
+    mileage_max: Mapped[int] = mapped_column(Integer, nullable=True)
+    engine_seconds_min: Mapped[int] = mapped_column(Integer, nullable=True)
+    engine_seconds_max: Mapped[int] = mapped_column(Integer, nullable=True)
+
+
+class UnsentAlarm(Base):
+    """Alarms which were not delivered to the core yet. Columns follow Alarm.to_model()"""
+    __tablename__ = 'alarms'
+    # Wialon reuses id, car_id and date_of_creation for every violation of one notification task
+    __table_args__ = (
+        UniqueConstraint('id', 'car_id', 'date_of_creation', 'record_date', 'title', name='uq_alarms_identity'),
+    )
+
+    pk: Mapped[int] = mapped_column(BigInteger, autoincrement=True, primary_key=True)
+    id: Mapped[int] = mapped_column(BigInteger)
+    car_id: Mapped[int] = mapped_column(Integer)
+    date_of_creation: Mapped[int] = mapped_column(Integer)
+    title: Mapped[str] = mapped_column(String(256))
+    message: Mapped[str] = mapped_column(Text, nullable=True)
+    level: Mapped[str] = mapped_column(String(16))
+    lat: Mapped[float] = mapped_column(Float, nullable=True)
+    lon: Mapped[float] = mapped_column(Float, nullable=True)
+    record_date: Mapped[int] = mapped_column(Integer)
+    driver_first_name: Mapped[str] = mapped_column(String(128), nullable=True)
+    driver_last_name: Mapped[str] = mapped_column(String(128), nullable=True)
+    place: Mapped[str] = mapped_column(String(256), nullable=True)
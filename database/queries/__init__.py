@@ -1,9 +1,18 @@
+from .alarm_orm import AlarmORM
 from .car_orm import CarORM
 from .car_state_orm import CarStateORM
 from .counter_orm import CounterORM
 from .device_orm import DeviceORM
 from .run_time_orm import RunTimeORM
 from .sensor_orm import SensorORM
+from .async_alarm_orm import AsyncAlarmORM
+from .async_car_orm import AsyncCarORM
+from .async_car_state_orm import AsyncCarStateORM
+from .async_counter_orm import AsyncCounterORM
+from .async_sensor_orm import AsyncSensorORM
 
 
-__all__ = ['CarORM', 'CarStateORM', 'CounterORM', 'DeviceORM', 'RunTimeORM', 'SensorORM']
+__all__ = [
+    'AlarmORM', 'CarORM', 'CarStateORM', 'CounterORM', 'DeviceORM', 'RunTimeORM', 'SensorORM',
+    'AsyncAlarmORM', 'AsyncCarORM', 'AsyncCarStateORM', 'AsyncCounterORM', 'AsyncSensorORM'
+]
@@ -0,0 +1,72 @@
+import logging
+import os
+
+from sqlalchemy import select, delete, tuple_
+from sqlalchemy.dialects.postgresql import insert
+
+from database.database import Session
+from database.models import UnsentAlarm
+from metrics import timed_methods
+from metrics.instruments import DB_SECONDS
+from telemetry_objects.alarm import Alarm
+
+
+logger = logging.getLogger(os.environ.get("LOGGER"))
+
+# Columns of uq_alarms_identity in the order of Alarm.key()
+IDENTITY = (
+    UnsentAlarm.id, UnsentAlarm.car_id, UnsentAlarm.date_of_creation, UnsentAlarm.record_date, UnsentAlarm.title
+)
+
+
+@timed_methods(DB_SECONDS)
+class AlarmORM:
+    """__tablename__ = 'alarms'"""
+
+    @staticmethod
+    def save_unsent_alarms(alarms: list[Alarm]):
+        """
+        Save alarms which were not delivered. Already saved alarms are skipped
+        :param alarms: list of Alarm objects
+        :return:
+        """
+        if not alarms:
+            return
+        logger.warning(f"Save unsent alarms: {len(alarms)}")
+        rows = []
+        for alarm in alarms:
+            row = alarm.to_model()
+            row['car_id'] = int(row['car_id'])
+            rows.append(row)
+        with Session() as session:
+            session.execute(insert(UnsentAlarm).on_conflict_do_nothing(), rows)
+            session.commit()
+
+    @staticmethod
+    def get_unsent_alarms(limit: int = 500) -> list[UnsentAlarm]:
+        """
+        Get the oldest unsent alarms
+        :param limit: max number of alarms
+        :return: list of UnsentAlarm objects
+        """
+        with Session() as session:
+            query = select(UnsentAlarm).order_by(UnsentAlarm.date_of_creation, UnsentAlarm.pk).limit(limit)
+            return session.execute(query).scalars().all()
+
+    @staticmethod
+    def delete_unsent_alarms(alarms: list[Alarm]):
+        """
+        Delete delivered alarms
+        :param alarms: list of Alarm objects
+        :return:
+        """
+        if not alarms:
+            return
+        keys = [alarm.key() for alarm in alarms]
+        with Session() as session:
+            session.execute(
+                delete(UnsentAlarm)
+                .where(tuple_(*IDENTITY).in_(keys))
+                .execution_options(synchronize_session=False)
+            )
+            session.commit()
@@ -0,0 +1,75 @@
+import asyncio
+import logging
+import os
+
+from sqlalchemy import select, delete, tuple_
+from sqlalchemy.dialects.postgresql import insert
+
+from database.database import AsyncSession
+from database.models import UnsentAlarm
+from database.queries.alarm_orm import IDENTITY, AlarmORM
+from metrics import timed_methods
+from metrics.instruments import DB_SECONDS
+from telemetry_objects.alarm import Alarm
+
+
+logger = logging.getLogger(os.environ.get("LOGGER"))
+
+
+@timed_methods(DB_SECONDS)
+class AsyncAlarmORM:
+    """Async variant of AlarmORM. Uses asyncpg when DB_ASYNC is set, AlarmORM in a worker thread otherwise"""
+
+    @staticmethod
+    async def save_unsent_alarms(alarms: list[Alarm]):
+        """
+        Save alarms which were not delivered. Already saved alarms are skipped
+        :param alarms: list of Alarm objects
+        :return:
+        """
+        if not alarms:
+            return
+        if AsyncSession is None:
+            return await asyncio.to_thread(AlarmORM.save_unsent_alarms, alarms)
+        logger.warning(f"Save unsent alarms: {len(alarms)}")
+        rows = []
+        for alarm in alarms:
+            row = alarm.to_model()
+            row['car_id'] = int(row['car_id'])
+            rows.append(row)
+        async with AsyncSession() as session:
+            await session.execute(insert(UnsentAlarm).on_conflict_do_nothing(), rows)
+            await session.commit()
+
+    @staticmethod
+    async def get_unsent_alarms(limit: int = 500) -> list[UnsentAlarm]:
+        """
+        Get the oldest unsent alarms
+        :param limit: max number of alarms
+        :return: list of UnsentAlarm objects
+        """
+        if AsyncSession is None:
+            return await asyncio.to_thread(AlarmORM.get_unsent_alarms, limit)
+        async with AsyncSession() as session:
+            query = select(UnsentAlarm).order_by(UnsentAlarm.date_of_creation, UnsentAlarm.pk).limit(limit)
+            return (await session.execute(query)).scalars().all()
+
+    @staticmethod
+    async def delete_unsent_alarms(alarms: list[Alarm]):
+        """
+        Delete delivered alarms
+        :param alarms: list of Alarm objects
+        :return:
+        """
+        if not alarms:
+            return
+        if AsyncSession is None:
+            return await asyncio.to_thread(AlarmORM.delete_unsent_alarms, alarms)
+        keys = [alarm.key() for alarm in alarms]
+        async with AsyncSession() as session:
+            await session.execute(
+                delete(UnsentAlarm)
+                .where(tuple_(*IDENTITY).in_(keys))
+                .execution_options(synchronize_session=False)
+            )
+            await session.commit()
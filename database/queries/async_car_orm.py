@@ -0,0 +1,77 @@
+import asyncio
+
+from sqlalchemy import select
+
+from database.database import AsyncSession
+from database.models import Car
+from database.queries.car_orm import CarORM
+from metrics import timed_methods
+from metrics.instruments import DB_SECONDS
+from tracing import traced_methods
+
+
+@traced_methods
+@timed_methods(DB_SECONDS)
+class AsyncCarORM:
+    """
+    Async variant of CarORM. Uses asyncpg when DB_ASYNC is set, CarORM in a worker thread otherwise.
+    Fleet sync upserts run once a day and always use CarORM in a worker thread.
+    """
+
+    @staticmethod
+    async def get_transport_ids(source: str | None = None) -> list[int]:
+        """
+        Get all transport IDs.
+        :param source: query parameter for 'source' column.
+        :return: list of IDs.
+        """
+        if AsyncSession is None:
+            return await asyncio.to_thread(CarORM.get_transport_ids, source)
+        query = select(Car.id)
+        if source:
+            query = query.where(Car.source == source)
+        async with AsyncSession() as session:
+            return (await session.execute(query)).scalars().all()
+
+    @staticmethod
+    async def get_car_by_id(car_id: int) -> Car:
+        """
+        Get car by its ID.
+        :param car_id: Car.id
+        :return: Car
+        """
+        if AsyncSession is None:
+            return await asyncio.to_thread(CarORM.get_car_by_id, car_id)
+        async with AsyncSession() as session:
+            return await session.get(Car, car_id)
+
+    @staticmethod
+    async def get_registry_entries() -> list[tuple]:
+        """
+        Get cars with columns needed by the in-memory car registry
+        :return: list of (id, name, is_hidden, source, reg_number) rows
+        """
+        if AsyncSession is None:
+            return await asyncio.to_thread(CarORM.get_registry_entries)
+        async with AsyncSession() as session:
+            query = select(Car.id, Car.name, Car.is_hidden, Car.source, Car.reg_number)
+            return (await session.execute(query)).all()
+
+    @staticmethod
+    async def add_transport_if_not_exists(transports: list[dict]) -> tuple[int, int]:
+        """
+        See CarORM.add_transport_if_not_exists
+        :param transports: dictionary representation of transport
+        :return: numbers of inserted and updated cars
+        """
+        return await asyncio.to_thread(CarORM.add_transport_if_not_exists, transports)
+
+    @staticmethod
+    async def upsert_cars(cars: list[dict], update_columns: tuple[str, ...] = ('name', 'reg_number')):
+        """
+        See CarORM.upsert_cars
+        :param cars: dictionary representations of cars, all with the same keys
+        :param update_columns: columns to overwrite when car already exists
+        :return:
+        """
+        await asyncio.to_thread(CarORM.upsert_cars, cars, update_columns)
@@ -0,0 +1,96 @@
+import asyncio
+import logging
+import os
+
+from sqlalchemy import insert, delete, select, tuple_, any_, bindparam, Integer
+from sqlalchemy.dialects.postgresql import ARRAY
+
+from database.database import AsyncSession
+from database.models import CarState
+from database.queries.car_state_orm import ESTIMATE_ROWS, CarStateORM
+from metrics import timed_methods
+from metrics.instruments import DB_SECONDS
+from tracing import traced_methods
+from telemetry_objects.transport import Transport
+
+
+logger = logging.getLogger(os.environ.get("LOGGER"))
+
+
+@traced_methods
+@timed_methods(DB_SECONDS)
+class AsyncCarStateORM:
+    """Async variant of CarStateORM. Uses asyncpg when DB_ASYNC is set, CarStateORM in a worker thread otherwise"""
+
+    @staticmethod
+    async def get_history_batch(after: tuple[int, int, int] | None = None, limit: int = 5000) -> list[CarState]:
+        """
+        Get next page of CarState objects ordered by (car_id, ts, id) using keyset pagination
+        :param after: (car_id, ts, id) of the last row of the previous page. None for the first page
+        :param limit: page size
+        :return: list of CarState objects
+        """
+        if AsyncSession is None:
+            return await asyncio.to_thread(CarStateORM.get_history_batch, after, limit)
+        query = select(CarState).order_by(CarState.car_id, CarState.ts, CarState.id).limit(limit)
+        if after is not None:
+            query = query.where(tuple_(CarState.car_id, CarState.ts, CarState.id) > tuple_(*after))
+        async with AsyncSession() as session:
+            return (await session.execute(query)).scalars().all()
+
+    @staticmethod
+    async def estimate_car_states() -> int:
+        """
+        Get estimated number of unsent states from planner statistics. Does not scan the table
+        :return:
+        """
+        if AsyncSession is None:
+            return await asyncio.to_thread(CarStateORM.estimate_car_states)
+        async with AsyncSession() as session:
+            result = await session.execute(ESTIMATE_ROWS, {'table': CarState.__tablename__})
+            return max(0, int(result.scalar_one() or 0))
+
+    @staticmethod
+    async def delete_car_states_by_ids(ids: list[int]) -> int:
+        """
+        Delete CarState rows with one DELETE ... WHERE id = ANY(...)
+        :param ids: list of CarState.id
+        :return: number of deleted rows
+        """
+        if not ids:
+            return 0
+        if AsyncSession is None:
+            return await asyncio.to_thread(CarStateORM.delete_car_states_by_ids, ids)
+        async with AsyncSession() as session:
+            result = await session.execute(
+                delete(CarState)
+                .where(CarState.id == any_(bindparam('ids', value=list(ids), type_=ARRAY(Integer))))
+                .execution_options(synchronize_session=False)
+            )
+            await session.commit()
+            return result.rowcount
+
+    @staticmethod
+    async def save_unsent_telemetry_list(telemetry: list[Transport]):
+        """
+        Save CarState objects with one multi-row INSERT
+        :param telemetry: list of Transport objects
+        :return:
+        """
+        if not telemetry:
+            return
+        if AsyncSession is None:
+            return await asyncio.to_thread(CarStateORM.save_unsent_telemetry_list, telemetry)
+        logger.warning(f"Save unsent telemetry list: {len(telemetry)} states")
+        async with AsyncSession() as session:
+            await session.execute(insert(CarState), [data.to_model() for data in telemetry])
+            await session.commit()
+
+    @staticmethod
+    async def save_unsent_telemetry(telemetry: Transport):
+        """
+        Save single CarState object
+        :param telemetry: Transport object
+        :return:
+        """
+        await AsyncCarStateORM.save_unsent_telemetry_list([telemetry])
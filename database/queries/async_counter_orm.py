@@ -0,0 +1,97 @@
+import asyncio
+from datetime import date
+
+from sqlalchemy import insert, select
+from sqlalchemy.sql import exists
+
+from database.database import AsyncSession
+from database.models import Counter, Car
+from database.queries.counter_orm import CounterORM, counter_rows, daily_stats_query, rollup_upsert
+from metrics import timed_methods
+from metrics.instruments import DB_SECONDS
+
+
+@timed_methods(DB_SECONDS)
+class AsyncCounterORM:
+    """
+    Async variant of CounterORM. Uses asyncpg when DB_ASYNC is set, CounterORM in a worker thread otherwise.
+    Partition maintenance is DDL and always uses CounterORM in a worker thread.
+    """
+
+    @staticmethod
+    async def save_counter(mileage: int, engine_seconds: int, ts: int, car_id: int):
+        """
+        Save current state of transport counter and update its daily rollup
+        :param mileage: Current total mileage
+        :param engine_seconds: Current total engine working seconds
+        :param ts: Timestamp of the record
+        :param car_id: ID of the transport
+        :return:
+        """
+        if mileage is None and engine_seconds is None:
+            return
+        if AsyncSession is None:
+            return await asyncio.to_thread(CounterORM.save_counter, mileage, engine_seconds, ts, car_id)
+        async with AsyncSession() as session:
+            if (await session.execute(select(exists().where(Car.id == car_id)))).scalar():
+                session.add(Counter(
+                    mileage=mileage,
+                    engine_seconds=engine_seconds,
+                    ts=ts,
+                    car_id=car_id
+                ))
+                await session.execute(rollup_upsert([
+                    {'car_id': car_id, 'mileage': mileage, 'engine_seconds': engine_seconds, 'ts': ts}
+                ]))
+                await session.commit()
+
+    @staticmethod
+    async def save_counters(items: list[dict], ts: int, known_ids: set[int] | None = None) -> int:
+        """
+        Save counters of all units with one multi-row INSERT and update their daily rollup in the same transaction
+        :param items: items of WialonAsyncSource.get_counters_info()
+        :param ts: Timestamp of the records
+        :param known_ids: IDs of known cars. Items of other units are skipped
+        :return: number of saved counters
+        """
+        if AsyncSession is None:
+            return await asyncio.to_thread(CounterORM.save_counters, items, ts, known_ids)
+        rows = counter_rows(items, ts, known_ids)
+        if not rows:
+            return 0
+        async with AsyncSession() as session:
+            await session.execute(insert(Counter), rows)
+            await session.execute(rollup_upsert(rows))
+            await session.commit()
+        return len(rows)
+
+    @staticmethod
+    async def get_daily_stats(first_day: date, days: int = 1) -> list[tuple]:
+        """
+        Get mileage and engine working seconds of visible cars for every day of the period from the rollup
+        :param first_day: first day of the period
+        :param days: number of days
+        :return: list of (car_id, name, day, mileage, engine_seconds) rows
+        """
+        if AsyncSession is None:
+            return await asyncio.to_thread(CounterORM.get_daily_stats, first_day, days)
+        async with AsyncSession() as session:
+            return (await session.execute(daily_stats_query(first_day, days))).all()
+
+    @staticmethod
+    async def prune_counters(before_ts: int) -> int:
+        """
+        See CounterORM.prune_counters
+        :param before_ts: Timestamp
+        :return: number of deleted rows
+        """
+        return await asyncio.to_thread(CounterORM.prune_counters, before_ts)
+
+    @staticmethod
+    async def ensure_partitions(months_ahead: int = 2):
+        """
+        See CounterORM.ensure_partitions
+        :param months_ahead: number of future months to create partitions for
+        :return:
+        """
+        await asyncio.to_thread(CounterORM.ensure_partitions, months_ahead)
@@ -0,0 +1,34 @@
+import asyncio
+
+from sqlalchemy import select
+
+from database.database import AsyncSession
+from database.models import Sensor
+from database.queries.sensor_orm import SensorORM
+from metrics import timed_methods
+from metrics.instruments import DB_SECONDS
+
+
+@timed_methods(DB_SECONDS)
+class AsyncSensorORM:
+    """Async variant of SensorORM. Uses asyncpg when DB_ASYNC is set, SensorORM in a worker thread otherwise"""
+
+    @staticmethod
+    async def get_all_sensors() -> list[Sensor]:
+        """
+        Get all sensors
+        :return: list of Sensor objects
+        """
+        if AsyncSession is None:
+            return await asyncio.to_thread(SensorORM.get_all_sensors)
+        async with AsyncSession() as session:
+            return (await session.execute(select(Sensor))).scalars().all()
+
+    @staticmethod
+    async def add_sensors_if_not_exist(sensors: list[dict]) -> tuple[int, int]:
+        """
+        See SensorORM.add_sensors_if_not_exist
+        :param sensors: list of dictionaries
+        :return: numbers of inserted and updated sensors
+        """
+        return await asyncio.to_thread(SensorORM.add_sensors_if_not_exist, sensors)
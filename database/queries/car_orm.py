@@ -1,14 +1,20 @@
 import re
 
-from psycopg2.errors import UniqueViolation
-from sqlalchemy import select
-from sqlalchemy.exc import IntegrityError
-from sqlalchemy.sql import exists
+from sqlalchemy import and_, literal_column, select, tuple_
+from sqlalchemy.dialects.postgresql import insert
 
 from database.database import Session
 from database.models import Car
+from metrics import timed_methods
+from metrics.instruments import DB_SECONDS
+from tracing import traced_methods
 
 
+REG_NUMBER_STRIP_REGEX = re.compile(r'[_\-|\s]')
+
+
+@traced_methods
+@timed_methods(DB_SECONDS)
 class CarORM:
     """__tablename__ = 'cars'"""
 
@@ -63,45 +69,74 @@ class CarORM:
             return session.query(Car.name, Car.department, Car.model).where(Car.source == 'wialon').all()
 
     @staticmethod
-    def add_wialon_transport_if_not_exists(transports: list[dict]):
+    def upsert_cars(cars: list[dict], update_columns: tuple[str, ...] = ('name', 'reg_number')):
         """
-        Add transport with source == 'wialon' if not exists in DB already
-        :param transports: dictionary representation of transport
+        Insert new cars and update given columns of existing ones in one statement.
+        Cars of another source with the same ID are left untouched
+        :param cars: dictionary representations of cars, all with the same keys
+        :param update_columns: columns to overwrite when car already exists
         :return:
         """
+        if not cars:
+            return
+        stmt = insert(Car)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Car.id],
+            set_={column: stmt.excluded[column] for column in update_columns},
+            where=Car.source == stmt.excluded.source
+        )
         with Session() as session:
-            for transport in transports:
-                try:
-                    if not session.query(exists().where(Car.id == int(transport['id']))).scalar():
-                        session.add(Car(**transport))
-                        session.commit()
-                except (IntegrityError, UniqueViolation):
-                    pass
+            session.execute(stmt, cars)
+            session.commit()
 
     @staticmethod
-    def add_transport_if_not_exists(transports: list[dict]):
+    def add_transport_if_not_exists(transports: list[dict]) -> tuple[int, int]:
         """
-        Add transport if not exists in DB already
+        Add CityPoint transport and update name, model and registration number of existing one in one statement.
+        is_hidden of existing cars is left as is
         :param transports: dictionary representation of transport
-        :return:
+        :return: numbers of inserted and updated cars
+        """
+        rows = {}
+        for transport in transports:
+            attributes = transport.get('attributes', {})
+            reg_number = REG_NUMBER_STRIP_REGEX.sub('', attributes.get('RegNumber') or '')
+            rows[int(transport['id'])] = {
+                'id': int(transport['id']),
+                'name': reg_number,
+                'model': attributes.get('Model', ''),
+                'reg_number': reg_number,
+                'is_hidden': bool(attributes.get('IsHidden')),
+                'source': 'city_point'
+            }
+        if not rows:
+            return 0, 0
+
+        stmt = insert(Car).values(list(rows.values()))
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Car.id],
+            set_={'name': stmt.excluded.name, 'model': stmt.excluded.model, 'reg_number': stmt.excluded.reg_number},
+            where=and_(
+                Car.source == stmt.excluded.source,
+                tuple_(Car.name, Car.model, Car.reg_number).is_distinct_from(
+                    tuple_(stmt.excluded.name, stmt.excluded.model, stmt.excluded.reg_number)
+                )
+            )
+        ).returning(literal_column('xmax = 0'))
+        with Session() as session:
+            inserted_flags = session.execute(stmt).scalars().all()
+            session.commit()
+        inserted = sum(1 for flag in inserted_flags if flag)
+        return inserted, len(inserted_flags) - inserted
+
+    @staticmethod
+    def get_registry_entries() -> list[tuple]:
+        """
+        Get cars with columns needed by the in-memory car registry
+        :return: list of (id, name, is_hidden, source, reg_number) rows
         """
         with Session() as session:
-            for transport in transports:
-                try:
-                    if not session.query(exists().where(Car.id == int(transport['id']))).scalar():
-                        model = transport.get('attributes', {}).get('Model', '')
-                        reg_number = re.sub('[_\-|\s]', '', transport.get('attributes', {}).get('RegNumber', ''))
-                        session.add(Car(
-                            id=int(transport['id']),
-                            name=reg_number,
-                            model=model,
-                            reg_number=reg_number,
-                            is_hidden=transport.get('attributes', {}).get('IsHidden'),
-                            source='city_point'
-                        ))
-                        session.commit()
-                except (IntegrityError, UniqueViolation):
-                    pass
+            return session.query(Car.id, Car.name, Car.is_hidden, Car.source, Car.reg_number).all()
 
     @staticmethod
     def get_all_transport_names() -> list[tuple]:
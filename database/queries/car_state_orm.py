@@ -1,14 +1,25 @@
 import logging
 import os
 
+from sqlalchemy import insert, delete, select, text, tuple_, any_, bindparam, Integer
+from sqlalchemy.dialects.postgresql import ARRAY
+
 from database.database import Session
 from database.models import CarState
+from metrics import timed_methods
+from metrics.instruments import DB_SECONDS
+from tracing import traced_methods
 from telemetry_objects.transport import Transport
 
 
 logger = logging.getLogger(os.environ.get("LOGGER"))
 
+# reltuples is -1 until the table is analyzed for the first time
+ESTIMATE_ROWS = text("SELECT reltuples FROM pg_class WHERE oid = to_regclass(:table)")
+
 
+@traced_methods
+@timed_methods(DB_SECONDS)
 class CarStateORM:
 
     @staticmethod
@@ -25,6 +36,47 @@ class CarStateORM:
                 .limit(30) \
                 .all()
 
+    @staticmethod
+    def get_history_batch(after: tuple[int, int, int] | None = None, limit: int = 5000) -> list[CarState]:
+        """
+        Get next page of CarState objects ordered by (car_id, ts, id) using keyset pagination
+        :param after: (car_id, ts, id) of the last row of the previous page. None for the first page
+        :param limit: page size
+        :return: list of CarState objects
+        """
+        query = select(CarState).order_by(CarState.car_id, CarState.ts, CarState.id).limit(limit)
+        if after is not None:
+            query = query.where(tuple_(CarState.car_id, CarState.ts, CarState.id) > tuple_(*after))
+        with Session() as session:
+            return session.execute(query).scalars().all()
+
+    @staticmethod
+    def estimate_car_states() -> int:
+        """
+        Get estimated number of unsent states from planner statistics. Does not scan the table
+        :return:
+        """
+        with Session() as session:
+            return max(0, int(session.execute(ESTIMATE_ROWS, {'table': CarState.__tablename__}).scalar_one() or 0))
+
+    @staticmethod
+    def delete_car_states_by_ids(ids: list[int]) -> int:
+        """
+        Delete CarState rows with one DELETE ... WHERE id = ANY(...)
+        :param ids: list of CarState.id
+        :return: number of deleted rows
+        """
+        if not ids:
+            return 0
+        with Session() as session:
+            result = session.execute(
+                delete(CarState)
+                .where(CarState.id == any_(bindparam('ids', value=list(ids), type_=ARRAY(Integer))))
+                .execution_options(synchronize_session=False)
+            )
+            session.commit()
+            return result.rowcount
+
     @staticmethod
     def delete_car_states(data: list[CarState]):
         """
@@ -40,16 +92,15 @@ class CarStateORM:
     @staticmethod
     def save_unsent_telemetry_list(telemetry: list[Transport]):
         """
-        Save CarState objects
+        Save CarState objects with one multi-row INSERT
         :param telemetry: list of Transport objects
         :return:
         """
-        logger.warning("Save unsent telemetry list")
+        if not telemetry:
+            return
+        logger.warning(f"Save unsent telemetry list: {len(telemetry)} states")
         with Session() as session:
-            for data in telemetry:
-                session.add(CarState(
-                    **data.to_model()
-                ))
+            session.execute(insert(CarState), [data.to_model() for data in telemetry])
             session.commit()
 
     @staticmethod
@@ -1,16 +1,132 @@
-from sqlalchemy import select, and_, func
+import calendar
+import logging
+import os
+import re
+from datetime import date, datetime, timedelta, timezone
+
+from sqlalchemy import select, and_, delete, func, text
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.sql import exists
 
 from database.database import Session
-from database.models import Counter, Car
+from database.models import Counter, CounterDaily, Car, COUNTERS_PARTITIONED
+from metrics import timed_methods
+from metrics.instruments import DB_SECONDS
+
+
+logger = logging.getLogger(os.environ.get("LOGGER"))
+
+PARTITION_NAME_REGEX = re.compile(r'^counters_(\d{4})_(\d{2})$')
+
+
+def daily_stats_query(first_day: date, days: int = 1):
+    """
+    Per-car and per-day mileage and engine seconds of visible cars from counter_daily rollup
+    :param first_day: first day of the period
+    :param days: number of days
+    :return: select of (car_id, name, day, mileage, engine_seconds)
+    """
+    return (
+        select(
+            CounterDaily.car_id,
+            Car.name,
+            CounterDaily.day,
+            (CounterDaily.mileage_max - CounterDaily.mileage_min).label('mileage'),
+            (CounterDaily.engine_seconds_max - CounterDaily.engine_seconds_min).label('engine_seconds')
+        )
+        .join(Car, Car.id == CounterDaily.car_id)
+        .where(
+            and_(
+                CounterDaily.day >= first_day,
+                CounterDaily.day < first_day + timedelta(days=days),
+                Car.is_hidden.isnot(True)
+            )
+        )
+    )
+
+
+def rollup_upsert(rows: list[dict]):
+    """
+    Widen per-day counter ranges with new counters
+    :param rows: list of dictionaries with keys car_id, mileage, engine_seconds and ts
+    :return: INSERT ... ON CONFLICT DO UPDATE statement into counter_daily
+    """
+    days = {}
+    for row in rows:
+        key = (row['car_id'], date.fromtimestamp(row['ts']))
+        mileage, engine_seconds = row['mileage'], row['engine_seconds']
+        if key not in days:
+            days[key] = [mileage, mileage, engine_seconds, engine_seconds]
+            continue
+        day = days[key]
+        if mileage is not None:
+            day[0] = mileage if day[0] is None else min(day[0], mileage)
+            day[1] = mileage if day[1] is None else max(day[1], mileage)
+        if engine_seconds is not None:
+            day[2] = engine_seconds if day[2] is None else min(day[2], engine_seconds)
+            day[3] = engine_seconds if day[3] is None else max(day[3], engine_seconds)
+
+    stmt = insert(CounterDaily).values([
+        {
+            'car_id': car_id,
+            'day': day,
+            'mileage_min': mileage_min,
+            'mileage_max': mileage_max,
+            'engine_seconds_min': engine_seconds_min,
+            'engine_seconds_max': engine_seconds_max
+        }
+        for (car_id, day), (mileage_min, mileage_max, engine_seconds_min, engine_seconds_max) in days.items()
+    ])
+    # LEAST and GREATEST ignore NULLs
+    return stmt.on_conflict_do_update(
+        index_elements=[CounterDaily.car_id, CounterDaily.day],
+        set_={
+            'mileage_min': func.least(CounterDaily.mileage_min, stmt.excluded.mileage_min),
+            'mileage_max': func.greatest(CounterDaily.mileage_max, stmt.excluded.mileage_max),
+            'engine_seconds_min': func.least(CounterDaily.engine_seconds_min, stmt.excluded.engine_seconds_min),
+            'engine_seconds_max': func.greatest(CounterDaily.engine_seconds_max, stmt.excluded.engine_seconds_max)
+        }
+    )
+
+
+def counter_rows(items: list[dict], ts: int, known_ids: set[int] | None = None) -> list[dict]:
+    """
+    Convert Wialon counters info into counters rows
+    :param items: avl_unit items with cnm (mileage) and cneh (engine hours) fields
+    :param ts: Timestamp of the records
+    :param known_ids: IDs of known cars. Items of other units are skipped. No filtering if None
+    :return: list of dictionaries with keys car_id, mileage, engine_seconds and ts
+    """
+    rows = []
+    for item in items:
+        if known_ids is not None and item['id'] not in known_ids:
+            continue
+        mileage = item.get('cnm')
+        engine_seconds = int(item['cneh'] * 3600) if item.get('cneh') else None
+        if mileage is None and engine_seconds is None:
+            continue
+        rows.append({'car_id': item['id'], 'mileage': mileage, 'engine_seconds': engine_seconds, 'ts': ts})
+    return rows
+
+
+def month_start_ts(year: int, month: int) -> int:
+    """
+    UTC timestamp of the first second of the month. Month may overflow into the next years.
+    :param year:
+    :param month: 1-based month number
+    :return:
+    """
+    year, month = year + (month - 1) // 12, (month - 1) % 12 + 1
+    return calendar.timegm((year, month, 1, 0, 0, 0))
 
 
+@timed_methods(DB_SECONDS)
 class CounterORM:
 
     @staticmethod
     def save_counter(mileage: int, engine_seconds: int, ts: int, car_id: int):
         """
-        Save current state of transport counter
+        Save current state of transport counter and update its daily rollup
         :param mileage: Current total mileage
         :param engine_seconds: Current total engine working seconds
         :param ts: Timestamp of the record
@@ -27,8 +143,29 @@ class CounterORM:
                     ts=ts,
                     car_id=car_id
                 ))
+                session.execute(rollup_upsert([
+                    {'car_id': car_id, 'mileage': mileage, 'engine_seconds': engine_seconds, 'ts': ts}
+                ]))
                 session.commit()
 
+    @staticmethod
+    def save_counters(items: list[dict], ts: int, known_ids: set[int] | None = None) -> int:
+        """
+        Save counters of all units with one multi-row INSERT and update their daily rollup in the same transaction
+        :param items: items of WialonAsyncSource.get_counters_info()
+        :param ts: Timestamp of the records
+        :param known_ids: IDs of known cars. Items of other units are skipped
+        :return: number of saved counters
+        """
+        rows = counter_rows(items, ts, known_ids)
+        if not rows:
+            return 0
+        with Session() as session:
+            session.execute(insert(Counter), rows)
+            session.execute(rollup_upsert(rows))
+            session.commit()
+        return len(rows)
+
     @staticmethod
     def get_counters_for_period(start_ts: int, end_ts: int) -> list[Counter]:
         """
@@ -93,3 +230,125 @@ class CounterORM:
                 )
             )
             return session.execute(query).all()
+
+    @staticmethod
+    def get_daily_stats(first_day: date, days: int = 1) -> list[tuple]:
+        """
+        Get mileage and engine working seconds of visible cars for every day of the period from the rollup
+        :param first_day: first day of the period
+        :param days: number of days
+        :return: list of (car_id, name, day, mileage, engine_seconds) rows
+        """
+        with Session() as session:
+            return session.execute(daily_stats_query(first_day, days)).all()
+
+    @staticmethod
+    def rebuild_rollup(first_day: date, days: int = 1):
+        """
+        Aggregate raw counters of the period into counter_daily. Safe to repeat, ranges are only widened
+        :param first_day: first day of the period
+        :param days: number of days
+        :return:
+        """
+        with Session() as session:
+            for offset in range(days):
+                day = first_day + timedelta(days=offset)
+                start_ts = int(datetime.combine(day, datetime.min.time()).timestamp())
+                end_ts = int(datetime.combine(day + timedelta(days=1), datetime.min.time()).timestamp())
+                rows = session.execute(
+                    select(
+                        Counter.car_id,
+                        func.min(Counter.mileage).label('mileage_min'),
+                        func.max(Counter.mileage).label('mileage_max'),
+                        func.min(Counter.engine_seconds).label('engine_seconds_min'),
+                        func.max(Counter.engine_seconds).label('engine_seconds_max')
+                    )
+                    .where(and_(Counter.ts >= start_ts, Counter.ts < end_ts))
+                    .group_by(Counter.car_id)
+                ).all()
+                if not rows:
+                    continue
+                # Every car contributes its min and max as two samples
+                session.execute(rollup_upsert([
+                    {'car_id': row.car_id, 'mileage': mileage, 'engine_seconds': engine_seconds, 'ts': start_ts}
+                    for row in rows
+                    for mileage, engine_seconds in (
+                        (row.mileage_min, row.engine_seconds_min), (row.mileage_max, row.engine_seconds_max)
+                    )
+                ]))
+            session.commit()
+
+    @staticmethod
+    def prune_counters(before_ts: int) -> int:
+        """
+        Remove raw counters older than before_ts. Whole monthly partitions are dropped if counters is partitioned.
+        Daily rollup is kept.
+        :param before_ts: Timestamp
+        :return: number of deleted rows. Rows of dropped partitions are not counted
+        """
+        if COUNTERS_PARTITIONED:
+            CounterORM.drop_partitions_before(before_ts)
+            return 0
+        with Session() as session:
+            result = session.execute(delete(Counter).where(Counter.ts < before_ts))
+            session.commit()
+        if result.rowcount:
+            logger.info(f"Pruned {result.rowcount} counters")
+        return result.rowcount
+
+    @staticmethod
+    def ensure_partitions(months_ahead: int = 2):
+        """
+        Create monthly partitions of counters table for the current and next months.
+        Does nothing if counters table is not partitioned.
+        :param months_ahead: number of future months to create partitions for
+        :return:
+        """
+        if not COUNTERS_PARTITIONED:
+            return
+        now = datetime.now(timezone.utc)
+        with Session() as session:
+            is_partitioned = session.execute(text(
+                "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'counters'::regclass)"
+            )).scalar()
+            if not is_partitioned:
+                logger.warning("DB_PARTITION_COUNTERS is set but counters table was created without partitioning")
+                return
+            for offset in range(months_ahead + 1):
+                lower = month_start_ts(now.year, now.month + offset)
+                upper = month_start_ts(now.year, now.month + offset + 1)
+                name = datetime.fromtimestamp(lower, timezone.utc).strftime('counters_%Y_%m')
+                session.execute(text(
+                    f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF counters FOR VALUES FROM ({lower}) TO ({upper})"
+                ))
+            session.commit()
+
+    @staticmethod
+    def drop_partitions_before(ts: int) -> list[str]:
+        """
+        Drop monthly partitions of counters table which contain only records older than ts
+        :param ts: Timestamp. Partitions ending before or at it are dropped
+        :return: names of dropped partitions
+        """
+        if not COUNTERS_PARTITIONED:
+            return []
+        dropped = []
+        with Session() as session:
+            partitions = session.execute(text(
+                "SELECT child.relname FROM pg_inherits "
+                "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+                "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+                "WHERE parent.relname = 'counters'"
+            )).scalars().all()
+            for name in partitions:
+                match = PARTITION_NAME_REGEX.match(name)
+                if not match:
+                    continue
+                upper = month_start_ts(int(match.group(1)), int(match.group(2)) + 1)
+                if upper <= ts:
+                    session.execute(text(f"DROP TABLE IF EXISTS {name}"))
+                    dropped.append(name)
+            session.commit()
+        if dropped:
+            logger.info(f"Dropped counters partitions: {dropped}")
+        return dropped
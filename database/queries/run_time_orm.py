@@ -5,11 +5,14 @@ from sqlalchemy.exc import MultipleResultsFound, NoResultFound
 
 from database.database import Session
 from database.models import RunTime
+from metrics import timed_methods
+from metrics.instruments import DB_SECONDS
 
 
 logger = logging.getLogger(os.environ.get("LOGGER"))
 
 
+@timed_methods(DB_SECONDS)
 class RunTimeORM:
 
     @staticmethod
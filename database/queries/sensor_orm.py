@@ -1,12 +1,13 @@
-from psycopg2.errors import UniqueViolation
-from sqlalchemy.exc import IntegrityError
-from sqlalchemy.sql import exists
-from sqlalchemy import select
+from sqlalchemy import literal_column, select, tuple_
+from sqlalchemy.dialects.postgresql import insert
 
 from database.database import Session
 from database.models import Sensor
+from metrics import timed_methods
+from metrics.instruments import DB_SECONDS
 
 
+@timed_methods(DB_SECONDS)
 class SensorORM:
 
     @staticmethod
@@ -41,22 +42,38 @@ class SensorORM:
             return session.execute(query).scalars().all()
 
     @staticmethod
-    def add_sensors_if_not_exist(sensors: list[dict]):
+    def add_sensors_if_not_exist(sensors: list[dict]) -> tuple[int, int]:
         """
-        Create sensors if not yet exist
+        Create sensors and update changed ones in one statement
         :param sensors: list of dictionaries
-        :return:
+        :return: numbers of inserted and updated sensors
         """
+        rows = {
+            int(sensor['id']): {
+                'id': int(sensor['id']),
+                'sensor_name': sensor['attributes']['SensorName'],
+                'destination': sensor['attributes']['Destination'],
+                'sensor_type': sensor['attributes']['SensorType'],
+            }
+            for sensor in sensors
+        }
+        if not rows:
+            return 0, 0
+
+        stmt = insert(Sensor).values(list(rows.values()))
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Sensor.id],
+            set_={
+                'sensor_name': stmt.excluded.sensor_name,
+                'destination': stmt.excluded.destination,
+                'sensor_type': stmt.excluded.sensor_type
+            },
+            where=tuple_(Sensor.sensor_name, Sensor.destination, Sensor.sensor_type).is_distinct_from(
+                tuple_(stmt.excluded.sensor_name, stmt.excluded.destination, stmt.excluded.sensor_type)
+            )
+        ).returning(literal_column('xmax = 0'))
         with Session() as session:
-            for sensor in sensors:
-                try:
-                    if not session.query(exists().where(Sensor.id == int(sensor['id']))).scalar():
-                        session.add(Sensor(
-                            id=int(sensor['id']),
-                            sensor_name=sensor['attributes']['SensorName'],
-                            destination=sensor['attributes']['Destination'],
-                            sensor_type=sensor['attributes']['SensorType'],
-                        ))
-                        session.commit()
-                except (IntegrityError, UniqueViolation):
-                    pass
+            inserted_flags = session.execute(stmt).scalars().all()
+            session.commit()
+        inserted = sum(1 for flag in inserted_flags if flag)
+        return inserted, len(inserted_flags) - inserted
@@ -6,4 +6,16 @@ class AbstractDestination(ABC):
 
     @abstractmethod
     def send_data(self, device_name, telemetry) -> bool:
-        pass
\ No newline at end of file
+        pass
+
+    @abstractmethod
+    async def send_batch(self, messages: dict[str, list[dict]]) -> bool:
+        pass
+
+    @abstractmethod
+    def queue_telemetry(self, transport, telemetry: dict | None = None):
+        pass
+
+    @abstractmethod
+    def flush(self):
+        pass
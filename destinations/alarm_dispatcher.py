@@ -0,0 +1,156 @@
+"""Asynchronous delivery of alarms to the core REST API"""
+import asyncio
+import logging
+import os
+from typing import Callable
+
+from database.car_registry import CarRegistry
+from database.queries import AsyncAlarmORM
+from destinations.cuba_rest_client import CubaRestClient
+from telemetry_objects.alarm import Alarm
+
+
+logger = logging.getLogger(os.environ.get('LOGGER'))
+
+
+class AlarmDispatcher:
+    """
+    Queue in front of CubaRestClient. A bounded number of workers post alarms concurrently,
+    so connectors never wait for the REST API. Alarms which failed to send are saved to alarms
+    table and replayed every replay_interval seconds. Alarms which did not fit in the queue are
+    kept in a bounded overflow list and saved to alarms table by a background task.
+    The core has no bulk alarm endpoint, so every alarm is still one save_alarm call.
+    """
+
+    def __init__(
+            self,
+            rest_client: CubaRestClient,
+            registry: CarRegistry,
+            workers: int = 4,
+            queue_size: int = 10000,
+            replay_interval: float = 60,
+            replay_batch_size: int = 500,
+            overflow_size: int = 10000,
+            owns: Callable[[int], bool] | None = None
+    ):
+        self.rest_client = rest_client
+        self.registry = registry
+        self.workers = workers
+        self.replay_interval = replay_interval
+        self.replay_batch_size = replay_batch_size
+        self.overflow_size = overflow_size
+        # Filter of cars replayed by this process when the fleet is sharded
+        self.owns = owns
+        self.queue: asyncio.Queue[tuple[Alarm, str, bool]] = asyncio.Queue(maxsize=queue_size)
+        self._replaying: set[tuple] = set()
+        self._tasks: list[asyncio.Task] = []
+        # Alarms which are neither queued nor saved to alarms table yet
+        self._unpersisted: list[Alarm] = []
+        self._persist_task: asyncio.Task | None = None
+
+    def start(self):
+        """
+        Start workers and replayer
+        :return:
+        """
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._replay()))
+
+    def dispatch(self, alarm: Alarm, device_name: str):
+        """
+        Queue alarm for delivery. Saved to DB in background if queue is full
+        :param alarm: Alarm
+        :param device_name: name of the device in the core
+        :return:
+        """
+        try:
+            self.queue.put_nowait((alarm, device_name, False))
+        except asyncio.QueueFull:
+            logger.warning(f"Alarm queue is full. Saving alarm {alarm.id} to DB")
+            self._unpersisted.append(alarm)
+            overflow = len(self._unpersisted) - self.overflow_size
+            if overflow > 0:
+                logger.warning(f"Alarm overflow is full. Dropping {overflow} oldest alarms")
+                del self._unpersisted[:overflow]
+            if self._persist_task is None or self._persist_task.done():
+                self._persist_task = asyncio.create_task(self._persist_unpersisted())
+
+    async def _persist_unpersisted(self):
+        """
+        Save alarms of the overflow list to alarms table. On DB error they stay in the list for the next attempt
+        :return:
+        """
+        while self._unpersisted:
+            alarms, self._unpersisted = self._unpersisted, []
+            try:
+                await AsyncAlarmORM.save_unsent_alarms(alarms)
+            except asyncio.CancelledError:
+                self._unpersisted[:0] = alarms
+                raise
+            except Exception as exc:
+                logger.exception(exc)
+                self._unpersisted[:0] = alarms
+                return
+
+    async def _worker(self):
+        while True:
+            alarm, device_name, persisted = await self.queue.get()
+            try:
+                sent = await asyncio.to_thread(self.rest_client.post_alarm, alarm, device_name)
+            except asyncio.CancelledError:
+                if not persisted:
+                    self._unpersisted.append(alarm)
+                raise
+            except Exception as exc:
+                logger.exception(exc)
+                sent = False
+
+            try:
+                if sent and persisted:
+                    await AsyncAlarmORM.delete_unsent_alarms([alarm])
+                elif not sent and not persisted:
+                    await AsyncAlarmORM.save_unsent_alarms([alarm])
+            except Exception as exc:
+                logger.exception(exc)
+            finally:
+                self._replaying.discard(alarm.key())
+                self.queue.task_done()
+
+    async def _replay(self):
+        while True:
+            await asyncio.sleep(self.replay_interval)
+            await self._persist_unpersisted()
+            try:
+                records = await AsyncAlarmORM.get_unsent_alarms(self.replay_batch_size)
+            except Exception as exc:
+                logger.exception(exc)
+                continue
+
+            for record in records:
+                alarm = Alarm.from_model(record)
+                key = alarm.key()
+                device_name = self.registry.name(alarm.car_id)
+                if key in self._replaying or device_name is None:
+                    continue
+                if self.owns is not None and not self.owns(int(alarm.car_id)):
+                    continue
+                if self.queue.full():
+                    break
+                self._replaying.add(key)
+                self.queue.put_nowait((alarm, device_name, True))
+
+    async def persist_pending(self):
+        """
+        Stop workers and save alarms which are still queued or were interrupted. Called on shutdown
+        :return:
+        """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._persist_task is not None:
+            await asyncio.gather(self._persist_task, return_exceptions=True)
+        while not self.queue.empty():
+            alarm, _, persisted = self.queue.get_nowait()
+            if not persisted:
+                self._unpersisted.append(alarm)
+        await self._persist_unpersisted()
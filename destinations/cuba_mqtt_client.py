@@ -2,22 +2,60 @@
 import asyncio
 import os
 import logging
+import time
+from typing import Callable
 
+from paho.mqtt.client import MQTT_ERR_SUCCESS, MQTTMessageInfo
 from tb_device_mqtt import TBPublishInfo
 from tb_gateway_mqtt import TBGatewayMqttClient
 
-from database.queries import CarORM, CarStateORM
+from database.backlog import TelemetryBacklog
+from database.car_registry import CarRegistry
+from database.queries import AsyncCarStateORM
 from destinations.abs_destination import AbstractDestination
+from metrics.instruments import MQTT_ACK_SECONDS, MQTT_PUBLISH_FAILURES, MQTT_PUBLISHES
+from serialization import dumps
 from telemetry_objects.transport import Transport
+from tracing import traced, tracer
 
 logger = logging.getLogger(os.environ.get('LOGGER'))
 
+GATEWAY_TELEMETRY_TOPIC = 'v1/gateway/telemetry'
+
 
 class CubaMqttClient(AbstractDestination):
 
-    def __init__(self, mqtt_client: TBGatewayMqttClient):
+    def __init__(
+            self,
+            mqtt_client: TBGatewayMqttClient,
+            backlog: TelemetryBacklog,
+            registry: CarRegistry,
+            batch_size: int = 500,
+            max_payload_size: int = 60000,
+            flush_interval: float = 1.0,
+            publish_timeout: float = 30,
+            replay_batch_size: int = 5000,
+            replay_interval: float = 60,
+            owns: Callable[[int], bool] | None = None
+    ):
         self.mqtt_client = mqtt_client
-        self.transport_map = {transport[0]: transport[1] for transport in CarORM.get_all_transport_names()}
+        self.backlog = backlog
+        self.registry = registry
+        # Filter of cars replayed by this process when the fleet is sharded
+        self.owns = owns
+
+        # Batching of gateway telemetry
+        self.batch_size = batch_size
+        self.max_payload_size = max_payload_size
+        self.flush_interval = flush_interval
+        self.publish_timeout = publish_timeout
+        self._pending: dict[str, list[dict]] = {}
+        self._pending_transports: list[Transport] = []
+        self._in_flight: list[tuple[MQTTMessageInfo, list[Transport], float]] = []
+
+        # Replay of car_states backlog
+        self.replay_batch_size = replay_batch_size
+        self.replay_interval = replay_interval
 
     def send_data(self, device_name: str, telemetry: dict | list) -> bool:
         """
@@ -26,27 +64,221 @@ class CubaMqttClient(AbstractDestination):
         :param telemetry:
         :return:
         """
-        result = self.mqtt_client.gw_send_telemetry(device_name, telemetry)
+        with tracer.span('mqtt.send_data', device=device_name):
+            result = self.mqtt_client.gw_send_telemetry(device_name, telemetry)
         successful = result.rc() == TBPublishInfo.TB_ERR_SUCCESS
+        MQTT_PUBLISHES.inc(mode='single')
         if not successful:
+            MQTT_PUBLISH_FAILURES.inc(reason='rejected')
             logger.warning(f"Telemetry was not sent: {device_name}, {telemetry}")
         return result.rc() == TBPublishInfo.TB_ERR_SUCCESS
 
-    async def send_history_data(self):
+    async def send_batch(self, messages: dict[str, list[dict]]) -> bool:
+        """
+        Send telemetry of many devices in as few gateway messages as possible and wait for acknowledgement
+        :param messages: {device_name: [telemetry, ...]}
+        :return: True if everything was acknowledged
+        """
+        if not messages:
+            return True
+        successful = await self._publish_and_wait(messages)
+        if not successful:
+            logger.warning(f"Telemetry batch of {len(messages)} devices was not sent")
+        return successful
+
+    def queue_telemetry(self, transport: Transport, telemetry: dict | None = None):
+        """
+        Add telemetry to the current batch. Batch is flushed when it reaches batch_size
+        or by run_publisher every flush_interval seconds.
+        :param transport: Transport object. Saved to backlog if batch is not delivered
+        :param telemetry: message to send. transport.form_mqtt_message() if None
+        :return:
+        """
+        if telemetry is None:
+            device_name, telemetry = transport.form_mqtt_message()
+        else:
+            device_name = transport.name
+        self._pending.setdefault(device_name, []).append(telemetry)
+        self._pending_transports.append(transport)
+        if len(self._pending_transports) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
         """
-        Get all historical data for every transport and send it to the core as telemetry
+        Publish all queued telemetry as gateway multi-device payloads no bigger than max_payload_size.
+        Delivery is tracked by check_deliveries.
         :return:
         """
-        transport_ids = CarORM.get_transport_ids()
-        for transport_id in transport_ids:
-            device_name = self.transport_map[transport_id]
-            while data := CarStateORM.get_history_data(transport_id):
-                telemetry = [
-                    Transport.model_to_mqtt_message(self.transport_map[state.car_id], state)[1] for state in data
+        if not self._pending:
+            return
+        pending, transports = self._pending, self._pending_transports
+        self._pending, self._pending_transports = {}, []
+
+        with tracer.span('mqtt.flush', child_only=True, messages=len(transports)) as span:
+            by_device: dict[str, list[Transport]] = {}
+            for transport in transports:
+                by_device.setdefault(transport.name, []).append(transport)
+
+            payloads = self._split_payload(pending)
+            span.set_attribute('payloads', len(payloads))
+            for payload in payloads:
+                payload_transports = [
+                    transport for device_name in payload for transport in by_device.get(device_name, [])
                 ]
-                result = self.mqtt_client.gw_send_telemetry(device_name, telemetry)
-                print(result.rc())
-                if result.rc() == TBPublishInfo.TB_ERR_SUCCESS:
-                    CarStateORM.delete_car_states(data)
-                await asyncio.sleep(0.1)
-        await asyncio.sleep(10)
+                self._publish_batch(payload, payload_transports)
+
+    def _split_payload(self, messages: dict[str, list[dict]]) -> list[dict[str, list[dict]]]:
+        """
+        Split multi-device telemetry into gateway payloads no bigger than max_payload_size.
+        Telemetry of one device is never split.
+        :param messages: {device_name: [telemetry, ...]}
+        :return: list of payloads
+        """
+        payloads = []
+        payload, payload_size = {}, 2
+        for device_name, device_messages in messages.items():
+            size = len(dumps(device_messages)) + len(device_name) + 6
+            if payload and payload_size + size > self.max_payload_size:
+                payloads.append(payload)
+                payload, payload_size = {}, 2
+            payload[device_name] = device_messages
+            payload_size += size
+        if payload:
+            payloads.append(payload)
+        return payloads
+
+    def _publish_gateway_payload(self, payload: dict[str, list[dict]]) -> MQTTMessageInfo:
+        """
+        Publish multi-device telemetry to the gateway topic with QoS 1.
+        TBGatewayMqttClient has no public call returning paho's MQTTMessageInfo, which is needed to track
+        acknowledgements without blocking, so its private paho client is used. Keep it the only such place.
+        :param payload: {device_name: [telemetry, ...]}
+        :return: MQTTMessageInfo
+        """
+        return self.mqtt_client._client.publish(GATEWAY_TELEMETRY_TOPIC, dumps(payload), qos=1)
+
+    def _publish_batch(self, payload: dict[str, list[dict]], transports: list[Transport]):
+        """
+        Publish one gateway telemetry message. On immediate failure the telemetry goes to backlog
+        :param payload: {device_name: [telemetry, ...]}
+        :param transports: Transport objects contained in payload
+        :return:
+        """
+        info = self._publish_gateway_payload(payload)
+        MQTT_PUBLISHES.inc(mode='batch')
+        if info.rc != MQTT_ERR_SUCCESS:
+            MQTT_PUBLISH_FAILURES.inc(reason='rejected')
+            logger.warning(f"Telemetry batch was not sent: rc={info.rc}, {len(transports)} messages")
+            self.backlog.extend(transports)
+            return
+        self._in_flight.append((info, transports, time.monotonic()))
+
+    def check_deliveries(self):
+        """
+        Drop acknowledged batches. Batches not acknowledged within publish_timeout go to backlog.
+        Acknowledgement latency is measured with flush_interval resolution.
+        :return:
+        """
+        now = time.monotonic()
+        in_flight = []
+        for info, transports, published_at in self._in_flight:
+            if info.is_published():
+                MQTT_ACK_SECONDS.observe(now - published_at, mode='batch')
+                continue
+            if now - published_at > self.publish_timeout:
+                MQTT_PUBLISH_FAILURES.inc(reason='ack_timeout')
+                logger.warning(f"Telemetry batch was not acknowledged: {len(transports)} messages")
+                self.backlog.extend(transports)
+                continue
+            in_flight.append((info, transports, published_at))
+        self._in_flight = in_flight
+
+    async def run_publisher(self):
+        """
+        Flush queued telemetry and track deliveries every flush_interval seconds
+        :return:
+        """
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                self.flush()
+                self.check_deliveries()
+            except Exception as exc:
+                logger.exception(exc)
+
+    @traced('mqtt.publish_and_wait', child_only=True)
+    async def _publish_and_wait(self, messages: dict[str, list[dict]]) -> bool:
+        """
+        Publish multi-device telemetry and wait until every payload is acknowledged
+        :param messages: {device_name: [telemetry, ...]}
+        :return: True if all payloads were acknowledged within publish_timeout
+        """
+        infos = []
+        published_at = time.monotonic()
+        for payload in self._split_payload(messages):
+            info = self._publish_gateway_payload(payload)
+            MQTT_PUBLISHES.inc(mode='wait')
+            if info.rc != MQTT_ERR_SUCCESS:
+                MQTT_PUBLISH_FAILURES.inc(reason='rejected')
+                return False
+            infos.append(info)
+
+        deadline = published_at + self.publish_timeout
+        while not all(info.is_published() for info in infos):
+            if time.monotonic() > deadline:
+                MQTT_PUBLISH_FAILURES.inc(reason='ack_timeout')
+                return False
+            await asyncio.sleep(0.05)
+        MQTT_ACK_SECONDS.observe(time.monotonic() - published_at, mode='wait')
+        return True
+
+    @traced('mqtt.replay_backlog')
+    async def replay_backlog(self) -> int:
+        """
+        Send car_states backlog to the core page by page. Every acknowledged page is deleted with one query.
+        Stops on the first failed page or when broker disconnects. States of cars owned by other workers are left to them.
+        :return: number of replayed states
+        """
+        replayed = 0
+        after = None
+        while self.mqtt_client.is_connected():
+            states = await AsyncCarStateORM.get_history_batch(after, self.replay_batch_size)
+            if not states:
+                break
+            after = (states[-1].car_id, states[-1].ts, states[-1].id)
+
+            messages, ids = {}, []
+            for state in states:
+                device_name = self.registry.name(state.car_id)
+                if device_name is None or (self.owns is not None and not self.owns(state.car_id)):
+                    continue
+                messages.setdefault(device_name, []).append(Transport.model_to_mqtt_message(device_name, state)[1])
+                ids.append(state.id)
+
+            if messages and not await self._publish_and_wait(messages):
+                logger.warning(f"Backlog replay stopped: page of {len(ids)} states was not acknowledged")
+                break
+            replayed += await AsyncCarStateORM.delete_car_states_by_ids(ids)
+            await asyncio.sleep(0)
+
+        if replayed:
+            logger.info(f"Replayed {replayed} states from backlog")
+        return replayed
+
+    async def send_history_data(self):
+        """
+        Replay historical data to the core whenever broker (re)connects and every replay_interval seconds
+        :return:
+        """
+        was_connected = False
+        last_replay = 0.0
+        while True:
+            connected = self.mqtt_client.is_connected()
+            if connected and (not was_connected or time.monotonic() - last_replay >= self.replay_interval):
+                try:
+                    await self.replay_backlog()
+                except Exception as exc:
+                    logger.exception(exc)
+                last_replay = time.monotonic()
+            was_connected = connected
+            await asyncio.sleep(1)
@@ -1,9 +1,12 @@
 """REST client for Cuba Core API"""
 import os
 import logging
+import threading
+import time
 
 
 from tb_rest_client import RestClientPE
+from tb_rest_client.models.models_pe import DeviceId
 from tb_rest_client.models.models_pe.device import Device
 from tb_rest_client.rest import ApiException
 
@@ -13,11 +16,64 @@ logger = logging.getLogger(os.environ.get('LOGGER'))
 
 
 class CubaRestClient:
+    """
+    Long-lived authenticated REST client. One login is reused by all calls and renewed before
+    token_ttl runs out or when the core answers 401. The underlying RestClientPE keeps its
+    HTTP connection pool between calls.
+    """
 
-    def __init__(self):
+    def __init__(self, token_ttl: float = 9000, refresh_margin: float = 300, device_cache_ttl: float = 3600):
         self.BASE_URL = os.environ.get('CUBA_URL')
         self.CUBA_USER = os.environ.get('CUBA_USER')
         self.CUBA_PASSWORD = os.environ.get('CUBA_PASSWORD')
+        self.token_ttl = token_ttl
+        self.refresh_margin = refresh_margin
+        self.device_cache_ttl = device_cache_ttl
+        self._rest_client: RestClientPE | None = None
+        self._logged_in_at: float = 0.0
+        self._lock = threading.Lock()
+        self._device_cache: dict[str, tuple[float, DeviceId]] = {}
+
+    def _get_client(self, force_login: bool = False) -> RestClientPE:
+        """
+        Return authenticated client. Login again if token is about to expire
+        :param force_login: login even if token is still considered valid
+        :return:
+        """
+        with self._lock:
+            expired = time.monotonic() - self._logged_in_at > self.token_ttl - self.refresh_margin
+            if self._rest_client is None or expired or force_login:
+                if self._rest_client is None:
+                    self._rest_client = RestClientPE(base_url=self.BASE_URL)
+                self._rest_client.login(self.CUBA_USER, self.CUBA_PASSWORD)
+                self._logged_in_at = time.monotonic()
+            return self._rest_client
+
+    def _call(self, method):
+        """
+        Call method with authenticated client. Retry once with a new login if token was rejected
+        :param method: callable receiving RestClientPE
+        :return: result of method
+        """
+        try:
+            return method(self._get_client())
+        except ApiException as e:
+            if e.status != 401:
+                raise
+            return method(self._get_client(force_login=True))
+
+    def get_device_id(self, device_name: str) -> DeviceId:
+        """
+        Get device ID by its name. Cached for device_cache_ttl seconds
+        :param device_name:
+        :return:
+        """
+        cached = self._device_cache.get(device_name)
+        if cached and time.monotonic() - cached[0] < self.device_cache_ttl:
+            return cached[1]
+        device = self._call(lambda rest_client: rest_client.get_tenant_device(device_name=device_name))
+        self._device_cache[device_name] = (time.monotonic(), device.id)
+        return device.id
 
     def post_alarm(self, alarm: Alarm, device_name: str):
         """
@@ -26,23 +82,15 @@ class CubaRestClient:
         :param device_name:
         :return:
         """
-        with RestClientPE(base_url=self.BASE_URL) as rest_client:
-            try:
-                rest_client.login(self.CUBA_USER, self.CUBA_PASSWORD)
+        try:
+            device_id = self.get_device_id(device_name)
+            self._call(lambda rest_client: rest_client.save_alarm(alarm.to_rest_object(device_id)))
+            return True
 
-                device = rest_client.get_tenant_device(device_name=device_name)
-                alarm = alarm.to_rest_object(device.id)
-                rest_client.save_alarm(alarm)
-                return True
-
-            except ApiException as e:
-                logger.exception(e)
-                return False
-            finally:
-                try:
-                    rest_client.logout()
-                except ApiException as e:
-                    logger.exception(e)
+        except ApiException as e:
+            logger.exception(e)
+            self._device_cache.pop(device_name, None)
+            return False
 
     def get_tenant_device(self, device_name: str) -> Device:
         """
@@ -50,38 +98,35 @@ class CubaRestClient:
         :param device_name:
         :return:
         """
-        with RestClientPE(base_url=self.BASE_URL) as rest_client:
-            try:
-                rest_client.login(self.CUBA_USER, self.CUBA_PASSWORD)
+        try:
+            return self._call(lambda rest_client: rest_client.get_tenant_device(device_name))
 
-                device = rest_client.get_tenant_device(device_name)
-                return device
-
-            except ApiException as e:
-                logger.exception(e)
-            finally:
-                try:
-                    rest_client.logout()
-                except ApiException as e:
-                    logger.exception(e)
+        except ApiException as e:
+            logger.exception(e)
 
     def get_transport_devices(self) -> list[Device]:
         """
         Get list of devices with device profile == KMG Transport
         :return: list of devices with profile == KMG Transport
         """
-        with RestClientPE(base_url=self.BASE_URL) as rest_client:
-            try:
-                rest_client.login(self.CUBA_USER, self.CUBA_PASSWORD)
-                devices = rest_client.get_tenant_devices(
-                    500, 0, 'KMG Transport'
-                )
-                return devices.data
+        try:
+            devices = self._call(lambda rest_client: rest_client.get_tenant_devices(500, 0, 'KMG Transport'))
+            return devices.data
+
+        except ApiException as e:
+            logger.exception(e)
 
+    def close(self):
+        """
+        Logout and release the connection pool
+        :return:
+        """
+        with self._lock:
+            if self._rest_client is None:
+                return
+            try:
+                self._rest_client.logout()
             except ApiException as e:
                 logger.exception(e)
-            finally:
-                try:
-                    rest_client.logout()
-                except ApiException as e:
-                    logger.exception(e)
+            self._rest_client.__exit__(None, None, None)
+            self._rest_client = None
@@ -1,82 +1,250 @@
 import asyncio
 import os
 import logging
-from datetime import datetime
+import signal
+from multiprocessing.connection import Connection
+from datetime import date, datetime, timedelta
 
+from aiohttp import web
 from dotenv import load_dotenv
 from tb_gateway_mqtt import TBGatewayMqttClient
 
 from config import config_log
-from database.queries import RunTimeORM
+from database.backlog import TelemetryBacklog
+from database.car_registry import CarRegistry
+from database.queries import AsyncCarStateORM, RunTimeORM, CounterORM
+from destinations.alarm_dispatcher import AlarmDispatcher
 from destinations.cuba_mqtt_client import CubaMqttClient
 from destinations.cuba_rest_client import CubaRestClient
+from metrics import MetricsServer
+from metrics.instruments import BACKLOG_BUFFER, BACKLOG_DEPTH
+from profiling import PROFILE_MODES, LoopMonitor, Profiler
 
 load_dotenv()
 
+from connectors.adaptive_poller import AdaptivePoller
 from connectors.city_point_connector import CityPointConnector
+from connectors.report_engine import CounterReportEngine
 from connectors.wialon_connector import WialonConnector
-from database.database import db_init
-from monitoring_source.citypoint_source import CityPointSource
-from monitoring_source.wialon_source import WialonSource
+from database.database import db_close, db_init
+from monitoring_source.citypoint_asource import CityPointAsyncSource
+from monitoring_source.http_client import AsyncHttpClient
+from monitoring_source.wialon_asource import WialonAsyncSource
+from scheduler import RateLimiter, Scheduler, load_accounts, load_rate_limits
+from sharding import Shard, Supervisor
+from tracing import load_exporter, tracer
 
-from async_code import run_code
 
 logger = logging.getLogger(os.environ.get('LOGGER'))
 
 
-async def main():
+async def main(shard: Shard | None = None):
+    loop_monitor = LoopMonitor(
+        interval=float(os.environ.get('LOOP_LAG_INTERVAL', 0.25)),
+        slow_step=float(os.environ.get('SLOW_STEP_THRESHOLD', 0.1))
+    )
+    # Per-task busy time wraps every step of every task, so it is off by default and profiles
+    # enable it for their window only. With TASK_TIMING it is installed first to account every task
+    if os.environ.get('TASK_TIMING', '').lower() in ('1', 'true', 'yes'):
+        loop_monitor.install()
+    asyncio.create_task(loop_monitor.run(), name='loop_monitor')
+
+    client_id = os.environ.get("CUBA_CLIENT_ID")
+    if shard is not None:
+        # Every worker keeps its own MQTT connection, broker drops duplicated client ids
+        client_id = f"{client_id}-{shard.worker_id}"
+        shard.listen()
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    owns = shard.owns if shard is not None else None
+
+    trace_file = os.environ.get('TRACE_FILE', 'logs/traces.jsonl')
+    if shard is not None:
+        trace_file = trace_file.replace('.jsonl', f'-{shard.worker_id}.jsonl')
+    tracer.configure(
+        load_exporter(os.environ.get('TRACE_EXPORTER', 'jsonl'), trace_file),
+        sample_rate=float(os.environ.get('TRACE_SAMPLE_RATE', 0))
+    )
+    asyncio.create_task(tracer.run())
+
     mqtt_client = TBGatewayMqttClient(
         os.environ.get('CUBA_MQTT_HOST'),
         int(os.environ.get('CUBA_PORT')),
         os.environ.get("CUBA_GATEWAY_TOKEN"),
-        client_id=os.environ.get("CUBA_CLIENT_ID")
+        client_id=client_id
     )
     mqtt_client.connect()
     if mqtt_client.is_connected():
         logger.info('Connected to Core')
 
-    destination = CubaMqttClient(mqtt_client)
-    asyncio.create_task(destination.send_history_data())
-    rest_client = CubaRestClient()
+    registry = CarRegistry()
+    registry.load()
 
-    cp_source = CityPointSource(
-        login=os.environ.get("CITY_POINT_LOGIN"),
-        password=os.environ.get("CITY_POINT_PASSWORD"),
-        secret_key=os.environ.get("CITY_POINT_SECRET_KEY"),
-        client_id=os.environ.get("CITY_POINT_CLIENT_ID")
+    backlog = TelemetryBacklog(
+        max_size=int(os.environ.get('BACKLOG_MAX_SIZE', 100000)),
+        flush_size=int(os.environ.get('BACKLOG_FLUSH_SIZE', 1000)),
+        flush_interval=float(os.environ.get('BACKLOG_FLUSH_INTERVAL', 5.0))
     )
-    cpc = CityPointConnector(
-        source=cp_source,
-        destination=destination,
-        rest_client=rest_client
+    asyncio.create_task(backlog.run())
+
+    destination = CubaMqttClient(
+        mqtt_client,
+        backlog=backlog,
+        registry=registry,
+        batch_size=int(os.environ.get('MQTT_BATCH_SIZE', 500)),
+        max_payload_size=int(os.environ.get('MQTT_MAX_PAYLOAD_SIZE', 60000)),
+        flush_interval=float(os.environ.get('MQTT_FLUSH_INTERVAL', 1.0)),
+        publish_timeout=float(os.environ.get('MQTT_PUBLISH_TIMEOUT', 30)),
+        replay_batch_size=int(os.environ.get('BACKLOG_REPLAY_BATCH_SIZE', 5000)),
+        replay_interval=float(os.environ.get('BACKLOG_REPLAY_INTERVAL', 60)),
+        owns=owns
     )
+    asyncio.create_task(destination.run_publisher())
+    asyncio.create_task(destination.send_history_data())
+    rest_client = CubaRestClient(
+        token_ttl=float(os.environ.get('CUBA_TOKEN_TTL', 9000)),
+        device_cache_ttl=float(os.environ.get('CUBA_DEVICE_CACHE_TTL', 3600))
+    )
+    alarm_dispatcher = AlarmDispatcher(
+        rest_client,
+        registry,
+        workers=int(os.environ.get('ALARM_WORKERS', 4)),
+        queue_size=int(os.environ.get('ALARM_QUEUE_SIZE', 10000)),
+        replay_interval=float(os.environ.get('ALARM_REPLAY_INTERVAL', 60)),
+        overflow_size=int(os.environ.get('ALARM_OVERFLOW_SIZE', 10000)),
+        owns=owns
+    )
+    alarm_dispatcher.start()
 
-    wialon_source = WialonSource(
-        secret_key=os.environ.get("WIALON_REFRESH_TOKEN")
+    http_client = AsyncHttpClient(
+        limit=int(os.environ.get('HTTP_POOL_SIZE', 100)),
+        limit_per_host=int(os.environ.get('HTTP_POOL_SIZE_PER_HOST', 20)),
+        timeout=float(os.environ.get('HTTP_TIMEOUT', 30)),
+        rate_limiter=RateLimiter(load_rate_limits())
     )
-    wialon_connector = WialonConnector(
-        source=wialon_source,
-        destination=destination,
-        rest_client=rest_client
+
+    scheduler = Scheduler()
+    report_engine = CounterReportEngine(destination)
+    connectors = []
+    for account in load_accounts():
+        if account.type == 'city_point':
+            source = CityPointAsyncSource(
+                http_client=http_client,
+                login=account.options.get('login'),
+                password=account.options.get('password'),
+                secret_key=account.options.get('secret_key'),
+                client_id=account.options.get('client_id')
+            )
+            connector = CityPointConnector(
+                source=source,
+                destination=destination,
+                alarm_dispatcher=alarm_dispatcher,
+                registry=registry,
+                sensor_channels=account.options.get('sensor_channels'),
+                heartbeat_interval=float(os.environ.get('TELEMETRY_HEARTBEAT', 300)),
+                scheduler=scheduler,
+                name=account.name,
+                shard=shard
+            )
+        else:
+            source = WialonAsyncSource(
+                http_client=http_client,
+                secret_key=account.options.get('token')
+            )
+            connector = WialonConnector(
+                source=source,
+                destination=destination,
+                alarm_dispatcher=alarm_dispatcher,
+                registry=registry,
+                heartbeat_interval=float(os.environ.get('TELEMETRY_HEARTBEAT', 300)),
+                report_backfill_days=int(os.environ.get('REPORT_BACKFILL_DAYS', 1)),
+                counters_retention_days=int(os.environ.get('COUNTERS_RETENTION_DAYS', 90)),
+                avl_poller=AdaptivePoller(
+                    min_interval=float(os.environ.get('AVL_MIN_INTERVAL', 0.5)),
+                    max_interval=float(os.environ.get('AVL_MAX_INTERVAL', 10))
+                ),
+                report_engine=report_engine,
+                scheduler=scheduler,
+                name=account.name,
+                shard=shard
+            )
+        connectors.append(connector)
+        asyncio.create_task(connector.start_loop(), name=f'{account.name}:start_loop')
+    logger.info(f"Serving {len(connectors)} accounts")
+
+    # Every sharded worker serves its own metrics on the next port
+    metrics_server = MetricsServer(
+        port=int(os.environ.get('METRICS_PORT', 8101)) + (shard.worker_id if shard is not None else 0)
     )
 
-    asyncio.create_task(wialon_connector.start_loop())
-    asyncio.create_task(cpc.start_loop())
+    async def collect_backlog():
+        BACKLOG_BUFFER.set(len(backlog))
+        BACKLOG_DEPTH.set(await AsyncCarStateORM.estimate_car_states())
+
+    metrics_server.add_collector(collect_backlog)
+
+    profiler = Profiler(loop_monitor, prefix=f'profile-{shard.worker_id}' if shard is not None else 'profile')
+    profile_seconds = float(os.environ.get('PROFILE_SECONDS', 30))
+    profile_mode = os.environ.get('PROFILE_MODE', 'collapsed')
+
+    async def handle_profile(request: web.Request) -> web.Response:
+        mode = request.query.get('mode', profile_mode)
+        if mode not in PROFILE_MODES:
+            return web.json_response({'error': f"mode must be one of {PROFILE_MODES}"}, status=400)
+        if profiler.running:
+            return web.json_response({'error': 'Profile is already running'}, status=409)
+        return web.json_response(await profiler.profile(float(request.query.get('seconds', profile_seconds)), mode))
+
+    metrics_server.add_route('POST', '/profile', handle_profile)
+    asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, profiler.trigger, profile_seconds, profile_mode)
+    await metrics_server.start()
 
     logger.info('Integration is up and running')
-    while True:
-        await asyncio.sleep(10)
+    try:
+        while True:
+            await asyncio.sleep(10)
+    finally:
+        scheduler.stop()
+        await metrics_server.stop()
+        tracer.flush()
+        await alarm_dispatcher.persist_pending()
+        backlog.flush()
+        await http_client.close()
+        rest_client.close()
+        await db_close()
+
+
+def run_worker(worker_id: int, members: list[int], connection: Connection):
+    """
+    Entry point of a sharded worker process
+    :param worker_id:
+    :param members: ids of running workers
+    :param connection: pipe receiving membership updates from supervisor
+    :return:
+    """
+    config_log()
+    # SIGINT is handled by supervisor, which then terminates workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        asyncio.run(main(Shard(worker_id, members, connection)))
+    except asyncio.CancelledError:
+        pass
 
 
 if __name__ == '__main__':
     config_log()
     db_init()
+    CounterORM.ensure_partitions()
+    # Counters of the reported days may predate counter_daily rollup
+    report_backfill_days = int(os.environ.get('REPORT_BACKFILL_DAYS', 1))
+    CounterORM.rebuild_rollup(date.today() - timedelta(days=report_backfill_days), report_backfill_days + 1)
 
     start_ts = datetime.timestamp(datetime.now())
     try:
-        # asyncio.run(main())
-        asyncio.run(run_code())
-        pass
+        shard_workers = int(os.environ.get('SHARD_WORKERS', 1))
+        if shard_workers > 1:
+            Supervisor(shard_workers, run_worker, restart_delay=float(os.environ.get('SHARD_RESTART_DELAY', 5))).run()
+        else:
+            asyncio.run(main())
     finally:
         end_ts = datetime.timestamp(datetime.now())
         RunTimeORM.create_runtime(start_ts=start_ts, end_ts=end_ts)
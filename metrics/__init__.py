@@ -0,0 +1,6 @@
+from .registry import REGISTRY, Counter, Gauge, Histogram, MetricsRegistry
+from .server import MetricsServer
+from .timing import timed_methods
+
+
+__all__ = ['REGISTRY', 'Counter', 'Gauge', 'Histogram', 'MetricsRegistry', 'MetricsServer', 'timed_methods']
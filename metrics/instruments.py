@@ -0,0 +1,74 @@
+"""Metrics of the integration process"""
+from metrics.registry import REGISTRY, Counter, Gauge, Histogram
+
+
+SOURCE_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    'integration_source_request_seconds',
+    'Latency of monitoring source requests',
+    ['source', 'method']
+))
+
+POLL_SECONDS = REGISTRY.register(Histogram(
+    'integration_poll_duration_seconds',
+    'Duration of polling cycles',
+    ['connector', 'poll']
+))
+
+POLL_UNITS = REGISTRY.register(Histogram(
+    'integration_poll_units',
+    'Units handled per polling cycle',
+    ['connector', 'poll'],
+    buckets=(0, 1, 10, 50, 100, 250, 500, 1000, 2500, 5000)
+))
+
+MQTT_PUBLISHES = REGISTRY.register(Counter(
+    'integration_mqtt_publishes_total',
+    'Gateway telemetry payloads published',
+    ['mode']
+))
+
+MQTT_PUBLISH_FAILURES = REGISTRY.register(Counter(
+    'integration_mqtt_publish_failures_total',
+    'Gateway telemetry payloads rejected by the client or not acknowledged in time',
+    ['reason']
+))
+
+MQTT_ACK_SECONDS = REGISTRY.register(Histogram(
+    'integration_mqtt_ack_seconds',
+    'Time from publishing a gateway payload until it was seen acknowledged',
+    ['mode']
+))
+
+BACKLOG_DEPTH = REGISTRY.register(Gauge(
+    'integration_car_states_backlog',
+    'Unsent telemetry rows in car_states, estimated from planner statistics'
+))
+
+BACKLOG_BUFFER = REGISTRY.register(Gauge(
+    'integration_backlog_buffer',
+    'Unsent telemetry waiting in memory to be written to car_states'
+))
+
+DB_SECONDS = REGISTRY.register(Histogram(
+    'integration_db_seconds',
+    'Duration of ORM methods including session time',
+    ['orm', 'method']
+))
+
+LOOP_LAG_SECONDS = REGISTRY.register(Histogram(
+    'integration_event_loop_lag_seconds',
+    'Delay of periodic event loop wakeups',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+))
+
+TASK_BUSY_SECONDS = REGISTRY.register(Counter(
+    'integration_task_busy_seconds_total',
+    'Time tasks spent running on the event loop',
+    ['task']
+))
+
+TASK_SLOW_STEPS = REGISTRY.register(Counter(
+    'integration_task_slow_steps_total',
+    'Task steps which blocked the event loop longer than the slow step threshold',
+    ['task']
+))
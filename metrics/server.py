@@ -0,0 +1,67 @@
+"""HTTP endpoint serving metrics of the process"""
+import logging
+import os
+from typing import Awaitable, Callable
+
+from aiohttp import web
+
+from metrics.registry import REGISTRY, MetricsRegistry
+
+
+logger = logging.getLogger(os.environ.get("LOGGER"))
+
+
+class MetricsServer:
+    """
+    Serves GET /metrics and service endpoints added with add_route. Collectors are run before every scrape
+    to refresh gauges which are read from elsewhere, e.g. backlog depth from DB.
+    """
+
+    def __init__(self, port: int = 8101, host: str = '0.0.0.0', registry: MetricsRegistry = REGISTRY):
+        self.port = port
+        self.host = host
+        self.registry = registry
+        self._collectors: list[Callable[[], Awaitable]] = []
+        self._routes: list[tuple[str, str, Callable[[web.Request], Awaitable[web.StreamResponse]]]] = []
+        self._runner: web.AppRunner | None = None
+
+    def add_collector(self, collector: Callable[[], Awaitable]):
+        """
+        Register coroutine function run before every scrape
+        :param collector:
+        :return:
+        """
+        self._collectors.append(collector)
+
+    def add_route(self, method: str, path: str, handler: Callable[[web.Request], Awaitable[web.StreamResponse]]):
+        """
+        Serve another endpoint on the same port. Must be called before start
+        :param method: HTTP method
+        :param path:
+        :param handler: aiohttp request handler
+        :return:
+        """
+        self._routes.append((method, path, handler))
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        for collector in self._collectors:
+            try:
+                await collector()
+            except Exception as exc:
+                logger.exception(f"Metrics collector failed: {exc}")
+        return web.Response(text=self.registry.render(), content_type='text/plain', charset='utf-8')
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/metrics', self.handle_metrics)
+        for method, path, handler in self._routes:
+            app.router.add_route(method, path, handler)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f"Metrics are served on {self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
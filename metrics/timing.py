@@ -0,0 +1,51 @@
+"""Timing of class methods"""
+import functools
+import inspect
+import time
+
+from metrics.registry import Histogram
+
+
+def _timed(function, histogram: Histogram, labels: dict):
+    if inspect.iscoroutinefunction(function):
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await function(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started, **labels)
+    else:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started, **labels)
+    return wrapper
+
+
+def timed_methods(histogram: Histogram, exclude: tuple[str, ...] = ()):
+    """
+    Class decorator observing duration of every public method defined by the class.
+    Histogram is labelled with class name and method name.
+    :param histogram: histogram with two labels: owner and method
+    :param exclude: names of methods not to time
+    :return:
+    """
+    owner_label, method_label = histogram.labelnames
+
+    def decorator(cls):
+        for name, attribute in list(vars(cls).items()):
+            if name.startswith('_') or name in exclude:
+                continue
+            labels = {owner_label: cls.__name__, method_label: name}
+            if isinstance(attribute, staticmethod):
+                setattr(cls, name, staticmethod(_timed(attribute.__func__, histogram, labels)))
+            elif isinstance(attribute, classmethod):
+                setattr(cls, name, classmethod(_timed(attribute.__func__, histogram, labels)))
+            elif inspect.isfunction(attribute):
+                setattr(cls, name, _timed(attribute, histogram, labels))
+        return cls
+    return decorator
@@ -0,0 +1,59 @@
+from abc import ABC, abstractmethod
+
+from monitoring_source.http_client import AsyncHttpClient
+
+
+class AbstractAsyncTransportSource(ABC):
+    def __init__(
+            self,
+            http_client: AsyncHttpClient,
+            login = None,
+            client_id = None,
+            secret_key = None,
+            password = None,
+            access = None,
+            timeout: float = 30
+    ):
+        self.http_client = http_client
+        self.login = login
+        self.client_id = client_id
+        self.secret_key = secret_key
+        self.password = password
+        self.access = access
+        self.timeout = timeout
+
+    @abstractmethod
+    async def get_transports(self, query_filter: str = ''):
+        pass
+
+    @abstractmethod
+    async def get_velocity_zones(self):
+        pass
+
+    @abstractmethod
+    async def auth(self):
+        pass
+
+    @abstractmethod
+    def is_connected(self):
+        pass
+
+    @abstractmethod
+    def update_token(self, token_params: dict):
+        pass
+
+    @abstractmethod
+    async def get_transport_list(self):
+        pass
+
+    @abstractmethod
+    async def get_messages(self):
+        pass
+
+    @abstractmethod
+    async def get_historical_messages_by_id(self, transport_id: int, start_ts: int, end_ts: int):
+        pass
+
+    @abstractmethod
+    async def reinitialize_session(self, *args):
+        pass
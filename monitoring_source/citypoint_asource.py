@@ -0,0 +1,180 @@
+"""Asynchronous starting point for working with City Point monitoring system"""
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import jwt
+
+from metrics import timed_methods
+from metrics.instruments import SOURCE_REQUEST_SECONDS
+from monitoring_source.abs_async_transport_src import AbstractAsyncTransportSource
+from monitoring_source.http_client import AsyncHttpClient
+from monitoring_source.utils import report_error
+
+
+@timed_methods(SOURCE_REQUEST_SECONDS, exclude=('is_connected', 'update_token', 'convert_params'))
+class CityPointAsyncSource(AbstractAsyncTransportSource):
+
+    def __init__(self, http_client: AsyncHttpClient, login, client_id, secret_key, password, timeout: float = 30):
+        super().__init__(http_client, login, client_id, secret_key, password, timeout=timeout)
+        self.refresh_token: str | None = None
+        self.access_token: str | None = None
+        self.expires_at: datetime | None = None
+        self.token_type: str | None = None
+        self.user_id: str | None = None
+        self.delay: int | None = None
+        self.BASE_URL: str = "https://api.citypoint.ru/v2.1"
+
+        # Endpoints for REST API
+        self.AUTH_URL: str = "/oauth/token"
+        self.TS_INFO: str = f"/cars/states?fields[carState]=Lon,Lat,Velocity,RecordDate,LattestGpsDate,LattestConnectionTime,Sensors.value,Sensors.calibration"
+        self.TS_LIST: str = f"/cars?filter[car]=eq(IsHidden,0)"
+        self.SENSORS_INFO: str = f"/sensors"
+        self.MESSAGES: str = '/notifications?include=Driver,Zone,Car&page[limit]=10'
+        self.GEO_ZONES: str = '/zones?fields[zone]=Name,Description,Geometry'
+        self.DAY_CAR_INFO: str = '/cars/aggregated/{}/day?fields[carAggrData]=Mileage,WorkingHours,FuelConsumptionHour,FuelConsumptionKm,IdleFuelVolume,IdleHours,Car'
+
+    async def _get(self, path: str, timeout: float | None = None) -> dict | None:
+        """
+        Authorized GET request. Return dict if request successful. None if status code != 2**
+        :param path: path relative to BASE_URL
+        :param timeout: per-request timeout. Source default if None
+        :return:
+        """
+        await self.get_token_if_expired()
+        res = await self.http_client.get(
+            self.BASE_URL + path,
+            headers=self.header,
+            timeout=timeout or self.timeout
+        )
+        if 200 <= res.status_code < 300:
+            return res.json()
+        report_error(res)
+
+    async def get_velocity_zones(self) -> dict | None:
+        """
+        Get all geo zones
+        :return:
+        """
+        return await self._get(f"/user/{self.user_id}" + self.SENSORS_INFO)
+
+    async def get_transport_list(self) -> dict | None:
+        """
+        Get list of transport. Return dict if request successful. None if status code != 2**
+        :return:
+        """
+        return await self._get(f"/user/{self.user_id}" + self.TS_LIST)
+
+    async def get_transports(self, query_filter: str = '') -> dict | None:
+        """
+        Get list of current transport states. Return dict if request successful. None if status code != 2**
+        :param query_filter:
+        :return:
+        """
+        return await self._get(f"/user/{self.user_id}" + self.TS_INFO)
+
+    async def get_historical_messages_by_id(self, transport_id, start_ts, end_ts) -> dict | None:
+        """
+        Get list of historical transport states for given transport ID. Return dict if request successful. None if status code != 2**
+        :param transport_id:
+        :param start_ts:
+        :param end_ts:
+        :return:
+        """
+        formatted_dt = datetime.fromtimestamp(start_ts, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        return await self._get(
+            f"/user/{self.user_id}" + f"/cars/{transport_id}/history/full" + f"?fields[histState]=Velocity,Lat,Lon,RecordDate&filter[histState]=and(gte(Velocity,3),gt(RecordDate,{formatted_dt}))",
+            timeout=self.timeout * 4
+        )
+
+    def update_token(self, token_params: dict):
+        self.token_type = token_params['token_type']
+        self.expires_at = datetime.now() + timedelta(seconds=token_params['expires_in'])
+        self.access_token = token_params['access_token']
+        self.refresh_token = token_params['refresh_token']
+        token = jwt.decode(self.access_token, options={"verify_signature": False})
+        self.user_id = token.get('user_id')
+
+    async def _post_token(self, data: str) -> bool:
+        res = await self.http_client.post(
+            self.BASE_URL + self.AUTH_URL,
+            data=data,
+            headers={
+                "Content-Type": "application/x-www-form-urlencoded"
+            },
+            timeout=self.timeout
+        )
+        if 200 <= res.status_code < 300:
+            self.update_token(res.json())
+            return True
+        report_error(res)
+        return False
+
+    async def auth(self) -> bool:
+        """
+        Authenticate in the system and get access and refresh tokens. Returns True if successful. False otherwise
+        :return:
+        """
+        return await self._post_token(
+            f"grant_type=password&client_id={self.client_id}&client_secret={self.secret_key}&username={self.login}&password={self.password}"
+        )
+
+    async def get_messages(self) -> dict | None:
+        """
+        Get list messages. Return dict if request successful. None if status code != 2**
+        :return:
+        """
+        return await self._get(f"/user/{self.user_id}" + self.MESSAGES)
+
+    def is_connected(self) -> bool:
+        """
+        Check if access token is still valid
+        :return:
+        """
+        return self.expires_at is not None and datetime.now() < self.expires_at
+
+    async def reinitialize_session(self, *args):
+        """
+        Connections are pooled by the shared http client, so only the token is renewed
+        :return:
+        """
+        await self.auth()
+
+    @property
+    def header(self):
+        return {
+            "Accept": "application/vnd.api+json",
+            "Authorization": f"{self.token_type} {self.access_token}"
+        }
+
+    async def __get_access_token(self) -> bool:
+        """
+        Update access token
+        :return:
+        """
+        return await self._post_token(
+            f"grant_type=refresh_token&client_id={self.client_id}&client_secret={self.secret_key}&refresh_token={self.refresh_token}"
+        )
+
+    async def get_token_if_expired(self):
+        """
+        If access token is expired, update it
+        :return:
+        """
+        if not self.is_connected():
+            while not await self.__get_access_token():
+                await asyncio.sleep(10)
+
+    async def get_day_info(self, date_str: str) -> dict | None:
+        """
+        Get list of data for the given day. Return dict if request successful. None if status code != 2**
+        :param date_str: date string representation with format: YYYY-MM-DD
+        :return:
+        """
+        return await self._get(f"/user/{self.user_id}" + self.DAY_CAR_INFO.format(date_str))
+
+    async def get_sensors(self) -> dict | None:
+        """
+        Get list of all sensors. Return dict if request successful. None if status code != 2**
+        :return:
+        """
+        return await self._get(self.SENSORS_INFO)
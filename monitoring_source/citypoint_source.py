@@ -4,6 +4,8 @@ from time import sleep
 from urllib3.exceptions import NameResolutionError
 from http.client import RemoteDisconnected
 
+from metrics import timed_methods
+from metrics.instruments import SOURCE_REQUEST_SECONDS
 from monitoring_source.abs_transport_src import AbstractTransportSource
 from datetime import datetime, timedelta
 import requests
@@ -11,8 +13,10 @@ import requests
 import jwt
 
 from monitoring_source.utils import report_error
+from serialization import loads
 
 
+@timed_methods(SOURCE_REQUEST_SECONDS, exclude=('is_connected', 'update_token', 'convert_params'))
 class CityPointSource(AbstractTransportSource):
 
     def __init__(self, login, client_id, secret_key, password):
@@ -51,7 +55,7 @@ class CityPointSource(AbstractTransportSource):
             self.session = requests.session()
             raise exception.__class__()
         if 200 <= res.status_code < 300:
-            return res.json()
+            return loads(res.content)
         report_error(res)
 
     def get_transport_list(self) -> dict | None:
@@ -70,7 +74,7 @@ class CityPointSource(AbstractTransportSource):
             self.session = requests.session()
             raise exception.__class__()
         if 200 <= res.status_code < 300:
-            return res.json()
+            return loads(res.content)
         report_error(res)
 
     def get_transports(self, query_filter: str = '') -> dict | None:
@@ -90,7 +94,7 @@ class CityPointSource(AbstractTransportSource):
             self.session = requests.session()
             raise exception.__class__()
         if 200 <= res.status_code < 300:
-            return res.json()
+            return loads(res.content)
         report_error(res)
 
     def get_historical_messages_by_id(self, transport_id, start_ts, end_ts) -> dict | None:
@@ -114,7 +118,7 @@ class CityPointSource(AbstractTransportSource):
             self.session = requests.session()
             raise exception.__class__()
         if 200 <= res.status_code < 300:
-            return res.json()
+            return loads(res.content)
         report_error(res)
 
     def update_token(self, token_params: dict):
@@ -142,7 +146,7 @@ class CityPointSource(AbstractTransportSource):
             self.session = requests.session()
             raise exception.__class__()
         if 200 <= res.status_code < 300:
-            self.update_token(res.json())
+            self.update_token(loads(res.content))
             return True
         report_error(res)
         return False
@@ -163,7 +167,7 @@ class CityPointSource(AbstractTransportSource):
             self.session = requests.session()
             raise exception.__class__()
         if 200 <= res.status_code < 300:
-            return res.json()
+            return loads(res.content)
         report_error(res)
 
     def is_connected(self) -> bool:
@@ -200,7 +204,7 @@ class CityPointSource(AbstractTransportSource):
             self.session = requests.session()
             raise exception.__class__()
         if 200 <= res.status_code < 300:
-            self.update_token(res.json())
+            self.update_token(loads(res.content))
             return True
         report_error(res)
         return False
@@ -234,7 +238,7 @@ class CityPointSource(AbstractTransportSource):
             self.session = requests.session()
             raise exception.__class__()
         if 200 <= res.status_code < 300:
-            return res.json()
+            return loads(res.content)
         report_error(res)
 
     def get_sensors(self) -> dict | None:
@@ -253,5 +257,5 @@ class CityPointSource(AbstractTransportSource):
             self.session = requests.session()
             raise exception.__class__()
         if 200 <= res.status_code < 300:
-            return res.json()
+            return loads(res.content)
         report_error(res)
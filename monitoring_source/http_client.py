@@ -0,0 +1,111 @@
+"""Shared asynchronous HTTP client for all monitoring sources"""
+import asyncio
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from scheduler.rate_limiter import RateLimiter
+from serialization import loads
+from tracing import tracer
+
+
+class HttpResponse:
+    """Already read response. Mimics the parts of requests.Response used by the project"""
+
+    def __init__(self, status_code: int, reason: str | None, url: str, content: bytes):
+        self.status_code = status_code
+        self.reason = reason
+        self.url = url
+        self.content = content
+
+    @property
+    def text(self) -> str:
+        return self.content.decode('utf-8', errors='replace')
+
+    def json(self):
+        return loads(self.content)
+
+
+class AsyncHttpClient:
+    """
+    One pooled keep-alive aiohttp session shared by every async source.
+    Requests are throttled per upstream host by the optional rate limiter.
+    Network errors are re-raised as builtin ConnectionError and TimeoutError.
+    """
+
+    def __init__(
+            self,
+            limit: int = 100,
+            limit_per_host: int = 20,
+            timeout: float = 30,
+            keepalive_timeout: float = 60,
+            rate_limiter: RateLimiter | None = None
+    ):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.timeout = timeout
+        self.keepalive_timeout = keepalive_timeout
+        self.rate_limiter = rate_limiter
+        self._session: aiohttp.ClientSession | None = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """
+        Lazily create the session, so it is bound to the running event loop
+        :return:
+        """
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self.limit,
+                    limit_per_host=self.limit_per_host,
+                    keepalive_timeout=self.keepalive_timeout
+                ),
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+        return self._session
+
+    async def request(
+            self,
+            method: str,
+            url: str,
+            params: dict | None = None,
+            data: dict | str | None = None,
+            headers: dict | None = None,
+            timeout: float | None = None
+    ) -> HttpResponse:
+        """
+        Perform request and read the whole body.
+        :param method: HTTP method
+        :param url: full URL
+        :param params: query parameters
+        :param data: request body
+        :param headers: request headers
+        :param timeout: total timeout of this request in seconds. Client default if None
+        :return: HttpResponse
+        """
+        kwargs = {'params': params, 'data': data, 'headers': headers}
+        if timeout is not None:
+            kwargs['timeout'] = aiohttp.ClientTimeout(total=timeout)
+        if self.rate_limiter is not None:
+            await self.rate_limiter.acquire(urlsplit(url).hostname)
+        try:
+            with tracer.span('http.request', child_only=True, method=method, url=url.split('?', 1)[0]) as span:
+                async with self.session.request(method, url, **kwargs) as res:
+                    content = await res.read()
+                    span.set_attribute('status', res.status)
+                    return HttpResponse(res.status, res.reason, str(res.url), content)
+        except asyncio.TimeoutError as exception:
+            raise TimeoutError(f"{method} {url} timed out") from exception
+        except aiohttp.ClientError as exception:
+            raise ConnectionError(f"{method} {url} failed: {exception}") from exception
+
+    async def get(self, url: str, **kwargs) -> HttpResponse:
+        return await self.request('GET', url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> HttpResponse:
+        return await self.request('POST', url, **kwargs)
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
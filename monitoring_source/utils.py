@@ -1,5 +1,8 @@
+import calendar
 import os
 import logging
+from datetime import datetime, timezone
+from functools import lru_cache
 
 import requests
 
@@ -16,5 +19,29 @@ def report_error(result: requests.Response):
     logger.warning('----------------------------------------------------------------------------------')
     logger.warning(f"Response returned with status code: {result.status_code}. Reason: {result.reason}")
     logger.warning(f"Requested URL: {result.url}")
-    logger.warning(f"Message: {result.json()}")
-    logger.warning('----------------------------------------------------------------------------------')
\ No newline at end of file
+    try:
+        message = result.json()
+    except ValueError:
+        # Gateways and proxies answer with HTML error pages
+        message = result.text
+    logger.warning(f"Message: {message}")
+    logger.warning('----------------------------------------------------------------------------------')
+
+
+@lru_cache(maxsize=8192)
+def parse_utc_timestamp(date: str) -> int:
+    """
+    Convert UTC date string with format YYYY-MM-DDTHH:MM:SSZ to epoch seconds.
+    Results are cached, since parked cars report the same dates poll after poll.
+    :param date: date string, e.g. 2024-10-21T06:00:00Z
+    :return: epoch seconds
+    """
+    if len(date) == 20 and date[19] == 'Z':
+        return calendar.timegm((
+            int(date[0:4]), int(date[5:7]), int(date[8:10]),
+            int(date[11:13]), int(date[14:16]), int(date[17:19])
+        ))
+    parsed = datetime.fromisoformat(date.replace('Z', '+00:00'))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp())
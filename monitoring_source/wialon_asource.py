@@ -0,0 +1,217 @@
+"""Asynchronous starting point for working with Wialon monitoring system"""
+import asyncio
+from functools import lru_cache
+
+from metrics import timed_methods
+from metrics.instruments import SOURCE_REQUEST_SECONDS
+from monitoring_source.abs_async_transport_src import AbstractAsyncTransportSource
+from monitoring_source.http_client import AsyncHttpClient
+from monitoring_source.utils import report_error
+from serialization import dumps_str
+
+
+@timed_methods(SOURCE_REQUEST_SECONDS, exclude=('is_connected', 'update_token', 'convert_params'))
+class WialonAsyncSource(AbstractAsyncTransportSource):
+
+    def __init__(
+            self,
+            http_client: AsyncHttpClient,
+            login = None,
+            client_id = None,
+            secret_key = None,
+            password = None,
+            timeout: float = 30
+    ):
+        super().__init__(http_client, login, client_id, secret_key, password, timeout=timeout)
+        self.refresh_token: str | None = secret_key
+        self.access_token: str | None = None
+        self.token_type: str | None = None
+        self.user_id: str | None = None
+        self.BASE_URL: str = 'https://hst-api.wialon.com/wialon/ajax.html'
+        self.AVL_EVENTS_URL: str = 'https://hst-api.wialon.com/avl_evts'
+        # avl_evts hands every event out once per session, so requests must not overlap
+        self._avl_lock = asyncio.Lock()
+
+    async def _call(self, svc: str, params: dict | str, timeout: float | None = None, authorized: bool = True) -> dict | None:
+        """
+        Call Wialon Remote API service. Return dict if request successful. None if status code != 2**.
+        Raises ConnectionError if session can not be authenticated
+        :param svc: service name, e.g. core/search_items
+        :param params: service parameters, either dict or already serialized JSON
+        :param timeout: per-request timeout. Source default if None
+        :param authorized: whether to pass current session id
+        :return:
+        """
+        if authorized and not self.is_connected() and not await self.auth():
+            raise ConnectionError('Wialon authentication failed')
+        query = {'svc': svc, 'params': params if isinstance(params, str) else self.convert_params(params)}
+        if authorized:
+            query['sid'] = self.access_token
+        res = await self.http_client.get(self.BASE_URL, params=query, timeout=timeout or self.timeout)
+        if 200 <= res.status_code < 300:
+            return res.json()
+        report_error(res)
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def _search_units_params(flags: int) -> str:
+        """
+        Serialized core/search_items params for all units. Cached per flag set
+        :param flags: data flags
+        :return:
+        """
+        return dumps_str({
+            "spec": {
+                "itemsType": "avl_unit",
+                "propName": "avl_unit",
+                "propValueMask": "*",
+                "sortType": "sys_name",
+                "propType": "avl_unit"
+            },
+            "force": 1,
+            "flags": flags,
+            "from": 0,
+            "to": 0
+        })
+
+    async def get_velocity_zones(self) -> dict | None:
+        """
+        Get all geo zones
+        :return:
+        """
+        params = {
+            "spec": {
+                "itemsType": "avl_resource",
+                "propName": "zones_library",
+                "propValueMask": "*",
+                "sortType": "sys_name",
+                "propType": "propitemname"
+            },
+            "force": 1,
+            "flags": 4097,
+            "from": 0,
+            "to": 0
+        }
+        return await self._call('core/search_items', params)
+
+    async def get_transport_list(self) -> dict | None:
+        """
+        Get list of transport. Return dict if request successful. None if status code != 2**
+        :return:
+        """
+        return await self._call('core/search_items', self._search_units_params(8388609), timeout=self.timeout * 2)
+
+    async def get_transports(self, query_filter: str = '') -> dict | None:
+        """
+        Get list of current transport states. Return dict if request successful. None if status code != 2**
+        :param query_filter:
+        :return:
+        """
+        return await self._call('core/search_items', self._search_units_params(15729697), timeout=self.timeout * 2)
+
+    async def get_messages(self):
+        pass
+
+    async def get_historical_messages_by_id(self, item_id, start_ts, end_ts) -> dict | None:
+        """
+        Get list of historical transport states for given transport ID. Return dict if request successful. None if status code != 2**
+        :param item_id:
+        :param start_ts:
+        :param end_ts:
+        :return:
+        """
+        params = {
+            'itemId': item_id,
+            'timeFrom': start_ts,
+            'timeTo': end_ts,
+            'flags': 1,
+            'flagsMask': 65281,
+            'loadCount': 4294967295
+        }
+        return await self._call('messages/load_interval', params, timeout=self.timeout * 4)
+
+    async def unload(self) -> dict | None:
+        """
+        Unload messages loaded into session by messages/load_interval
+        :return:
+        """
+        return await self._call('messages/unload', {})
+
+    def is_connected(self) -> bool:
+        """
+        Check if access token is expired
+        :return:
+        """
+        if not self.access_token:
+            return False
+        return True
+
+    async def auth(self) -> bool:
+        """
+        Authenticate in the system and get access and refresh tokens. Returns True if successful. False otherwise
+        :return:
+        """
+        res = await self._call('token/login', {"token": self.refresh_token}, authorized=False)
+        if res and res.get('eid'):
+            self.update_token(res)
+            return True
+        return False
+
+    def update_token(self, token_params: dict):
+        self.access_token = token_params['eid']
+
+    async def reinitialize_session(self, item_ids: list[int]):
+        """
+        Renew session and load given units into it again
+        :param item_ids:
+        :return:
+        """
+        self.access_token = None
+        await self.manage_session_units(item_ids)
+
+    async def get_counters_info(self) -> dict | None:
+        """
+        Get list of counters with its current state. Return dict if request successful
+        :return:
+        """
+        return await self._call('core/search_items', self._search_units_params(8193), timeout=self.timeout * 2)
+
+    async def manage_session_units(self, item_ids: list[int], mode: int = 0) -> dict | None:
+        """
+        Load transports in session to obtain its AVL events
+        :param item_ids:
+        :param mode: 0 - set units of the session, 1 - add units, 2 - remove units
+        :return:
+        """
+        params = {
+            "spec":[
+                {
+                    "type": "col",
+                    "data": list(item_ids),
+                    "flags": 32+8192,
+                    "mode": mode
+                }
+            ]
+        }
+        return await self._call('core/update_data_flags', params)
+
+    async def get_avl_event(self) -> dict | None:
+        """
+        Get all AVL events since last request. Only one request per session is in flight at a time
+        :return:
+        """
+        async with self._avl_lock:
+            if not self.is_connected() and not await self.auth():
+                raise ConnectionError('Wialon authentication failed')
+            res = await self.http_client.get(
+                self.AVL_EVENTS_URL,
+                params={'sid': self.access_token},
+                timeout=self.timeout
+            )
+        if 200 <= res.status_code < 300:
+            return res.json()
+        report_error(res)
+
+    @staticmethod
+    def convert_params(params):
+        return dumps_str(params)
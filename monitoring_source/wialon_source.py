@@ -1,13 +1,16 @@
 """Starting point for working with Wialon monitoring system"""
 import requests
-import json
 
 from urllib3.exceptions import NameResolutionError
 
+from metrics import timed_methods
+from metrics.instruments import SOURCE_REQUEST_SECONDS
 from monitoring_source.abs_transport_src import AbstractTransportSource
 from monitoring_source.utils import report_error
+from serialization import dumps_str, loads
 
 
+@timed_methods(SOURCE_REQUEST_SECONDS, exclude=('is_connected', 'update_token', 'convert_params'))
 class WialonSource(AbstractTransportSource):
 
     def __init__(self, login = None, client_id = None, secret_key = None, password = None):
@@ -46,7 +49,7 @@ class WialonSource(AbstractTransportSource):
             self.session = requests.session()
             raise exception.__class__()
         if 200 <= res.status_code < 300:
-            return res.json()
+            return loads(res.content)
         report_error(res)
 
     def get_transport_list(self) -> dict | None:
@@ -75,7 +78,7 @@ class WialonSource(AbstractTransportSource):
             self.session = requests.session()
             raise exception.__class__()
         if 200 <= res.status_code < 300:
-            return res.json()
+            return loads(res.content)
         report_error(res)
 
     def get_transports(self, query_filter: str = '') -> dict | None:
@@ -105,7 +108,7 @@ class WialonSource(AbstractTransportSource):
             self.session = requests.session()
             raise exception.__class__()
         if 200 <= res.status_code < 300:
-            return res.json()
+            return loads(res.content)
         report_error(res)
 
     def get_messages(self):
@@ -130,14 +133,14 @@ class WialonSource(AbstractTransportSource):
             'loadCount': 4294967295
         }
         try:
-            res = self.session.get(self.BASE_URL + 'messages/load_interval&params=' + json.dumps(params) + f"&sid={self.access_token}")
+            res = self.session.get(self.BASE_URL + 'messages/load_interval&params=' + self.convert_params(params) + f"&sid={self.access_token}")
         except (requests.exceptions.ConnectionError, NameResolutionError, TimeoutError) as exception:
             self.session = requests.session()
             raise exception.__class__()
         if 200 <= res.status_code < 300:
-            return res.json()
+            return loads(res.content)
         report_error(res)
-        return res.json()
+        return loads(res.content)
 
     def is_connected(self) -> bool:
         """
@@ -155,12 +158,12 @@ class WialonSource(AbstractTransportSource):
         """
         params = {"token": self.refresh_token}
         try:
-            res = self.session.get(self.BASE_URL + 'token/login&params=' + json.dumps(params))
+            res = self.session.get(self.BASE_URL + 'token/login&params=' + self.convert_params(params))
         except (requests.exceptions.ConnectionError, NameResolutionError, TimeoutError) as exception:
             self.session = requests.session()
             raise exception.__class__()
         if 200 <= res.status_code < 300:
-            self.update_token(res.json())
+            self.update_token(loads(res.content))
             return True
         report_error(res)
         return False
@@ -199,7 +202,7 @@ class WialonSource(AbstractTransportSource):
             self.session = requests.session()
             raise exception.__class__()
         if 200 <= res.status_code < 300:
-            return res.json()
+            return loads(res.content)
         report_error(res)
 
     def manage_session_units(self, item_ids: list[int]) -> dict | None:
@@ -226,9 +229,9 @@ class WialonSource(AbstractTransportSource):
             self.session = requests.session()
             raise exception.__class__()
         if 200 <= res.status_code < 300:
-            return res.json()
+            return loads(res.content)
         report_error(res)
-        return res.json()
+        return loads(res.content)
 
     def get_avl_event(self) -> dict | None:
         """
@@ -243,10 +246,10 @@ class WialonSource(AbstractTransportSource):
             self.session = requests.session()
             raise exception.__class__()
         if 200 <= res.status_code < 300:
-            return res.json()
+            return loads(res.content)
         report_error(res)
-        return res.json()
+        return loads(res.content)
 
     @staticmethod
     def convert_params(params):
-        return json.dumps(params)
+        return dumps_str(params)
@@ -0,0 +1,5 @@
+from .monitor import LoopMonitor
+from .profiler import PROFILE_MODES, Profiler
+
+
+__all__ = ['LoopMonitor', 'PROFILE_MODES', 'Profiler']
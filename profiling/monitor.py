@@ -0,0 +1,156 @@
+"""Event loop lag and per-task busy time"""
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from collections.abc import Coroutine
+
+from metrics.instruments import LOOP_LAG_SECONDS, TASK_BUSY_SECONDS, TASK_SLOW_STEPS
+
+
+logger = logging.getLogger(os.environ.get("LOGGER"))
+
+
+class _TimedCoroutine(Coroutine):
+    """Coroutine of a task which reports time of every step, i.e. run between two awaits, to the monitor"""
+    __slots__ = ('_coroutine', '_monitor', 'task_name')
+
+    def __init__(self, coroutine, monitor: 'LoopMonitor'):
+        self._coroutine = coroutine
+        self._monitor = monitor
+        self.task_name: str | None = None
+
+    def send(self, value):
+        started = time.perf_counter()
+        try:
+            return self._coroutine.send(value)
+        finally:
+            self._monitor.account(self, time.perf_counter() - started)
+
+    def throw(self, typ, val=None, tb=None):
+        started = time.perf_counter()
+        try:
+            if val is None and tb is None:
+                return self._coroutine.throw(typ)
+            return self._coroutine.throw(typ, val, tb)
+        finally:
+            self._monitor.account(self, time.perf_counter() - started)
+
+    def close(self):
+        return self._coroutine.close()
+
+    def __await__(self):
+        return self._coroutine.__await__()
+
+    @property
+    def cr_frame(self):
+        return getattr(self._coroutine, 'cr_frame', None)
+
+    @property
+    def name(self) -> str:
+        return getattr(self._coroutine, '__qualname__', type(self._coroutine).__name__)
+
+
+class LoopMonitor:
+    """
+    Measures event loop lag as the delay of a periodic wakeup and busy time of every task.
+    Lag is measured all the time. Busy time is measured only for tasks created while the monitor
+    is installed, since it wraps every step of them. Tasks are keyed by their name, or by the
+    coroutine name for unnamed tasks. A step longer than slow_step blocked every other task and is logged.
+    """
+
+    def __init__(self, interval: float = 0.25, slow_step: float = 0.1, history: int = 14400):
+        self.interval = interval
+        self.slow_step = slow_step
+        self.busy: dict[str, float] = {}
+        self.steps: dict[str, int] = {}
+        # (loop time, lag) of the recent wakeups
+        self.lags: deque[tuple[float, float]] = deque(maxlen=history)
+        self._previous_factory = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    @property
+    def installed(self) -> bool:
+        return self._loop is not None
+
+    def install(self, loop: asyncio.AbstractEventLoop | None = None):
+        """
+        Wrap coroutines of tasks created from now on
+        :param loop: running loop if None
+        :return:
+        """
+        if self._loop is not None:
+            return
+        self._loop = loop or asyncio.get_running_loop()
+        self._previous_factory = self._loop.get_task_factory()
+        self._loop.set_task_factory(self._task_factory)
+
+    def uninstall(self):
+        """
+        Stop wrapping coroutines of new tasks. Tasks wrapped already are accounted until they finish
+        :return:
+        """
+        if self._loop is None:
+            return
+        if self._loop.get_task_factory() == self._task_factory:
+            self._loop.set_task_factory(self._previous_factory)
+        self._loop, self._previous_factory = None, None
+
+    def _task_factory(self, loop, coroutine, **kwargs):
+        coroutine = _TimedCoroutine(coroutine, self)
+        if self._previous_factory is not None:
+            return self._previous_factory(loop, coroutine, **kwargs)
+        return asyncio.Task(coroutine, loop=loop, **kwargs)
+
+    def account(self, coroutine: _TimedCoroutine, duration: float):
+        name = coroutine.task_name
+        if name is None:
+            task = asyncio.current_task()
+            name = task.get_name() if task is not None else ''
+            if not name or name.startswith('Task-'):
+                name = coroutine.name
+            coroutine.task_name = name
+        self.busy[name] = self.busy.get(name, 0.0) + duration
+        self.steps[name] = self.steps.get(name, 0) + 1
+        TASK_BUSY_SECONDS.inc(duration, task=name)
+        if duration >= self.slow_step:
+            TASK_SLOW_STEPS.inc(task=name)
+            logger.warning(f"Task {name} blocked the event loop for {duration:.3f}s")
+
+    async def run(self):
+        """
+        Measure event loop lag every interval seconds
+        :return:
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            now = loop.time()
+            lag = max(0.0, now - started - self.interval)
+            self.lags.append((now, lag))
+            LOOP_LAG_SECONDS.observe(lag)
+
+    def snapshot(self) -> dict[str, float]:
+        """
+        Busy time of every task so far
+        :return: {task name: seconds}
+        """
+        return dict(self.busy)
+
+    def lag_since(self, since: float) -> dict:
+        """
+        Summary of event loop lag measured after the given loop time
+        :param since: loop.time()
+        :return:
+        """
+        lags = sorted(lag for measured_at, lag in self.lags if measured_at >= since)
+        if not lags:
+            return {'samples': 0}
+        return {
+            'samples': len(lags),
+            'mean_ms': round(sum(lags) / len(lags) * 1000, 2),
+            'p95_ms': round(lags[min(len(lags) - 1, round(0.95 * (len(lags) - 1)))] * 1000, 2),
+            'max_ms': round(lags[-1] * 1000, 2),
+        }
@@ -0,0 +1,155 @@
+"""On-demand profiling of the running service"""
+import asyncio
+import cProfile
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from profiling.monitor import LoopMonitor
+from serialization import dumps
+
+
+logger = logging.getLogger(os.environ.get("LOGGER"))
+
+PROFILE_MODES = ('collapsed', 'pstats')
+
+
+def sample_stacks(thread_id: int, seconds: float, interval: float) -> tuple[Counter, int]:
+    """
+    Sample stack of the thread from another thread
+    :param thread_id: threading.get_ident() of the sampled thread
+    :param seconds: sampling duration
+    :param interval: seconds between samples
+    :return: collapsed stacks with their sample counts and number of samples
+    """
+    stacks: Counter[str] = Counter()
+    samples = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        frame = sys._current_frames().get(thread_id)
+        if frame is not None:
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            stacks[';'.join(reversed(stack))] += 1
+            samples += 1
+        time.sleep(interval)
+    return stacks, samples
+
+
+class Profiler:
+    """
+    Profiles the event loop thread for a number of seconds and writes the result under directory:
+    collapsed - sampled stacks in the collapsed format of flamegraph tools, pstats - cProfile statistics.
+    A JSON summary with busy time of every task and event loop lag during the window is written next to it.
+    If the monitor is not installed permanently, it is installed for the window only, so busy time covers
+    tasks created during the window. One profile runs at a time.
+    """
+
+    def __init__(
+            self,
+            monitor: LoopMonitor | None = None,
+            directory: str = 'logs',
+            prefix: str = 'profile',
+            sample_interval: float = 0.005
+    ):
+        self.monitor = monitor
+        self.directory = directory
+        self.prefix = prefix
+        self.sample_interval = sample_interval
+        self._running = False
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    async def profile(self, seconds: float = 30, mode: str = 'collapsed') -> dict:
+        """
+        Profile the event loop
+        :param seconds: duration
+        :param mode: collapsed or pstats
+        :return: summary
+        """
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profile mode: {mode}")
+        if self._running:
+            raise RuntimeError('Profile is already running')
+        self._running = True
+        try:
+            return await self._profile(seconds, mode)
+        finally:
+            self._running = False
+
+    async def _profile(self, seconds: float, mode: str) -> dict:
+        loop = asyncio.get_running_loop()
+        name = f"{self.prefix}-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
+        path = os.path.join(self.directory, f"{name}.{mode}")
+        logger.info(f"Profiling event loop for {seconds}s into {path}")
+        started = loop.time()
+        busy_before = self.monitor.snapshot() if self.monitor else {}
+        install_monitor = self.monitor is not None and not self.monitor.installed
+        if install_monitor:
+            self.monitor.install(loop)
+
+        summary = {'mode': mode, 'seconds': seconds, 'file': path}
+        try:
+            if mode == 'pstats':
+                # Enabled from the loop thread, so every callback and task step of the loop is profiled
+                profile = cProfile.Profile()
+                profile.enable()
+                try:
+                    await asyncio.sleep(seconds)
+                finally:
+                    profile.disable()
+                await asyncio.to_thread(profile.dump_stats, path)
+            else:
+                stacks, samples = await asyncio.to_thread(
+                    sample_stacks, threading.get_ident(), seconds, self.sample_interval
+                )
+                await asyncio.to_thread(self._write_collapsed, path, stacks)
+                summary['samples'] = samples
+        finally:
+            if install_monitor:
+                self.monitor.uninstall()
+
+        if self.monitor:
+            busy_after = self.monitor.snapshot()
+            busy = {task: busy_after[task] - busy_before.get(task, 0.0) for task in busy_after}
+            summary['tasks'] = {
+                task: round(busy_seconds, 4)
+                for task, busy_seconds in sorted(busy.items(), key=lambda item: -item[1]) if busy_seconds
+            }
+            summary['loop_lag'] = self.monitor.lag_since(started)
+
+        await asyncio.to_thread(self._write_summary, os.path.join(self.directory, f"{name}.json"), summary)
+        logger.info(f"Profile written: {summary}")
+        return summary
+
+    @staticmethod
+    def _write_collapsed(path: str, stacks: Counter):
+        with open(path, 'w', encoding='utf-8') as file:
+            for stack, count in stacks.most_common():
+                file.write(f"{stack} {count}\n")
+
+    @staticmethod
+    def _write_summary(path: str, summary: dict):
+        with open(path, 'wb') as file:
+            file.write(dumps(summary))
+
+    def trigger(self, seconds: float = 30, mode: str = 'collapsed'):
+        """
+        Start profile in background, e.g. from a signal handler. Ignored while one is running
+        :param seconds:
+        :param mode:
+        :return:
+        """
+        if self._running:
+            logger.warning('Profile is already running')
+            return
+        asyncio.get_running_loop().create_task(self.profile(seconds, mode), name='profiler')
@@ -0,0 +1,6 @@
+from .accounts import Account, load_accounts, load_rate_limits
+from .rate_limiter import RateLimiter
+from .scheduler import Scheduler
+
+
+__all__ = ['Account', 'load_accounts', 'load_rate_limits', 'RateLimiter', 'Scheduler']
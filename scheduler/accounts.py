@@ -0,0 +1,86 @@
+"""Source accounts served by one process"""
+import json
+import os
+from typing import Any, NamedTuple
+
+
+class Account(NamedTuple):
+    name: str
+    type: str
+    options: dict[str, Any]
+
+
+def _expand(value):
+    """
+    Substitute $VAR and ${VAR} in string values, so secrets may stay in the environment
+    :param value: config value
+    :return:
+    """
+    if isinstance(value, str):
+        return os.path.expandvars(value)
+    if isinstance(value, dict):
+        return {key: _expand(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_expand(item) for item in value]
+    return value
+
+
+def _read_config(path: str | None) -> dict:
+    if not path:
+        return {}
+    with open(path, encoding='utf-8') as file:
+        return _expand(json.load(file))
+
+
+def _accounts_from_env() -> list[Account]:
+    """
+    Single CityPoint and single Wialon account configured by environment variables
+    :return:
+    """
+    return [
+        Account('city_point', 'city_point', {
+            'login': os.environ.get("CITY_POINT_LOGIN"),
+            'password': os.environ.get("CITY_POINT_PASSWORD"),
+            'secret_key': os.environ.get("CITY_POINT_SECRET_KEY"),
+            'client_id': os.environ.get("CITY_POINT_CLIENT_ID"),
+            'sensor_channels': json.loads(os.environ['CITY_POINT_SENSOR_CHANNELS']) if os.environ.get('CITY_POINT_SENSOR_CHANNELS') else None
+        }),
+        Account('wialon', 'wialon', {
+            'token': os.environ.get("WIALON_REFRESH_TOKEN")
+        }),
+    ]
+
+
+def load_accounts(path: str | None = None) -> list[Account]:
+    """
+    Read accounts from JSON config file:
+    {"accounts": [{"name": "...", "type": "city_point" | "wialon", ...options}], "rate_limits": {"host": rps}}
+    Falls back to the environment variables if no file is configured.
+    :param path: path to the config file. ACCOUNTS_CONFIG environment variable if None
+    :return: list of Account
+    """
+    config = _read_config(path or os.environ.get('ACCOUNTS_CONFIG'))
+    if not config.get('accounts'):
+        return _accounts_from_env()
+
+    accounts = []
+    for item in config['accounts']:
+        options = dict(item)
+        name, account_type = options.pop('name', None), options.pop('type', None)
+        if account_type not in ('city_point', 'wialon'):
+            raise ValueError(f"Unknown account type: {account_type}")
+        accounts.append(Account(name or f"{account_type}_{len(accounts)}", account_type, options))
+    names = [account.name for account in accounts]
+    if len(names) != len(set(names)):
+        raise ValueError(f"Account names must be unique: {names}")
+    return accounts
+
+
+def load_rate_limits(path: str | None = None) -> dict[str, float]:
+    """
+    Read per-host request rate limits (requests per second) from the accounts config file
+    :param path: path to the config file. ACCOUNTS_CONFIG environment variable if None
+    :return: {host: requests per second}
+    """
+    config = _read_config(path or os.environ.get('ACCOUNTS_CONFIG'))
+    return {host: float(rate) for host, rate in config.get('rate_limits', {}).items()}
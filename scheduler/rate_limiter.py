@@ -0,0 +1,48 @@
+"""Per-upstream request rate limiting"""
+import asyncio
+import time
+
+
+class TokenBucket:
+    """Allows rate requests per second on average with bursts of up to capacity requests"""
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        """
+        Wait until a request is allowed. Waiters are served in FIFO order
+        :return:
+        """
+        async with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
+
+
+class RateLimiter:
+    """Token bucket per upstream host. Hosts without a limit are not throttled"""
+
+    def __init__(self, limits: dict[str, float] | None = None):
+        self._buckets = {host: TokenBucket(rate) for host, rate in (limits or {}).items() if rate > 0}
+
+    async def acquire(self, host: str):
+        """
+        Wait until a request to the host is allowed
+        :param host: upstream host name
+        :return:
+        """
+        bucket = self._buckets.get(host)
+        if bucket is not None:
+            await bucket.acquire()
@@ -0,0 +1,137 @@
+"""Shared scheduler of periodic jobs of all connectors"""
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable
+
+
+logger = logging.getLogger(os.environ.get("LOGGER"))
+
+# Golden ratio conjugate. Phases i * GOLDEN % 1 stay evenly spread for any number of jobs
+GOLDEN = 0.6180339887498949
+
+
+class Scheduler:
+    """
+    Runs periodic jobs at a fixed rate. Jobs with the same interval get staggered phases,
+    so requests of all accounts spread evenly across the interval instead of bursting together.
+    A job returning False is retried after retry_interval instead of waiting for the next tick.
+    """
+
+    def __init__(self):
+        self._epoch: float | None = None
+        self._slots: dict[float, int] = {}
+        self._tasks: dict[str, asyncio.Task] = {}
+
+    def _phase(self, interval: float) -> float:
+        slot = self._slots.get(interval, 0)
+        self._slots[interval] = slot + 1
+        return (slot * GOLDEN) % 1 * interval
+
+    def every(
+            self,
+            name: str,
+            interval: float,
+            job: Callable[[], Awaitable[bool | None]],
+            run_immediately: bool = False,
+            retry_interval: float | None = None
+    ):
+        """
+        Run job every interval seconds
+        :param name: unique job name, e.g. <account>:<job>
+        :param interval: seconds between runs
+        :param job: coroutine function without arguments
+        :param run_immediately: run once right away, then follow the staggered schedule
+        :param retry_interval: seconds before retrying a job which returned False. None - wait for the next tick
+        :return:
+        """
+        loop = asyncio.get_running_loop()
+        if self._epoch is None:
+            self._epoch = loop.time()
+        phase = self._phase(interval)
+        self._start(name, self._run_every(name, interval, phase, job, run_immediately, retry_interval))
+        logger.info(f"Scheduled {name} every {interval}s with phase {phase:.1f}s")
+
+    def daily(
+            self,
+            name: str,
+            hour: int,
+            minute: int,
+            job: Callable[[], Awaitable[bool | None]],
+            run_immediately: bool = True
+    ):
+        """
+        Run job every day at the given local time
+        :param name: unique job name
+        :param hour:
+        :param minute:
+        :param job: coroutine function without arguments
+        :param run_immediately: run once right away as well
+        :return:
+        """
+        self._start(name, self._run_daily(name, hour, minute, job, run_immediately))
+
+    def _start(self, name: str, coroutine):
+        if name in self._tasks and not self._tasks[name].done():
+            coroutine.close()
+            raise ValueError(f"Job {name} is already scheduled")
+        self._tasks[name] = asyncio.create_task(coroutine, name=name)
+
+    def cancel(self, name: str):
+        """
+        Stop the job
+        :param name: job name
+        :return:
+        """
+        task = self._tasks.pop(name, None)
+        if task is not None:
+            task.cancel()
+
+    def stop(self):
+        """
+        Stop all jobs
+        :return:
+        """
+        for task in self._tasks.values():
+            task.cancel()
+        self._tasks.clear()
+
+    @staticmethod
+    async def _execute(name: str, job: Callable[[], Awaitable[bool | None]]) -> bool:
+        try:
+            return await job() is not False
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            logger.exception(f"Job {name} failed: {exc}")
+            return False
+
+    async def _run_every(self, name, interval, phase, job, run_immediately, retry_interval):
+        loop = asyncio.get_running_loop()
+        next_run = self._epoch + phase
+        if run_immediately:
+            await self._execute(name, job)
+        while True:
+            now = loop.time()
+            if next_run <= now:
+                # Skip missed ticks, keep the phase
+                next_run += ((now - next_run) // interval + 1) * interval
+            await asyncio.sleep(next_run - now)
+            successful = await self._execute(name, job)
+            while not successful and retry_interval and loop.time() + retry_interval < next_run + interval:
+                await asyncio.sleep(retry_interval)
+                successful = await self._execute(name, job)
+
+    async def _run_daily(self, name, hour, minute, job, run_immediately):
+        if run_immediately:
+            await self._execute(name, job)
+        while True:
+            now = datetime.now()
+            next_run = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+            if next_run <= now:
+                next_run += timedelta(days=1)
+            time_to_wait = (next_run - now).total_seconds()
+            logger.info(f"{name}: waiting {time_to_wait} seconds until the next run at {next_run}")
+            await asyncio.sleep(time_to_wait)
+            await self._execute(name, job)
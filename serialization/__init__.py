@@ -0,0 +1,68 @@
+"""
+JSON codec shared by monitoring sources and destinations.
+orjson is used when installed, stdlib json otherwise. Another codec may be plugged in with set_codec.
+"""
+import json
+from typing import Any, Callable
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+def _json_loads(data: bytes | str) -> Any:
+    return json.loads(data)
+
+
+def _json_dumps(obj: Any) -> bytes:
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+
+if orjson is not None:
+    _loads: Callable[[bytes | str], Any] = orjson.loads
+    _dumps: Callable[[Any], bytes] = orjson.dumps
+else:
+    _loads = _json_loads
+    _dumps = _json_dumps
+
+
+def set_codec(loads_function: Callable[[bytes | str], Any], dumps_function: Callable[[Any], bytes]):
+    """
+    Replace JSON codec for the whole process
+    :param loads_function: decodes bytes or str into python object
+    :param dumps_function: encodes python object into bytes
+    :return:
+    """
+    global _loads, _dumps
+    _loads, _dumps = loads_function, dumps_function
+
+
+def loads(data: bytes | str) -> Any:
+    """
+    Decode JSON document
+    :param data: bytes or str
+    :return:
+    """
+    return _loads(data)
+
+
+def dumps(obj: Any) -> bytes:
+    """
+    Encode object into compact JSON
+    :param obj:
+    :return: UTF-8 encoded JSON
+    """
+    return _dumps(obj)
+
+
+def dumps_str(obj: Any) -> str:
+    """
+    Encode object into compact JSON string
+    :param obj:
+    :return:
+    """
+    return _dumps(obj).decode('utf-8')
+
+
+__all__ = ['loads', 'dumps', 'dumps_str', 'set_codec']
@@ -0,0 +1,6 @@
+from .hash_ring import HashRing
+from .shard import Shard
+from .supervisor import Supervisor
+
+
+__all__ = ['HashRing', 'Shard', 'Supervisor']
@@ -0,0 +1,48 @@
+"""Consistent hash ring of worker processes"""
+from bisect import bisect
+
+import mmh3
+
+
+class HashRing:
+    """
+    Maps keys to nodes with murmur3 consistent hashing. Every node owns `replicas` points on the ring,
+    so adding or removing a node moves only about 1/N of the keys.
+    """
+
+    def __init__(self, nodes: list[int] | None = None, replicas: int = 64):
+        self.replicas = replicas
+        self.nodes: list[int] = []
+        self._points: list[int] = []
+        self._owners: list[int] = []
+        self._cache: dict = {}
+        self.rebuild(nodes or [])
+
+    def rebuild(self, nodes: list[int]):
+        """
+        Replace ring nodes
+        :param nodes: node IDs
+        :return:
+        """
+        ring = sorted(
+            (mmh3.hash(f"{node}:{replica}", signed=False), node)
+            for node in set(nodes) for replica in range(self.replicas)
+        )
+        self.nodes = sorted(set(nodes))
+        self._points = [point for point, _ in ring]
+        self._owners = [node for _, node in ring]
+        self._cache = {}
+
+    def node(self, key) -> int | None:
+        """
+        Get node owning the key
+        :param key: any key with stable str() representation, e.g. car ID
+        :return: node ID or None if ring is empty
+        """
+        if not self._points:
+            return None
+        owner = self._cache.get(key)
+        if owner is None:
+            index = bisect(self._points, mmh3.hash(str(key), signed=False)) % len(self._points)
+            owner = self._cache[key] = self._owners[index]
+        return owner
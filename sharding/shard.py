@@ -0,0 +1,70 @@
+"""Slice of the fleet owned by one worker process"""
+import asyncio
+import logging
+import os
+from multiprocessing.connection import Connection
+from typing import Awaitable, Callable
+
+from sharding.hash_ring import HashRing
+
+
+logger = logging.getLogger(os.environ.get("LOGGER"))
+
+
+class Shard:
+    """
+    Ownership of cars and account-wide jobs by this worker. Membership updates are received from
+    the supervisor and rebalance callbacks are run after every change.
+    """
+
+    def __init__(self, worker_id: int, members: list[int], connection: Connection | None = None, replicas: int = 64):
+        self.worker_id = worker_id
+        self.connection = connection
+        self.ring = HashRing(members, replicas)
+        self._callbacks: list[Callable[[], Awaitable]] = []
+
+    def owns(self, car_id) -> bool:
+        """
+        Check if car is handled by this worker
+        :param car_id: Car.id
+        :return:
+        """
+        return self.ring.node(int(car_id)) == self.worker_id
+
+    def is_home(self, key: str) -> bool:
+        """
+        Check if account-wide job identified by key, e.g. account name, runs on this worker
+        :param key:
+        :return:
+        """
+        return self.ring.node(key) == self.worker_id
+
+    def on_rebalance(self, callback: Callable[[], Awaitable]):
+        """
+        Register coroutine function run after membership changed
+        :param callback:
+        :return:
+        """
+        self._callbacks.append(callback)
+
+    def listen(self):
+        """
+        Start receiving membership updates from supervisor
+        :return:
+        """
+        if self.connection is not None:
+            asyncio.get_running_loop().add_reader(self.connection.fileno(), self._receive)
+
+    def _receive(self):
+        try:
+            members = self.connection.recv()
+        except EOFError:
+            logger.warning("Supervisor connection closed")
+            asyncio.get_running_loop().remove_reader(self.connection.fileno())
+            return
+        if members == self.ring.nodes:
+            return
+        logger.info(f"Worker {self.worker_id}: rebalancing from {self.ring.nodes} to {members}")
+        self.ring.rebuild(members)
+        for callback in self._callbacks:
+            asyncio.create_task(callback())
@@ -0,0 +1,107 @@
+"""Supervisor of sharded worker processes"""
+import logging
+import multiprocessing
+import os
+import signal
+import time
+from multiprocessing.connection import Connection
+from typing import Callable
+
+
+logger = logging.getLogger(os.environ.get("LOGGER"))
+
+
+class Supervisor:
+    """
+    Runs `workers` processes, each owning a consistent-hash slice of the fleet. When a worker stops,
+    the remaining ones take over its cars. It is restarted after restart_delay seconds and reclaims them.
+    Membership is pushed to every worker over a pipe.
+    """
+
+    def __init__(
+            self,
+            workers: int,
+            target: Callable[[int, list[int], Connection], None],
+            restart_delay: float = 5,
+            check_interval: float = 1
+    ):
+        self.workers = workers
+        self.target = target
+        self.restart_delay = restart_delay
+        self.check_interval = check_interval
+        self._context = multiprocessing.get_context('spawn')
+        self._processes: dict[int, multiprocessing.Process] = {}
+        self._connections: dict[int, Connection] = {}
+        self._restart_at: dict[int, float] = {}
+        self._stopping = False
+
+    @property
+    def members(self) -> list[int]:
+        return sorted(worker_id for worker_id, process in self._processes.items() if process.is_alive())
+
+    def _start(self, worker_id: int):
+        receiver, sender = self._context.Pipe(duplex=False)
+        members = sorted(set(self.members) | {worker_id})
+        process = self._context.Process(
+            target=self.target,
+            args=(worker_id, members, receiver),
+            name=f'worker-{worker_id}',
+            daemon=False
+        )
+        process.start()
+        receiver.close()
+        self._processes[worker_id] = process
+        self._connections[worker_id] = sender
+        self._restart_at.pop(worker_id, None)
+        logger.info(f"Worker {worker_id} started: pid {process.pid}")
+
+    def _broadcast(self):
+        members = self.members
+        for worker_id in members:
+            try:
+                self._connections[worker_id].send(members)
+            except (BrokenPipeError, OSError) as exc:
+                logger.warning(f"Membership was not sent to worker {worker_id}: {exc}")
+        logger.info(f"Workers: {members}")
+
+    def stop(self, *args):
+        self._stopping = True
+
+    def run(self):
+        """
+        Start workers and supervise them until SIGTERM or SIGINT
+        :return:
+        """
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for worker_id in range(self.workers):
+            self._start(worker_id)
+        self._broadcast()
+
+        while not self._stopping:
+            time.sleep(self.check_interval)
+            changed = False
+            for worker_id, process in self._processes.items():
+                if not process.is_alive() and worker_id not in self._restart_at:
+                    logger.warning(f"Worker {worker_id} stopped with code {process.exitcode}")
+                    self._restart_at[worker_id] = time.monotonic() + self.restart_delay
+                    changed = True
+            for worker_id, restart_at in list(self._restart_at.items()):
+                if time.monotonic() >= restart_at:
+                    self._start(worker_id)
+                    changed = True
+            if changed:
+                self._broadcast()
+
+        self._shutdown()
+
+    def _shutdown(self):
+        for process in self._processes.values():
+            if process.is_alive():
+                process.terminate()
+        for worker_id, process in self._processes.items():
+            process.join(timeout=30)
+            if process.is_alive():
+                logger.warning(f"Worker {worker_id} did not stop in time, killing it")
+                process.kill()
+        logger.info("All workers stopped")
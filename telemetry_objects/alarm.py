@@ -46,6 +46,35 @@ class Alarm:
             'place': self.place
         }
 
+    def key(self) -> tuple:
+        """
+        Identity of the alarm. Matches uq_alarms_identity of alarms table
+        :return: (id, car_id, date_of_creation, record_date, title)
+        """
+        return self.id, int(self.car_id), self.date_of_creation, self.record_date, self.title
+
+    @staticmethod
+    def from_model(record) -> 'Alarm':
+        """
+        Restore Alarm from UnsentAlarm record
+        :param record: UnsentAlarm
+        :return: Alarm
+        """
+        return Alarm(
+            id=record.id,
+            title=record.title,
+            message=record.message,
+            level=7 if record.level == 'CRITICAL' else 4,
+            latitude=record.lat,
+            longitude=record.lon,
+            record_date=record.record_date,
+            date_of_creation=record.date_of_creation,
+            car_id=record.car_id,
+            driver_first_name=record.driver_first_name,
+            driver_last_name=record.driver_last_name,
+            place=record.place
+        )
+
     def to_rest_object(self, device_id: DeviceId):
         return RestAlarm(
             type=self.title,
@@ -59,7 +88,7 @@ class Alarm:
             propagate=True,
             propagate_to_tenant=True,
             propagate_relation_types=['string'],
-            details={'message': self.message.replace('%ZONE%', self.place)},
+            details={'message': self.message.replace('%ZONE%', self.place or '')},
             originator=device_id,
             status='ACTIVE_UNACK'
         )
@@ -0,0 +1,41 @@
+import time
+
+
+class LastStateCache:
+    """
+    Last published telemetry values per unit. Used to publish only changed keys
+    and to suppress unchanged messages. Full message is sent at least every heartbeat_interval seconds.
+    """
+
+    def __init__(self, heartbeat_interval: float = 300):
+        self.heartbeat_interval = heartbeat_interval
+        self._states: dict[int, tuple[dict, float]] = {}
+
+    def diff(self, car_id: int, telemetry: dict) -> dict | None:
+        """
+        Reduce telemetry to the values changed since the last published message of the unit
+        :param car_id: ID of the transport
+        :param telemetry: {'ts': ..., 'values': {...}} as formed by Transport
+        :return: telemetry with changed values only, full telemetry if heartbeat is due, None if nothing changed
+        """
+        values = telemetry['values']
+        now = time.monotonic()
+        previous = self._states.get(car_id)
+        if previous is None or now - previous[1] >= self.heartbeat_interval:
+            self._states[car_id] = (dict(values), now)
+            return telemetry
+
+        last_values, full_sent_at = previous
+        changed = {key: value for key, value in values.items() if key not in last_values or last_values[key] != value}
+        self._states[car_id] = (dict(values), full_sent_at)
+        if not changed:
+            return None
+        return {'ts': telemetry['ts'], 'values': changed}
+
+    def forget(self, car_id: int):
+        """
+        Drop cached state, so the next message of the unit is sent in full
+        :param car_id: ID of the transport
+        :return:
+        """
+        self._states.pop(car_id, None)
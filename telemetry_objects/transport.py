@@ -2,7 +2,7 @@ from database.models import CarState
 
 
 class Transport:
-    def __init__(self, ts, is_sent, latitude, longitude, velocity, fuel_level, car_id, ignition, light, last_conn, name):
+    def __init__(self, ts, is_sent, latitude, longitude, velocity, fuel_level, car_id, ignition, light, last_conn, name, extra=None):
         self.ts = int(ts)
         self.is_sent = is_sent
         self.latitude = latitude
@@ -14,6 +14,8 @@ class Transport:
         self.light = light
         self.last_conn = int(last_conn)
         self.name = name
+        # Additional sensor channels. Sent as telemetry, not stored in car_states
+        self.extra = extra or {}
 
     def __repr__(self):
         return f"({self.latitude}, {self.longitude}) Velocity: {self.velocity}, Fuel(l): {self.fuel_level}"
@@ -45,6 +47,7 @@ class Transport:
             data['light'] = self.light
         if self.ignition:
             data['ignition'] = self.ignition
+        data.update(self.extra)
         return {
             'ts': int(round(self.ts * 1000)),
             'values': data
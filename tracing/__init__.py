@@ -0,0 +1,8 @@
+from .exporters import JsonLinesExporter, LoggingExporter, SpanExporter, load_exporter
+from .tracer import Span, Tracer, traced, traced_methods, tracer
+
+
+__all__ = [
+    'JsonLinesExporter', 'LoggingExporter', 'SpanExporter', 'load_exporter',
+    'Span', 'Tracer', 'traced', 'traced_methods', 'tracer'
+]
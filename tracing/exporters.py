@@ -0,0 +1,59 @@
+"""Destinations of finished spans"""
+import importlib
+import logging
+import os
+from abc import ABC, abstractmethod
+
+from serialization import dumps, dumps_str
+
+
+logger = logging.getLogger(os.environ.get("LOGGER"))
+
+
+class SpanExporter(ABC):
+    """Receives batches of finished spans from a worker thread"""
+
+    @abstractmethod
+    def export(self, spans: list[dict]):
+        pass
+
+
+class JsonLinesExporter(SpanExporter):
+    """Appends spans to a JSON-lines file. The file is rotated to <path>.1 once it exceeds max_bytes"""
+
+    def __init__(self, path: str = 'logs/traces.jsonl', max_bytes: int = 100 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+
+    def export(self, spans: list[dict]):
+        if os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+            os.replace(self.path, f'{self.path}.1')
+        with open(self.path, 'ab') as file:
+            file.write(b''.join(dumps(span) + b'\n' for span in spans))
+
+
+class LoggingExporter(SpanExporter):
+    """Writes spans to the project logger"""
+
+    def export(self, spans: list[dict]):
+        for span in spans:
+            logger.info(f"Span: {dumps_str(span)}")
+
+
+def load_exporter(name: str, path: str = 'logs/traces.jsonl') -> SpanExporter | None:
+    """
+    Get exporter by name
+    :param name: jsonl, log, none or dotted path of a SpanExporter subclass, e.g. package.module:Exporter
+    :param path: file of jsonl exporter
+    :return: None for none
+    """
+    if name == 'none':
+        return None
+    if name == 'jsonl':
+        return JsonLinesExporter(path)
+    if name == 'log':
+        return LoggingExporter()
+    module_name, _, class_name = name.partition(':')
+    if not class_name:
+        raise ValueError(f"Unknown span exporter: {name}")
+    return getattr(importlib.import_module(module_name), class_name)()
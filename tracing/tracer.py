@@ -0,0 +1,218 @@
+"""Context-propagated spans with head sampling"""
+import asyncio
+import functools
+import inspect
+import logging
+import os
+import random
+import time
+from collections import deque
+from contextvars import ContextVar
+
+from tracing.exporters import SpanExporter
+
+
+logger = logging.getLogger(os.environ.get("LOGGER"))
+
+
+class Span:
+    """Timed operation. Spans started while another one is current become its children"""
+    __slots__ = ('name', 'trace_id', 'span_id', 'parent_id', 'start', 'started', 'duration', 'attributes', 'error')
+
+    def __init__(self, name: str, trace_id: str, parent_id: str | None, attributes: dict):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = f'{random.getrandbits(64):016x}'
+        self.parent_id = parent_id
+        self.start = time.time()
+        self.started = time.perf_counter()
+        self.duration = 0.0
+        self.attributes = attributes
+        self.error: str | None = None
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def to_dict(self) -> dict:
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start': round(self.start, 6),
+            'duration_ms': round(self.duration * 1000, 3),
+            'attributes': self.attributes,
+            'error': self.error,
+        }
+
+
+class _NoopSpan:
+    """Stands for spans which are not recorded. Current span of not sampled traces"""
+    __slots__ = ()
+
+    def set_attribute(self, key: str, value):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+_current_span: ContextVar[Span | _NoopSpan | None] = ContextVar('current_span', default=None)
+
+
+class _NoopScope:
+    __slots__ = ()
+
+    def __enter__(self) -> _NoopSpan:
+        return NOOP_SPAN
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SCOPE = _NoopScope()
+
+
+class _SpanScope:
+    """Makes span current for the duration of the block and records it on exit"""
+    __slots__ = ('tracer', 'span', 'token')
+
+    def __init__(self, tracer: 'Tracer', span: Span | _NoopSpan):
+        self.tracer = tracer
+        self.span = span
+
+    def __enter__(self):
+        self.token = _current_span.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_span.reset(self.token)
+        span = self.span
+        if span is not NOOP_SPAN:
+            span.duration = time.perf_counter() - span.started
+            if exc_type is not None:
+                span.error = exc_type.__name__
+            self.tracer.record(span)
+        return False
+
+
+class Tracer:
+    """
+    Whether a trace is recorded is decided once by its root span with probability sample_rate,
+    children follow the decision. Disabled tracer costs one attribute check per span.
+    Finished spans are buffered and exported from a worker thread every flush_interval seconds.
+    """
+
+    def __init__(
+            self,
+            exporter: SpanExporter | None = None,
+            sample_rate: float = 0.0,
+            buffer_size: int = 10000,
+            flush_interval: float = 1.0
+    ):
+        self.flush_interval = flush_interval
+        self._buffer: deque[dict] = deque(maxlen=buffer_size)
+        self.configure(exporter, sample_rate)
+
+    def configure(self, exporter: SpanExporter | None, sample_rate: float):
+        """
+        Set exporter and share of recorded traces. Tracing is off without exporter or with sample_rate 0
+        :param exporter:
+        :param sample_rate: 0..1
+        :return:
+        """
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self.enabled = exporter is not None and sample_rate > 0
+
+    def span(self, name: str, child_only: bool = False, **attributes):
+        """
+        Context manager of a span. Works across awaits, the span is current for the task running the block
+        :param name: operation name, e.g. wialon.avl_poll
+        :param child_only: record only inside a recorded trace, never start one
+        :param attributes: span attributes
+        :return: span as the context value
+        """
+        if not self.enabled:
+            return _NOOP_SCOPE
+        parent = _current_span.get()
+        if parent is NOOP_SPAN:
+            return _NOOP_SCOPE
+        if parent is None:
+            if child_only:
+                return _NOOP_SCOPE
+            if random.random() >= self.sample_rate:
+                return _SpanScope(self, NOOP_SPAN)
+            return _SpanScope(self, Span(name, f'{random.getrandbits(128):032x}', None, attributes))
+        return _SpanScope(self, Span(name, parent.trace_id, parent.span_id, attributes))
+
+    def record(self, span: Span):
+        self._buffer.append(span.to_dict())
+
+    def flush(self):
+        """
+        Export buffered spans
+        :return:
+        """
+        if not self._buffer or self.exporter is None:
+            return
+        spans = []
+        while self._buffer:
+            spans.append(self._buffer.popleft())
+        try:
+            self.exporter.export(spans)
+        except Exception as exc:
+            logger.exception(f"Spans were not exported: {exc}")
+
+    async def run(self):
+        """
+        Export spans every flush_interval seconds without blocking the event loop
+        :return:
+        """
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            if self._buffer:
+                await asyncio.to_thread(self.flush)
+
+
+tracer = Tracer()
+
+
+def traced(name: str | None = None, child_only: bool = False):
+    """
+    Decorator running function in a span of the default tracer
+    :param name: span name. Qualified name of the function if None
+    :param child_only: see Tracer.span
+    :return:
+    """
+    def decorator(function):
+        span_name = name or function.__qualname__
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def wrapper(*args, **kwargs):
+                with tracer.span(span_name, child_only):
+                    return await function(*args, **kwargs)
+        else:
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with tracer.span(span_name, child_only):
+                    return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def traced_methods(cls):
+    """
+    Class decorator tracing every public method defined by the class as a child span named Class.method
+    :param cls:
+    :return:
+    """
+    for name, attribute in list(vars(cls).items()):
+        if name.startswith('_'):
+            continue
+        decorator = traced(f'{cls.__name__}.{name}', child_only=True)
+        if isinstance(attribute, staticmethod):
+            setattr(cls, name, staticmethod(decorator(attribute.__func__)))
+        elif isinstance(attribute, classmethod):
+            setattr(cls, name, classmethod(decorator(attribute.__func__)))
+        elif inspect.isfunction(attribute):
+            setattr(cls, name, decorator(attribute))
+    return cls